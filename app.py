@@ -1,17 +1,40 @@
 #pyright: basic
+import time
+import_started = time.perf_counter()
+
+import atexit
+import io
+import json
 import logging
 import os
-import requests
 import secrets
+import sys
 import traceback
-import validators
 
-from ansifier import ansify
-from flask import Flask, request, render_template, redirect, url_for, session, make_response
+from contextlib import nullcontext
+from flask import (Flask, Request, Response, request, render_template, redirect, url_for, session,
+                   make_response, jsonify, g)
 from logging.handlers import RotatingFileHandler
-
-from data_model import Database
-assert Database is not None  # for pyright...
+from types import SimpleNamespace
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from pipeline.bands import BAND_FORMATS, BandStream
+from pipeline.buffers import ImageBuffer
+from pipeline.convert import convert, preload_conversion
+from pipeline.errors import AnsifierError
+from pipeline.executor import ConversionExecutor
+from pipeline.fetcher import ImageFetcher
+from pipeline.gallery_writer import GalleryWriter
+from pipeline.delta import DEFAULT_KEYFRAME_INTERVAL, DELTA_FORMAT
+from pipeline.frames import FrameStream
+from pipeline.html_palette import compact_html
+from pipeline.jobs import JobRunner
+from pipeline.metrics import Metrics, RequestTimings, UntimedStage
+from pipeline.preflight import inspect_input, plan_decode
+from pipeline.result_cache import ResultCache, make_key
+from pipeline.scheduler import Admission, estimate_cost
+from pipeline.sgr import minimize_sgr
 
 
 FILE_EXTENSIONS = [ "blp", "bmp", "dds", "dib", "eps", "gif", "icns", "ico", "im", "jpeg", "jpg",
@@ -25,15 +48,55 @@ FILE_EXTENSIONS = [ "blp", "bmp", "dds", "dib", "eps", "gif", "icns", "ico", "im
                    ]
 FORMATTED_FILE_EXTENSIONS = ' '.join([ext if i % 10 else ext + '<br/>'
                                       for i, ext in enumerate(FILE_EXTENSIONS)])
-IMAGE_FILEPATH = 'IMAGEFILE'
 MAX_FILESIZE_MB = 5
 MAX_FILESIZE_KB = 1000 * MAX_FILESIZE_MB
 MAX_FILESIZE_B = 1000 * MAX_FILESIZE_KB
-MAX_DIM = 333
+MAX_FORM_OVERHEAD_B = 64 * 1000  # room for the other /ansify fields and multipart boundaries
+MAX_DIM = int(os.environ.get('ANSIFIER_MAX_DIM', 333))  # raise with care unless a blob store is set
 MIN_DIM = 4
+MAX_FRAMES = int(os.environ.get('ANSIFIER_MAX_FRAMES', 100))  # per response in frames mode
+JOB_EVENTS_POLL_S = 0.5
+JOB_EVENTS_KEEPALIVE_S = 15
+JOB_EVENTS_TIMEOUT_S = 600  # clients reconnect to keep following longer jobs
+JOB_WEIGHT = 0.25  # share of the workers jobs get when requests are waiting, see Admission
+
+
+class AnsifierRequest(Request):
+    """
+    parses uploaded files straight into per-request ImageBuffers, so that MAX_FILESIZE_B is enforced
+    as the body is received and uploads are never copied to a temporary file of Werkzeug's first
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        return ImageBuffer(MAX_FILESIZE_B)
+
+
 app = Flask('ansifier-cloud')
+app.request_class = AnsifierRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILESIZE_B + MAX_FORM_OVERHEAD_B  # refused before parsing
 app.secret_key = secrets.token_hex(16)
 debug = os.environ.get('ANSIFIER_DEBUG')
+cache_max_mb = float(os.environ.get('ANSIFIER_CACHE_MAX_MB', 64))
+cache_dir = os.environ.get('ANSIFIER_CACHE_DIR')  # on-disk cache tier is disabled unless set
+cache_disk_max_mb = float(os.environ.get('ANSIFIER_CACHE_DISK_MAX_MB', 512))
+convert_workers = int(os.environ.get('ANSIFIER_CONVERT_WORKERS', os.cpu_count() or 1))
+convert_queue_depth = int(os.environ.get('ANSIFIER_CONVERT_QUEUE_DEPTH', 8))
+client_cells_per_s = float(os.environ.get('ANSIFIER_CLIENT_CELLS_PER_S', 500_000))  # 0 for no limit
+client_burst_cells = float(os.environ.get('ANSIFIER_CLIENT_BURST_CELLS', 5_000_000))
+proxy_hops = int(os.environ.get('ANSIFIER_PROXY_HOPS', 1))  # Cloud Run's front end, see request_client
+fetch_cache_mb = float(os.environ.get('ANSIFIER_FETCH_CACHE_MB', 32))
+decode_budget_mb = float(os.environ.get('ANSIFIER_DECODE_BUDGET_MB', 256))  # 0 for no limit
+max_decoded_frames = int(os.environ.get('ANSIFIER_MAX_DECODED_FRAMES', 1000))  # 0 for no limit
+job_workers = int(os.environ.get('ANSIFIER_JOB_WORKERS', 1))  # threads per process, see run_job
+job_keep_hours = float(os.environ.get('ANSIFIER_JOB_KEEP_HOURS', 24))
+gallery_batch = int(os.environ.get('ANSIFIER_GALLERY_BATCH', 50))
+gallery_flush_ms = float(os.environ.get('ANSIFIER_GALLERY_FLUSH_MS', 200))  # 0 writes synchronously
+metrics_enabled = os.environ.get('ANSIFIER_METRICS')
+lazy_startup = os.environ.get('ANSIFIER_LAZY_STARTUP')  # defers the database backend to first use
+startup_seconds = {}  # how long each phase of startup took, see warmup
+if proxy_hops > 0:
+    # clients' own addresses, as the proxies in front of the app forwarded them, see request_client
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
 
 if debug:
     # Configure rotating log handler
@@ -58,11 +121,87 @@ else:
     def log_debug(message):
         pass
 
+if metrics_enabled:
+    metrics = Metrics(startup_seconds=startup_seconds)
+
+    def timed(stage):
+        """ times a stage of the current request, see pipeline/metrics.py """
+        return g.timings.stage(stage)
+else:
+    # the same shared no-op for every stage if metrics are off
+    untimed = nullcontext(UntimedStage())
+
+    def timed(stage):
+        return untimed
+
+
+result_cache = ResultCache(max_bytes=int(cache_max_mb * 1e6),
+                           disk_dir=cache_dir,
+                           disk_max_bytes=int(cache_disk_max_mb * 1e6))
+conversion_executor = ConversionExecutor(workers=convert_workers, queue_depth=convert_queue_depth,
+                                         client_rate=client_cells_per_s,
+                                         client_burst=client_burst_cells)
+image_fetcher = ImageFetcher(max_size_b=MAX_FILESIZE_B, cache_max_bytes=int(fetch_cache_mb * 1e6))
+if not lazy_startup:
+    import data_model
+    data_model.Database.init_schema()  # once per process, instead of on every Database()
+
+
+def open_database():
+    """
+    :return: a new session with the backend chosen in data_model/__init__.py;
+        in lazy startup mode, the first call imports the backend and creates its schema
+    """
+    from data_model import Database
+    return Database()
+
+
+gallery_writer = GalleryWriter(open_database, max_batch=gallery_batch,
+                               max_delay_s=gallery_flush_ms / 1000)
+atexit.register(gallery_writer.close)  # the last submissions are written on the way out
 
-class AnsifierError(Exception):
-    def __init__(self, message, http_code):
-        super().__init__(message)
-        self.http_code = http_code
+
+def warmup():
+    """
+    does ahead of time what the first requests would otherwise have to: imports the database backend
+    and creates its engine and schema, imports the url fetcher's and validator's dependencies, and
+    runs one throwaway conversion inline to import and exercise the conversion stack.
+    Meant to run once before a server forks its workers, see gunicorn.conf.py; the engine's pooled
+    connections are closed again afterwards so that no two processes share one.
+    """
+    started = time.perf_counter()
+    import data_model
+    import requests  # noqa: F401, used by the fetcher
+    import validators  # noqa: F401
+    from PIL import Image
+
+    data_model.Database.init_schema()
+    data_model.Database.remove_sessions()
+    data_model.Database.get_engine().dispose()
+    png = io.BytesIO()
+    Image.new('RGBA', (MIN_DIM, MIN_DIM), (255, 0, 0, 255)).save(png, format='PNG')
+    convert(png.getvalue(), 'ansi-escaped', '█▓▒░ ', MIN_DIM, MIN_DIM)
+    startup_seconds['warmup'] = time.perf_counter() - started
+    log_debug(f'warmed up in {startup_seconds["warmup"]:.3f}s')
+
+
+def start_conversion_workers():
+    """
+    starts the conversion worker processes now, rather than on the first conversions, and has each
+    import the conversion stack; to be run in each server worker after forking, see gunicorn.conf.py
+    """
+    started = time.perf_counter()
+    conversion_executor.prestart(preload_conversion)
+    job_runner.start()  # also picks up jobs left behind by workers that went away
+    startup_seconds['conversion_workers'] = time.perf_counter() - started
+
+
+@app.teardown_appcontext
+def remove_db_sessions(exception):
+    """ hands each request's database connection back to the pool when the request ends """
+    data_model = sys.modules.get('data_model')
+    if data_model is not None:  # in lazy startup mode, nothing to do until the backend is imported
+        data_model.Database.remove_sessions()
 
 
 @app.route('/', methods=['GET'])
@@ -76,7 +215,7 @@ def login():
     if request.method == 'GET':
         return render_template('login.html', session=session)  # TODO
     else:
-        db_session = Database()
+        db_session = open_database()
         username = request.form.get('username')
         password = request.form.get('password')
         login_success = db_session.login(username, password)
@@ -91,7 +230,7 @@ def create_account():
     if request.method == 'GET':
         return render_template('create-account.html', session=session)  # TODO
     else:
-        db_session = Database()
+        db_session = open_database()
         username = request.form.get('username')
         password = request.form.get('password')
         success, message = db_session.create_user(username, password)
@@ -115,18 +254,31 @@ def gallery():
     if no arguments are provided, loads some recent database entries
     uid arg retrieves a specific string of content from the db
     if uid is not found, returns a 404
+    feed arg lists a page of gallery entries as JSON instead, see gallery_feed
     """
     uid = request.args.get('uid')
-    db_session = Database()
+    feed = request.args.get('feed')
+    db_session = open_database()
+
+    if feed is not None:
+        return gallery_feed(db_session, feed)
 
     # TODO flesh this out
     # if a user is NOT logged in, just display some way to browse public arts
     # if a user is logged in, allow them to view either gallery with no overlap using the same
     # interface (so just add a toggle for public/private?)
     if uid is None:
-        return render_template('gallery.html', arts=db_session.most_recent_3())
+        # like most_recent_3, but html/css arts are compacted on the way out,
+        # see pipeline/html_palette.py
+        arts, _ = db_session.list_arts(limit=3)
+        return render_template('gallery.html', arts=[
+            '<br/>' + art['uid'] + ':<br/>' + compacted_art(db_session, art['uid'])
+            for art in arts])
     else:
-        art = db_session.retrieve_art(uid, session.get('username'))
+        # submissions made moments ago may not have been written yet, see pipeline/gallery_writer.py
+        art = gallery_writer.get(uid, session.get('username'))
+        if art is None:
+            art = db_session.retrieve_art_stream(uid, session.get('username'))
         if art is None:
             ret = (f'no such art {uid}', 404)
         else:
@@ -135,6 +287,56 @@ def gallery():
     return ret
 
 
+def compacted_art(db_session, uid):
+    """
+    :return: the public art at uid, compacted, see pipeline/html_palette.py;
+        an art never changes once it's stored, so it's compacted once and kept in result_cache
+    """
+    def compute():
+        art = db_session.retrieve_art(uid)
+        if art is None:
+            raise LookupError(f'no such art {uid}')
+        return compact_html(art)
+
+    try:
+        art, cache_status = result_cache.get_or_compute(make_key(uid, compacted=True), compute)
+    except LookupError:
+        return ''  # deleted since it was listed
+    log_debug(f'compacted art cache {cache_status} for {uid}')
+    return art
+
+
+def gallery_feed(db_session, feed):
+    """
+    lists one page of the public or the logged-in user's private gallery, newest first
+    args:
+        feed: "public" or "private"
+        cursor: optional, next_cursor from the previous page
+        limit: optional page size
+        include-art: "true" to include each entry's art, which is omitted by default
+    :return: JSON {"arts": [...], "next_cursor": str or null once the feed is exhausted}
+    """
+    if feed == 'public':
+        user = None
+    elif feed == 'private':
+        user = session.get('username')
+        if user is None:
+            return ('log in to view your private gallery', 401)
+    else:
+        return (f'no such feed {feed}, must be one of public, private', 400)
+
+    try:
+        limit = int(request.args.get('limit', 20))
+        arts, next_cursor = db_session.list_arts(
+            user=user,
+            cursor=request.args.get('cursor'),
+            limit=limit,
+            include_art=request.args.get('include-art') == 'true')
+    except ValueError as e:
+        return (str(e), 400)
+    return jsonify({'arts': arts, 'next_cursor': next_cursor})
+
+
 @app.route('/ansify', methods=['POST'])
 def main() -> tuple[str, int]:
     """
@@ -144,30 +346,42 @@ def main() -> tuple[str, int]:
 
     :return: (message, httpcode),
         :message: the message that resulted from processing input image
-            (which will be either an error message or the result of ansification)
-        :httpcode: the http response code for the request
+            (which will be either an error message or the result of ansification,
+            streamed frame by frame in frames mode, or the job for async=true, see submit_job)
+        :httpcode: the http response code for the request, 202 for accepted async jobs
 
     *_flow functions MUST return the message and an HTTP response code as a pair
     """
-    log_debug(f'entered main with file "{request.files}" & url "{request.form.get("url")}"')
+    if metrics_enabled:
+        g.timings = RequestTimings()
 
-    received_file = request.files['file'] if 'file' in request.files else None
-    received_url = request.form.get('url')
     message = 'Please supply a valid file or URL to ansify'
     http_response_code = 200
     headers = {}
 
     try:
-        if received_file is not None:
-            message, headers = file_flow(received_file, request)
-        elif received_url is not None:
-            message, headers = url_flow(received_url, request)
-        else:
-            http_response_code = 400
+        with timed('total'):
+            # the body is parsed here, so that uploads over the size limit end up below
+            received_file = request.files['file'] if 'file' in request.files else None
+            received_url = request.form.get('url')
+            log_debug(f'entered main with file "{received_file}" & url "{received_url}"')
+            if received_file is not None:
+                message, headers = file_flow(received_file, request)
+            elif received_url is not None:
+                message, headers = url_flow(received_url, request)
+            else:
+                http_response_code = 400
+            if http_response_code == 200 and request.form.get('async') == 'true':
+                http_response_code = 202
 
     except AnsifierError as e:
         http_response_code = e.http_code
         message = str(e)
+        headers = e.headers
+
+    except RequestEntityTooLarge:
+        http_response_code = 400
+        message = f'File must not exceed {MAX_FILESIZE_MB} MB'
 
     # TODO generate a crash UID and ask user to submit it
     except Exception as e:
@@ -178,10 +392,22 @@ def main() -> tuple[str, int]:
     finally:
         response = make_response(message, http_response_code)
         for k, v in headers.items():
-            response.headers.add(k, v)
+            response.headers[k] = v  # replacing defaults, e.x. Content-Type for async jobs
+        if metrics_enabled:
+            # stages of streamed responses that run after this point aren't reported
+            response.headers.add('Server-Timing', g.timings.server_timing())
+            metrics.observe(g.timings)
         return response
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """ stage timing histograms for this process in the Prometheus text format """
+    if not metrics_enabled:
+        return ('metrics are disabled, set ANSIFIER_METRICS to enable them', 404)
+    return (metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'})
+
+
 # main routines for processing user image inputs
 #
 #
@@ -191,8 +417,12 @@ def file_flow(received_file, request):
     :return: str, see main
     """
     log_debug(f' processing {received_file}')
-    message = save_image_werkzeug(received_file)
-    message, headers = process_imagefile(request, 'the file you uploaded')
+    with timed('save') as stage:
+        image = save_image_werkzeug(received_file)
+        stage.count(image.size)
+    with image:
+        message, headers = process_imagefile(request, 'the file you uploaded', image,
+                                             session.get('username'))
     return message, headers
 
 
@@ -202,22 +432,29 @@ def url_flow(image_url, request):
     :return: str, see main
     """
     log_debug(f' processing {image_url}')
-    message = validate_url(image_url)
-    message = download_url(image_url)
-    message = save_image_bytes(message)
-    message, headers = process_imagefile(request, image_url)
+    with timed('validate'):
+        message = validate_url(image_url)
+    with timed('download') as stage:
+        image = download_url(image_url)
+        stage.count(image.size)
+    with image:
+        message, headers = process_imagefile(request, image_url, image, session.get('username'))
     return message, headers
 
     
-def process_imagefile(request, image_url):
+def process_imagefile(request, image_url, image, user=None, progress=None):
     """
-    ansifies the data stored at IMAGE_FILEPATH; meant to be called after file has been saved there
+    ansifies the data held in a request's image buffer
     :param image_url: str, only used for logging
+    :param image: ImageBuffer, see save_image_*
+    :param user: the logged in user, if any, whose private gallery may be submitted to
+    :param progress: set when running a job, see run_job; frames are then collected into one string
+        instead of being streamed, calling progress with the number converted so far
     :return: str, see main
     """
     log_debug(f'processing downloaded copy of {image_url}')
 
-    #moderate_imagefile()
+    #moderate_imagefile(image)
 
     headers = {}
     format_raw = request.form.get('format', None)
@@ -232,47 +469,335 @@ def process_imagefile(request, image_url):
     if not characters_raw:
         characters_raw = '█▓▒░ '
 
-    characters = list(characters_raw)
-
-    width = validate_dim(request.form.get('width'))
-    height = validate_dim(request.form.get('height'))
-
-    try:
-        result = ansify(IMAGE_FILEPATH, output_format=format_raw, chars=characters,
-                        height=height, width=width)[0]
-    except ValueError as e:  #TODO this should be an IOError, probably need to update ansifier
-        raise AnsifierError(str(e) + f'; valid image formats are {FORMATTED_FILE_EXTENSIONS}',
-                            http_code=400)
+    with timed('validate'):
+        width = validate_dim(request.form.get('width'))
+        height = validate_dim(request.form.get('height'))
+
+    frames_mode = format_raw == DELTA_FORMAT or request.form.get('frames') == 'true'
+    frame_range = range(*validate_frame_range(request)) if frames_mode else range(1)
+    with timed('inspect'):
+        # also done before queueing jobs, so that inputs too large to decode are turned away up front
+        info, predecode = plan_imagefile(image, frame_range.stop, height, width)
+    # videos whose containers don't say how many frames they have are assumed to have enough
+    last = min(frame_range.stop, info.frames) if info.frames > 0 else frame_range.stop
+    frames = len(range(frame_range.start, last, frame_range.step))
+    admission = Admission(request_client(request, user),
+                          estimate_cost(image.size, width, height, frames),
+                          JOB_WEIGHT if progress is not None else 1.0)
+
+    if request.form.get('async') == 'true':
+        return submit_job(request, image, user), {'Content-Type': 'application/json'}
+
+    if frames_mode:
+        stream = stream_imagefile(request, image, format_raw, characters_raw, height, width,
+                                  predecode, admission)
+        # ansi-delta output can be stored, but then it has to be collected before responding
+        if progress is None and (format_raw != DELTA_FORMAT
+                                 or not (public_gallery_choice or private_gallery_choice)):
+            return stream, headers
+        result = collect_frames(stream, progress)
+        if format_raw != DELTA_FORMAT:
+            return result, headers  # like when streamed, only ansi-delta goes to the galleries
+    else:
+        params = dict(format=format_raw, characters=characters_raw, width=width, height=height)
+        if predecode:
+            params['predecode'] = True  # shrinking before decoding changes colors slightly
+        key = make_key(image.digest(), **params)
+        banded = request.form.get('bands') == 'true' and format_raw in BAND_FORMATS
+        # banded output is streamed, unless the whole of it is needed before responding
+        if banded and progress is None and not (public_gallery_choice or private_gallery_choice
+                                                or request.form.get('optimize') == 'true'):
+            result = result_cache.get(key)
+            if result is None:
+                headers['ansifier-cache'] = 'miss'
+                return band_imagefile(image, format_raw, characters_raw, height, width, predecode,
+                                      admission,
+                                      on_complete=lambda result: result_cache.put(key, result)), \
+                    headers
+            headers['ansifier-cache'] = 'hit'
+            return result, headers
+        if banded:
+            compute = lambda: ''.join(band_imagefile(image, format_raw, characters_raw, height,
+                                                     width, predecode, admission))
+        else:
+            compute = lambda: convert_imagefile(image, format_raw, characters_raw, height, width,
+                                                predecode, admission)
+        with timed('convert') as stage:
+            result, cache_status = result_cache.get_or_compute(key, compute)
+            stage.count_text(result)
+        headers['ansifier-cache'] = cache_status
+        log_debug(f'cache {cache_status} for {key}; {result_cache.stats()}')
+        if format_raw == 'ansi-escaped' and request.form.get('optimize') == 'true':
+            with timed('optimize'):
+                result = optimize_result(request, result, headers)
 
     # if one of either galleries is chosen, that UID will be appended;
     # if both are chose, public then private UIDs will be appended.
     # UI/client has to include mirror logic, kinda sucks to maintain...
-    if public_gallery_choice or private_gallery_choice:
-        db_session = Database()
+    # the arts themselves are written to the database shortly after, see pipeline/gallery_writer.py
     if public_gallery_choice:
-        uid = db_session.insert_art(result, format_raw)  # TODO err handling
+        with timed('store') as stage:
+            uid = gallery_writer.put(result, format_raw)
+            stage.count_text(result)
         headers['public-uid'] = uid
-    if private_gallery_choice and 'username' in session:
-        uid = db_session.insert_art(result, format_raw, session.get('username'))
+    if private_gallery_choice and user is not None:
+        with timed('store') as stage:
+            uid = gallery_writer.put(result, format_raw, user)
+            stage.count_text(result)
         headers['private-uid'] = uid
 
     return result, headers
 
 
+def collect_frames(stream, progress=None):
+    """ :return: str, every frame of a FrameStream, reporting progress after each if given """
+    frames = []
+    for frame in stream:
+        frames.append(frame)
+        if progress is not None:
+            progress(len(frames))
+    return ''.join(frames)
+
+
+def optimize_result(request, result, headers):
+    """
+    rewrites ansi-escaped output with minimal color escapes, see pipeline/sgr.py,
+    reporting how much smaller it got in the ansifier-sgr-savings header
+    :return: str, the optimized result
+    """
+    colors = request.form.get('colors')
+    if colors not in (None, '', '256'):
+        raise AnsifierError(f'colors must be 256 if given, got {colors}', http_code=400)
+    optimized = minimize_sgr(result, 256 if colors == '256' else None)
+    before, after = len(result.encode()), len(optimized.encode())
+    saved = before - after
+    headers['ansifier-sgr-savings'] = f'{saved} bytes ({100 * saved / max(before, 1):.1f}%)'
+    log_debug(f'sgr optimization shrank {before} bytes to {after}')
+    return optimized
+
+
+def stream_imagefile(request, image, format_raw, characters_raw, height, width, predecode=False,
+                     admission=None):
+    """
+    frames mode: converts a range of frames of an animated image or video, see pipeline/frames.py
+    gallery submission isn't supported in this mode, except for the ansi-delta format
+    :param predecode: see plan_imagefile
+    :param admission: Admission, see pipeline/scheduler.py
+    :return: FrameStream, which main sends as a streamed response
+    """
+    start, end, stride = validate_frame_range(request)
+    keyframe_interval = max(1, validate_frame_arg(request.form.get('keyframe-interval'),
+                                                  DEFAULT_KEYFRAME_INTERVAL))
+    log_debug(f'streaming frames {start} to {end} every {stride} frames')
+    try:
+        return FrameStream(conversion_executor, image.getvalue(), format_raw, characters_raw,
+                           height, width, start, end, stride, keyframe_interval, predecode,
+                           admission)
+    except ValueError as e:
+        raise AnsifierError(str(e) + f'; valid image formats are {FORMATTED_FILE_EXTENSIONS}',
+                            http_code=400)
+
+
+# asynchronous jobs, for conversions that would keep a connection open for too long
+#
+#
+def submit_job(request, image, user):
+    """
+    queues the conversion a request asks for, to be run by job_runner, see pipeline/jobs.py
+    the job will belong to user, if given, and nobody else will be able to see it
+    :return: str, JSON describing the job, see job_document
+    """
+    params = {k: v for k, v in request.form.items() if k not in ('async', 'url')}
+    with timed('store') as stage:
+        uid = open_database().enqueue_job(image.getvalue(), params, user,
+                                          request_client(request, user))
+        stage.count(image.size)
+    log_debug(f'queued job {uid}')
+    job_runner.start()
+    job_runner.notify()
+    return json.dumps(job_document({'uid': uid, 'status': 'queued', 'progress': 0}))
+
+
+def run_job(data, params, user, client, progress):
+    """
+    runs one job on a job_runner thread, the same way process_imagefile would have run it,
+    as the client that submitted it, see request_client
+    :return: (result, headers), see pipeline/jobs.py
+    """
+    with app.app_context():
+        if metrics_enabled:
+            g.timings = RequestTimings()
+        try:
+            with timed('job'), save_image_bytes(data) as image:
+                return process_imagefile(SimpleNamespace(form=params, remote_addr=client),
+                                         'an async job', image, user, progress)
+        except AnsifierError:
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            raise AnsifierError(str(e) if debug else 'Sorry, something went wrong', http_code=500)
+        finally:
+            if metrics_enabled:
+                metrics.observe(g.timings)
+
+
+job_runner = JobRunner(open_database, run_job, threads=job_workers,
+                       keep_s=job_keep_hours * 3600)
+
+
+def job_document(job):
+    """ :return: dict, a job's state from get_job, with the urls to follow it at """
+    uid = job['uid']
+    return {**job,
+            'status_url': f'/jobs/{uid}',
+            'events_url': f'/jobs/{uid}/events',
+            'result_url': f'/jobs/{uid}/result'}
+
+
+@app.route('/jobs/<uid>', methods=['GET'])
+def job_status(uid):
+    """ a job's status as JSON: queued, running, done, or failed, and how many frames it's done """
+    job = open_database().get_job(uid, session.get('username'))
+    if job is None:
+        return (f'no such job {uid}', 404)
+    return jsonify(job_document(job))
+
+
+@app.route('/jobs/<uid>/result', methods=['GET'])
+def job_result(uid):
+    """
+    a finished job's result, as /ansify would have sent it; the job's error and its http code if it
+    failed; or its status with a 202 if it hasn't ended yet
+    """
+    job = open_database().retrieve_job_result(uid, session.get('username'))
+    if job is None:
+        return (f'no such job {uid}', 404)
+    if job['status'] == 'done':
+        return (job['result'], 200, job['headers'])
+    if job['status'] == 'failed':
+        return (job['error'], job['error_code'])
+    del job['result'], job['headers']
+    return (jsonify(job_document(job)), 202, {'Retry-After': '1'})
+
+
+@app.route('/jobs/<uid>/events', methods=['GET'])
+def job_events(uid):
+    """
+    follows a job as Server-Sent Events: an event named after the job's status, with its state as
+    JSON (see job_status), whenever its status or progress changes, ending once it's done or failed
+    """
+    user = session.get('username')
+    job = open_database().get_job(uid, user)
+    if job is None:
+        return (f'no such job {uid}', 404)
+
+    def events(job):
+        # runs after the request has ended, so the database session is this generator's to clean up
+        db = open_database()
+        last_state = None
+        last_sent = started = time.monotonic()
+        try:
+            while True:
+                state = (job['status'], job['progress'])
+                now = time.monotonic()
+                if state != last_state:
+                    yield f'event: {job["status"]}\ndata: {json.dumps(job_document(job))}\n\n'
+                    last_state, last_sent = state, now
+                elif now - last_sent >= JOB_EVENTS_KEEPALIVE_S:
+                    yield ': keepalive\n\n'
+                    last_sent = now
+                if job['status'] in ('done', 'failed') or now - started > JOB_EVENTS_TIMEOUT_S:
+                    return
+                time.sleep(JOB_EVENTS_POLL_S)
+                db.remove_sessions()  # ends the last read's transaction, so this one sees new commits
+                job = db.get_job(uid, user)
+                if job is None:  # deleted
+                    return
+        finally:
+            db.remove_sessions()
+
+    return Response(events(job), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def band_imagefile(image, format_raw, characters_raw, height, width, predecode=False,
+                   admission=None, on_complete=None):
+    """
+    bands mode: converts the first frame in bands of rows at once, see pipeline/bands.py
+    :param predecode: see plan_imagefile
+    :param admission: Admission, see pipeline/scheduler.py
+    :return: BandStream, which main sends as a streamed response
+    """
+    try:
+        return BandStream(conversion_executor, image.getvalue(), format_raw, characters_raw,
+                          height, width, on_complete, predecode, admission)
+    except ValueError as e:
+        raise AnsifierError(str(e) + f'; valid image formats are {FORMATTED_FILE_EXTENSIONS}',
+                            http_code=400)
+
+
+def convert_imagefile(image, format_raw, characters_raw, height, width, predecode=False,
+                      admission=None):
+    """
+    runs ansify over an image buffer on the conversion executor
+    :param predecode: see plan_imagefile
+    :param admission: Admission, see pipeline/scheduler.py
+    :return: str, the first frame of output
+    """
+    try:
+        return conversion_executor.run(convert, image.getvalue(), format_raw, characters_raw,
+                                       height, width, predecode, admission=admission)
+    except ValueError as e:  #TODO this should be an IOError, probably need to update ansifier
+        raise AnsifierError(str(e) + f'; valid image formats are {FORMATTED_FILE_EXTENSIONS}',
+                            http_code=400)
+
+
+def plan_imagefile(image, frames, height, width):
+    """
+    reads what an image buffer holds from its header, without decoding it, and checks what decoding
+    it would take against ANSIFIER_DECODE_BUDGET_MB and ANSIFIER_MAX_DECODED_FRAMES,
+    see pipeline/preflight.py
+    :param frames: int, how many frames will be decoded, see plan_decode
+    :return: (InputInfo, bool), what the input is, and whether it has to be shrunk as it's decoded
+        to stay within budget, see pipeline/frames.prepare_frame
+    """
+    try:
+        info = inspect_input(image)
+    except ValueError as e:
+        raise AnsifierError(str(e) + f'; valid image formats are {FORMATTED_FILE_EXTENSIONS}',
+                            http_code=400)
+    try:
+        return info, plan_decode(info, frames, (width//2, height), int(decode_budget_mb * 1e6),
+                                 max_decoded_frames)
+    except ValueError as e:
+        raise AnsifierError(str(e), http_code=400)
+
+
+def request_client(request, user):
+    """
+    :return: str, who a request is from, so that clients get their fair share of the conversion
+        workers: its user if logged in, or else its address (jobs keep the one they were submitted
+        from, see run_job). Behind proxies, remote_addr is the address the last of the
+        ANSIFIER_PROXY_HOPS trusted proxies saw in X-Forwarded-For, rather than the proxy's own
+    """
+    if user is not None:
+        return f'user:{user}'
+    return getattr(request, 'remote_addr', None) or 'anonymous'
+
+
 '''
-def moderate_imagefile():
+def moderate_imagefile(image_buffer):
     """
-    runs the data stored at IMAGE_FILEPATH through Google's safesearch ML model,
+    runs the data stored in an ImageBuffer through Google's safesearch ML model,
     raises an exception if the image is deemed inappropriate
-    :param image_url: str, only used for logging
+    :param image_buffer: ImageBuffer, see save_image_*
     :return: None
     """
-    log_debug('moderating locally stored image file')
+    log_debug('moderating buffered image')
     image = vision.Image()
     vision_client = vision.ImageAnnotatorClient()
 
-    with open(IMAGE_FILEPATH, 'rb') as rf:
-        image.content = rf.read() # TODO reading file twice, once to moderate and once to ansify...
+    image.content = image_buffer.getvalue()
     response = vision_client.safe_search_detection(image=image)
     if response.error.message:
         raise Exception(
@@ -295,46 +820,40 @@ def moderate_imagefile():
 
 
 def save_image_werkzeug(image):
-    """ saves an image to disk from a werkzeug file object """
-    log_debug('werkzeug-saving image to file')
-    image.seek(0)
-    file_size = len(image.read())
-    log_debug(f'received {file_size} byte image to save')
-    if file_size > MAX_FILESIZE_B:
-        raise AnsifierError(f'File is ~{file_size/1e6} MB, must not exceed {MAX_FILESIZE_MB} MB',
-                            http_code=400)
-    image.seek(0)
-    image.save(IMAGE_FILEPATH)  # TODO may be reading into memory twice here
-    saved_size = os.path.getsize(IMAGE_FILEPATH)
-    log_debug(f'saved {saved_size} bytes to {IMAGE_FILEPATH}')
-    return f'Image saved to {IMAGE_FILEPATH}'
+    """
+    :param image: werkzeug.FileStorage, already parsed into an ImageBuffer (see AnsifierRequest),
+        or else streamed into a new one, enforcing MAX_FILESIZE_B as it goes
+    :return: ImageBuffer, which the caller is responsible for closing
+    """
+    if isinstance(image.stream, ImageBuffer):
+        log_debug(f'upload was parsed into {image.stream}')
+        return image.stream
+    log_debug('werkzeug-saving image to buffer')
+    image.stream.seek(0)
+    buffer = ImageBuffer.from_stream(image.stream, MAX_FILESIZE_B)
+    log_debug(f'saved {buffer.size} bytes to {buffer}')
+    return buffer
 
 
 def save_image_bytes(content):
-    log_debug(f'writing binary image data to file at {IMAGE_FILEPATH}')
-    with open(IMAGE_FILEPATH, 'wb') as wf:
-        wf.write(content)
-    return f'image saved to {IMAGE_FILEPATH}'
+    """
+    :return: ImageBuffer, which the caller is responsible for closing
+    """
+    log_debug(f'writing {len(content)} bytes of binary image data to buffer')
+    return ImageBuffer.from_bytes(content, MAX_FILESIZE_B)
 
 
 def download_url(url):
+    """
+    streams the image at url into a new per-request buffer via the shared, pooled fetcher
+    :return: ImageBuffer, which the caller is responsible for closing
+    """
     log_debug(f'downloading image from {url}')
-    s = requests.session()
-    head_raw = s.head(url)
-
-    if head_raw.status_code < 200 or head_raw.status_code > 299:
-        raise AnsifierError(f'image url returned code {head_raw.status_code}',
-                            http_code=500)
-    size = int(head_raw.headers.get('Content-Length', 0))
-    if size > MAX_FILESIZE_B:
-        raise AnsifierError(f'File must not exceed {MAX_FILESIZE_MB} MB',
-                            http_code=400)
-
-    content_raw = s.get(url, timeout=10)
-    return content_raw.content
+    return image_fetcher.fetch(url)
 
 
 def validate_url(url):
+    import validators  # deferred to keep startup fast, see warmup
     log_debug(f'validating {url}')
     if not validators.url(url):
         raise AnsifierError('valid URL must be supplied',
@@ -342,9 +861,7 @@ def validate_url(url):
     if not url.startswith('https'):
         raise AnsifierError('only HTTPS urls are allowed',
                             http_code=400)
-    if not any(map(lambda ex: url.endswith(ex), FILE_EXTENSIONS)):
-        raise AnsifierError(f'file type must be one of {FORMATTED_FILE_EXTENSIONS}',
-                            http_code=400)
+    # what the url points to is recognized by its contents once downloaded, see plan_imagefile
     return f'{url} validated'
 
 
@@ -358,5 +875,26 @@ def validate_dim(dim):
     return dim
 
 
+def validate_frame_range(request):
+    """ :return: (start, end, stride) of the frames a request asks for in frames mode """
+    start = validate_frame_arg(request.form.get('frame-start'), 0)
+    stride = max(1, validate_frame_arg(request.form.get('frame-stride'), 1))
+    end = validate_frame_arg(request.form.get('frame-end'), start + MAX_FRAMES * stride)
+    return start, min(end, start + MAX_FRAMES * stride), stride
+
+
+def validate_frame_arg(arg, default):
+    if arg is None or arg == '':
+        return default
+    try:
+        return max(0, int(arg))
+    except ValueError:
+        raise AnsifierError(f'frame arguments must be whole numbers, got {arg}', http_code=400)
+
+
+startup_seconds['import'] = time.perf_counter() - import_started
+log_debug(f'app imported in {startup_seconds["import"]:.3f}s')
+
+
 if __name__ == '__main__':
     app.run()
@@ -5,15 +5,19 @@ and MUST expose functions:
     insert_art(art)
     ...
 """
+from importlib import import_module
 from os import environ
 from .base_model import BaseDBSession
+from .blob_store import LocalBlobStore
 
-from .sqlite_model import Sqlite3DBSession
-from .gcp_mysql_model import GcpMySQLDBSession
-
+# only the selected backend's module is imported, along with whatever driver it needs
 databases = {
-        'Sqlite3': Sqlite3DBSession,
-        'Gcp': GcpMySQLDBSession
+        'Sqlite3': ('.sqlite_model', 'Sqlite3DBSession'),
+        'Gcp': ('.gcp_mysql_model', 'GcpMySQLDBSession')
+}
+
+blob_stores = {
+        'Local': LocalBlobStore
 }
 
 
@@ -21,9 +25,19 @@ database = environ.get('ANSIFIER_DATABASE', None)
 if database is None:
     raise ValueError('env var ANSIFIER_DATABASE not set')
 
-Database = databases.get(database)
-if Database is None:
+if database not in databases:
     raise ValueError(f'{database} is not a valid database name, must be one of: '
                      + ', '.join(databases.keys()))
+module_name, class_name = databases[database]
+Database = getattr(import_module(module_name, __name__), class_name)
 
 assert issubclass(Database, BaseDBSession)
+
+# large arts are only moved out of the database if a blob store is chosen
+blob_store = environ.get('ANSIFIER_BLOB_STORE', None)
+if blob_store is not None:
+    BlobStore = blob_stores.get(blob_store)
+    if BlobStore is None:
+        raise ValueError(f'{blob_store} is not a valid blob store name, must be one of: '
+                         + ', '.join(blob_stores.keys()))
+    Database.blob_store = BlobStore.from_environ()
@@ -5,24 +5,53 @@ Concrete backends/databases should be set up independently, e.x. you might stand
 with a public IP, a database, a username, and a password, then define a subclass of BaseDBSession here
 to interface with it.
 
-To interface with such a backend, inherit from BaseDBSession. In the concrete DB class's __init__,
-create a sqlalchemy Engine using sqlalchemy.create_engine and pass the engine to super().__init__,
-which initializes a Session for the lifetime of the object at self.session.
+To interface with such a backend, inherit from BaseDBSession. In the concrete DB class, override the
+create_engine classmethod to build a sqlalchemy Engine using sqlalchemy.create_engine, and have
+__init__ pass self.get_engine() to super().__init__.
+get_engine only calls create_engine once per process; every instance afterwards shares that engine,
+its connection pool, and a registry of sessions scoped to the current thread (i.e. to the current
+request), exposed at self.session. Call BaseDBSession.remove_sessions when a request is done with
+the database to return its session's connection to the pool.
 """
 
+import base64
+import codecs
+import hashlib
+import json
+import threading
 import time
 import uuid
+import zlib
 
 from abc import ABC
-from sqlalchemy import Column, Integer, String, Text, TypeDecorator, desc
+from itertools import islice
+from os import environ
+from sqlalchemy import (Column, Index, Integer, LargeBinary, String, Text, TypeDecorator, and_, desc,
+                        inspect, or_, text)
 from sqlalchemy.engine.base import Engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 from sqlalchemy.dialects import mysql
 from werkzeug.security import generate_password_hash, check_password_hash
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 MAX_USERNAME_LEN = 30
 MAX_PASSWORD_LEN = 1024 # per https://docs.python.org/3/library/hashlib.html#hashlib.scrypt
+MAX_PAGE_SIZE = 100
+MIN_SHARED_BODY_LEN = 1024  # smaller arts are stored inline; sharing them would cost more than it saves
+LOCK_CONFLICT_ERRORS = (1205, 1213)  # MySQL lock wait timeout and deadlock; the transaction can rerun
+MAX_INSERT_ATTEMPTS = 3
+ART_CODEC = environ.get('ANSIFIER_ART_CODEC', 'zlib')  # see CompressedLongText
+
+
+def _lock_conflict(e: OperationalError) -> bool:
+    """ :return: whether e is a MySQL deadlock or lock wait timeout, see LOCK_CONFLICT_ERRORS """
+    args = getattr(e.orig, 'args', ())
+    return bool(args) and args[0] in LOCK_CONFLICT_ERRORS
 
 
 # MySQL Compatibility
@@ -32,8 +61,9 @@ class LongTextUniversal(TypeDecorator):
     """
     ansi arts are really long strings - with sufficient dimensions they're big enough
     that they really ought to be stored in files and pointed to from the database.
-    However, I don't want to deal with that right now,
-    so I'm limiting the dimensions to somewhere around 300x300, which should keep output <= 1 MB.
+    When a blob store is configured, that's what AnsiArtRecord does with arts past its threshold
+    (see blob_store.py); otherwise everything lands in this column,
+    so dimensions are limited to somewhere around 300x300 by default, which should keep output <= 1 MB.
     This is small enough that it can reasonably be stored directly in the database;
     Many dialects have a single text type with variadic sizing and very high limits
     (e.x. 1 GB for PostgreSQL).
@@ -51,21 +81,104 @@ class LongTextUniversal(TypeDecorator):
         return dialect.type_descriptor(Text())
 
 
+class CompressedLongText(LongTextUniversal):
+    """
+    ansi arts repeat the same escape sequences and block characters over and over,
+    so they shrink by an order of magnitude or more when compressed.
+    Values are compressed on the way in and transparently decompressed on the way out;
+    they're still stored in a text column (base64 encoded, behind a short header naming the format
+    version and codec) so that rows written before compression was introduced stay readable as-is.
+    :param codec: "zlib", "zstd" (needs the zstandard package), or "none" to write uncompressed rows;
+        rows written with any codec can always be read back, as long as the codec is installed
+    """
+    cache_ok = True
+    MAGIC = '~ansz'
+    VERSION = '1'
+    CODECS = {'zlib': 'z', 'zstd': 's'}
+    MIN_COMPRESS_LEN = 256  # below this, the header and base64 overhead aren't worth it
+
+    def __init__(self, codec: str = 'zlib', *args, **kwargs):
+        if codec != 'none' and codec not in self.CODECS:
+            raise ValueError(f'{codec} is not a valid art codec, must be one of: none, '
+                             + ', '.join(self.CODECS.keys()))
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('the zstd art codec requires the zstandard package')
+        self.codec = codec
+        super().__init__(*args, **kwargs)
+
+    def process_bind_param(self, value, dialect):
+        if value is None or self.codec == 'none' or len(value) < self.MIN_COMPRESS_LEN:
+            return value
+        raw = value.encode('utf-8')
+        if self.codec == 'zstd':
+            compressed = zstandard.ZstdCompressor().compress(raw)  # pyright:ignore
+        else:
+            compressed = zlib.compress(raw, 9)
+        header = self.MAGIC + self.VERSION + self.CODECS[self.codec] + ':'
+        return header + base64.b64encode(compressed).decode('ascii')
+
+    def process_result_value(self, value, dialect):
+        if value is None or not value.startswith(self.MAGIC):
+            return value  # uncompressed row
+        header_len = len(self.MAGIC) + 3
+        version, codec_id = value[len(self.MAGIC)], value[len(self.MAGIC) + 1]
+        if version != self.VERSION:
+            raise ValueError(f'unknown compressed art version {version}')
+        compressed = base64.b64decode(value[header_len:])
+        if codec_id == self.CODECS['zstd']:
+            if zstandard is None:
+                raise ValueError('art was compressed with zstd, but zstandard is not installed')
+            raw = zstandard.ZstdDecompressor().decompress(compressed)
+        elif codec_id == self.CODECS['zlib']:
+            raw = zlib.decompress(compressed)
+        else:
+            raise ValueError(f'unknown compressed art codec {codec_id}')
+        return raw.decode('utf-8')
+
+
 # Table definitions/Models
 #
 # https://docs.sqlalchemy.org/en/20/orm/mapping_api.html#sqlalchemy.orm.declarative_base
 BaseRecord = declarative_base()
 
+class ArtBodyRecord(BaseRecord):
+    """
+    the content of an art, shared by every gallery entry (AnsiArtRecord) with identical content;
+    rows are keyed by the sha256 of the art, and are only ever touched through AnsiArtRecord
+    """
+    __tablename__ = 'art_bodies'
+    hash = Column(String(64), primary_key=True)
+    art = Column(CompressedLongText(ART_CODEC), nullable=False)  # empty when blob_key is set
+    blob_key = Column(String(64), nullable=True)  # see data_model/blob_store.py
+    size = Column(Integer(), nullable=False)  # of the art in bytes, utf-8 encoded
+
+    def __repr__(self):
+        return f'ArtBodyRecord(hash={self.hash}, size={self.size}, blob_key={self.blob_key})'
+
+
 class AnsiArtRecord(BaseRecord):
     __tablename__ = 'art'
+    __table_args__ = (
+        # serves both gallery feeds (user IS NULL for public, user = ? for private),
+        # ordered newest first with uid breaking timestamp ties; see list_arts
+        Index('ix_art_user_timestamp_uid', 'user', 'timestamp', 'uid'),
+        Index('ix_art_blob_key', 'blob_key'),
+        Index('ix_art_body_hash', 'body_hash'),
+    )
     uid = Column(String(37), primary_key=True)
-    art = Column(LongTextUniversal(), nullable=False)
+    # the art itself lives in exactly one of art, blob_key, or the body named by body_hash;
+    # new rows use art for tiny arts and body_hash otherwise, blob_key only exists for older rows
+    art = Column(CompressedLongText(ART_CODEC), nullable=False)
     format = Column(String(64), nullable=False)
     timestamp = Column(Integer(), nullable=False)
     user = Column(String(MAX_USERNAME_LEN), nullable=True)
+    blob_key = Column(String(64), nullable=True)  # see data_model/blob_store.py
+    size = Column(Integer(), nullable=True)  # of the art in bytes, utf-8 encoded
+    body_hash = Column(String(64), nullable=True)  # see ArtBodyRecord
 
-    def __init__(self, session=None, *args, **kwargs):
+    def __init__(self, session=None, blob_store=None, *args, **kwargs):
         self.session = session
+        self.blob_store = blob_store
         super().__init__(*args, **kwargs)
 
     def __repr__(self):
@@ -75,42 +188,268 @@ class AnsiArtRecord(BaseRecord):
     def insert_art(self, art: str, format: str, user=None) -> str:
         """
         add a row to the database, one piece of ansi art
+        identical arts share one ArtBodyRecord, which is only written the first time its art is seen;
+        arts past the blob store's threshold are written to the store, leaving a pointer in the body
         """
-        timestamp = time.time()
-        uid = BaseDBSession.get_uuid()
-        self.session.add(AnsiArtRecord(
-            uid=uid,
-            timestamp=timestamp,
-            art=art,
-            format=format,
-            user=user))
-        self.session.commit()
-        return uid
+        return self.insert_arts([{'art': art, 'format': format, 'user': user}])[0]
+
+    def insert_arts(self, arts, batch_size=500, skip_existing=False) -> list[str]:
+        """
+        add rows to the database in transactions of up to batch_size rows each, see insert_art
+        :param arts: dicts with the art and format of each row, and optionally its user,
+            and the uid and timestamp to give it (by default a new uid and the current time);
+            consumed one batch at a time, so it may be a generator
+        :param skip_existing: leave out rows whose uid is already taken instead of failing,
+            e.x. to resume an interrupted import
+        :return: the uids of the rows inserted, in order
+        """
+        uids = []
+        arts = iter(arts)
+        while batch := list(islice(arts, batch_size)):
+            uids += self._insert_art_batch(batch, skip_existing)
+        return uids
+
+    def _insert_art_batch(self, arts: list, skip_existing: bool) -> list[str]:
+        if skip_existing:
+            given = [entry['uid'] for entry in arts if entry.get('uid')]
+            existing = {uid for uid, in self.session.query(AnsiArtRecord.uid).filter(
+                AnsiArtRecord.uid.in_(given))} if given else set()
+            arts = [entry for entry in arts if entry.get('uid') not in existing]
+        now = time.time()
+        rows = []
+        bodies = {}  # hash: (art, data) of the bodies the rows need
+        for entry in arts:
+            art = entry['art']
+            data = art.encode('utf-8')
+            row = AnsiArtRecord(
+                uid=entry.get('uid') or BaseDBSession.get_uuid(),
+                timestamp=entry.get('timestamp', now),
+                art=art,
+                format=entry['format'],
+                user=entry.get('user'),
+                size=len(data))
+            if len(data) >= MIN_SHARED_BODY_LEN:
+                row.art = ''
+                row.body_hash = hashlib.sha256(data).hexdigest()
+                bodies.setdefault(row.body_hash, (art, data))
+            rows.append(row)
+
+        for attempt in range(MAX_INSERT_ATTEMPTS):
+            try:
+                existing = set()
+                if bodies:
+                    # locked until the rows referring to them are committed, see delete_art
+                    existing = {body_hash for body_hash, in self.session.query(
+                        ArtBodyRecord.hash).filter(ArtBodyRecord.hash.in_(list(bodies)))
+                        .with_for_update()}
+                for body_hash, (art, data) in bodies.items():
+                    if body_hash not in existing:
+                        self.session.add(self._new_body(body_hash, art, data))
+                self.session.add_all(rows)
+                self.session.commit()
+                break
+            except (IntegrityError, OperationalError) as e:
+                # someone else inserted one of the same bodies first, theirs will do; or, on MySQL,
+                # locking bodies that don't exist yet takes gap locks, which two inserts of the same
+                # new body can deadlock on, and the one that's rolled back has to run again
+                self.session.rollback()
+                if attempt == MAX_INSERT_ATTEMPTS - 1 or not (
+                        isinstance(e, IntegrityError) or _lock_conflict(e)):
+                    raise
+        return [row.uid for row in rows]
+
+    def _new_body(self, body_hash: str, art: str, data: bytes) -> ArtBodyRecord:
+        blob_key = None
+        if self.blob_store is not None and len(data) >= self.blob_store.threshold_b:
+            blob_key = self.blob_store.put(data)
+            art = ''
+        return ArtBodyRecord(hash=body_hash, art=art, blob_key=blob_key, size=len(data))
+
+    def _query_with_body(self, *columns):
+        """ art rows outer joined with their body, if they have one """
+        return self.session.query(*columns).outerjoin(
+            ArtBodyRecord, AnsiArtRecord.body_hash == ArtBodyRecord.hash)
+
+    @staticmethod
+    def _art_columns():
+        """ the columns of a row and of its body that _resolve_art needs to find its art """
+        return [AnsiArtRecord.art, AnsiArtRecord.blob_key, AnsiArtRecord.body_hash,
+                ArtBodyRecord.art.label('body_art'), ArtBodyRecord.blob_key.label('body_blob_key')]
+
+    def _resolve_art(self, art: dict) -> dict:
+        """ replaces the _art_columns of a row's dict with the art itself, wherever it's kept """
+        blob_key, body_hash = art.pop('blob_key'), art.pop('body_hash')
+        body_art, body_blob_key = art.pop('body_art'), art.pop('body_blob_key')
+        if body_hash is not None and body_art is None:  # a body's art is never NULL
+            raise self._missing_body(art['uid'], body_hash)
+        if body_art is not None:
+            art['art'], blob_key = body_art, body_blob_key
+        if blob_key is not None:
+            art['art'] = self._get_blob_store().read(blob_key).decode('utf-8')
+        return art
 
     def retrieve_art(self, uid: str, user=None) -> str:
         """
         read the art out of the given uid
         returns the empty string on failed queries
         """
-        query = self.session.query(AnsiArtRecord).filter_by(uid=uid)
+        query = self._query_with_body(AnsiArtRecord, ArtBodyRecord).filter(AnsiArtRecord.uid == uid)
+        ret = query.first()
+        if ret is None or (ret[0].user is not None and user != ret[0].user):
+            return None
+        art, blob_key = self._art_source(*ret)
+        if blob_key is not None:
+            return self._get_blob_store().read(blob_key).decode('utf-8')
+        return art  # return other columns too?
+
+    def retrieve_art_stream(self, uid: str, user=None, chunk_size=64 * 1024):
+        """
+        like retrieve_art, but returns an iterator over chunks of the art (or None),
+        so that arts kept in the blob store can be sent on without reading them into memory whole
+        """
+        query = self._query_with_body(AnsiArtRecord, ArtBodyRecord).filter(AnsiArtRecord.uid == uid)
         ret = query.first()
-        if ret is None or (ret.user is not None and user != ret.user):
+        if ret is None or (ret[0].user is not None and user != ret[0].user):
             return None
-        return ret.art  # return other columns too?
+        art, blob_key = self._art_source(*ret)
+        if blob_key is None:
+            return iter([art])
+        return self._stream_blob(blob_key, chunk_size)
+
+    @staticmethod
+    def _art_source(record, body):
+        """ :return: (art, blob_key) for a row and its body; art is only meaningful without blob_key """
+        if body is not None:
+            return body.art, body.blob_key
+        if record.body_hash is not None:
+            raise AnsiArtRecord._missing_body(record.uid, record.body_hash)
+        return record.art, record.blob_key
+
+    @staticmethod
+    def _missing_body(uid: str, body_hash: str) -> LookupError:
+        return LookupError(f'art {uid} refers to body {body_hash}, which does not exist')
+
+    def _stream_blob(self, blob_key: str, chunk_size: int):
+        decoder = codecs.getincrementaldecoder('utf-8')()  # chunks may split multibyte characters
+        with self._get_blob_store().open(blob_key) as rf:
+            chunk = rf.read(chunk_size)
+            while chunk:
+                yield decoder.decode(chunk)
+                chunk = rf.read(chunk_size)
+        yield decoder.decode(b'', final=True)
+
+    def _get_blob_store(self):
+        if self.blob_store is None:
+            raise ValueError('art is kept in a blob store, but no blob store is configured')
+        return self.blob_store
 
     def delete_art(self, uid: str) -> None:
+        """
+        removes one gallery entry; its body, and the body's blob, are released once no other entry
+        refers to them
+        """
         query = self.session.query(AnsiArtRecord).filter_by(uid=uid)
+        ret = query.first()
         query.delete()
+        blob_key = ret.blob_key if ret is not None else None
+        if ret is not None and ret.body_hash is not None:
+            # the body is locked before its references are counted, and inserts lock the bodies
+            # they reuse, so that a body can't be deleted while a new entry comes to refer to it;
+            # the count is a locking read too, so that it sees entries committed while waiting
+            body = self.session.query(ArtBodyRecord).filter_by(
+                hash=ret.body_hash).with_for_update().first()
+            referenced = self.session.query(AnsiArtRecord.uid).filter_by(
+                body_hash=ret.body_hash).with_for_update().first() is not None
+            if body is not None and not referenced:
+                blob_key = body.blob_key
+                self.session.delete(body)
         self.session.commit()
+        if blob_key is not None:
+            # blobs are content addressed, so older rows and bodies may point at the same one
+            references = self.session.query(AnsiArtRecord).filter_by(blob_key=blob_key).count()
+            references += self.session.query(ArtBodyRecord).filter_by(blob_key=blob_key).count()
+            if references == 0:
+                self._get_blob_store().delete(blob_key)
 
     def most_recent_3(self, user=None) -> str:
         """
         read the most recent 3 gallery submissions and return them as a list
         """
-        query = self.session.query(AnsiArtRecord).filter_by(user=user)
-        query = query.order_by(desc(AnsiArtRecord.timestamp)).limit(3)
-        ret = query.all()
-        return ['<br/>' + record.uid + ':<br/>' + record.art for record in ret]
+        arts, _ = self.list_arts(user=user, limit=3, include_art=True)
+        return ['<br/>' + art['uid'] + ':<br/>' + art['art'] for art in arts]
+
+    def list_arts(self, user=None, cursor=None, limit=20, include_art=False):
+        """
+        read one page of a gallery feed, newest first
+        pages are keyed on (timestamp, uid) rather than offsets, so each page is an index range scan
+        no matter how deep into the feed it is
+        :param user: whose private gallery to list; None lists the public gallery
+        :param cursor: next_cursor from the previous page, or None for the first page;
+            raises a ValueError if it is malformed
+        :param limit: page size, capped at MAX_PAGE_SIZE
+        :param include_art: whether to load the art itself, which is by far the largest column
+        :return: (list of dicts of column values, next_cursor or None if this is the last page)
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        columns = [AnsiArtRecord.uid, AnsiArtRecord.format, AnsiArtRecord.timestamp,
+                   AnsiArtRecord.user, AnsiArtRecord.size]
+        if include_art:
+            query = self._query_with_body(*columns, *self._art_columns())
+        else:
+            query = self.session.query(*columns)
+        query = query.filter(AnsiArtRecord.user.is_(None) if user is None
+                             else AnsiArtRecord.user == user)
+        if cursor is not None:
+            timestamp, uid = AnsiArtRecord.decode_cursor(cursor)
+            query = query.filter(or_(
+                AnsiArtRecord.timestamp < timestamp,
+                and_(AnsiArtRecord.timestamp == timestamp, AnsiArtRecord.uid < uid)))
+        query = query.order_by(desc(AnsiArtRecord.timestamp), desc(AnsiArtRecord.uid))
+        rows = query.limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = AnsiArtRecord.encode_cursor(rows[-1].timestamp, rows[-1].uid)
+        arts = [row._asdict() for row in rows]
+        if include_art:
+            arts = [self._resolve_art(art) for art in arts]
+        return arts, next_cursor
+
+    def iter_arts(self, chunk_size=100, after=None):
+        """
+        iterates over every gallery entry, public and private, art included, reading chunk_size rows
+        at a time so that memory use stays the same however large the table is.
+        Rows come in uid order, so each chunk is a range scan of the primary key, and an interrupted
+        iteration can be picked up again by passing the last uid it reached as after.
+        :return: generator of dicts like list_arts's with include_art
+        """
+        columns = [AnsiArtRecord.uid, AnsiArtRecord.format, AnsiArtRecord.timestamp,
+                   AnsiArtRecord.user, AnsiArtRecord.size, *self._art_columns()]
+        while True:
+            query = self._query_with_body(*columns)
+            if after is not None:
+                query = query.filter(AnsiArtRecord.uid > after)
+            rows = query.order_by(AnsiArtRecord.uid).limit(chunk_size).all()
+            for row in rows:
+                yield self._resolve_art(row._asdict())  # blobs are only read one at a time
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1].uid
+
+    @staticmethod
+    def encode_cursor(timestamp, uid: str) -> str:
+        return base64.urlsafe_b64encode(json.dumps([timestamp, uid]).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        try:
+            timestamp, uid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(timestamp, (int, float)) or not isinstance(uid, str):
+                raise ValueError
+        except Exception:
+            raise ValueError(f'invalid gallery cursor {cursor}')
+        return timestamp, uid
 
 
 class UserRecord(BaseRecord):
@@ -165,39 +504,289 @@ class UserRecord(BaseRecord):
         pass  # TODO
 
 
+class JobRecord(BaseRecord):
+    """
+    a queue of asynchronous /ansify requests, worked through by pipeline/jobs.py.
+    A job is claimed by a worker for a lease, which the worker renews whenever it reports progress;
+    jobs whose worker went away without finishing are claimed again once their lease runs out.
+    The input is dropped once a job ends, the result is kept until the job is deleted.
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_created', 'status', 'created'),
+    )
+    uid = Column(String(37), primary_key=True)
+    status = Column(String(16), nullable=False)  # queued, running, done, or failed
+    user = Column(String(MAX_USERNAME_LEN), nullable=True)  # only they may see the job, if set
+    client = Column(String(128), nullable=True)  # who submitted it, for its share of the workers
+    created = Column(Integer(), nullable=False)
+    updated = Column(Integer(), nullable=False)
+    params = Column(Text(), nullable=False)  # JSON of the /ansify form
+    input = Column(LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'), nullable=True)
+    worker = Column(String(128), nullable=True)  # holder of the current claim
+    attempts = Column(Integer(), nullable=False, default=0)
+    progress = Column(Integer(), nullable=False, default=0)  # frames converted so far
+    result = Column(CompressedLongText(ART_CODEC), nullable=True)
+    headers = Column(Text(), nullable=True)  # JSON of the response headers the result came with
+    error = Column(Text(), nullable=True)
+    error_code = Column(Integer(), nullable=True)
+
+    def __init__(self, session=None, *args, **kwargs):
+        self.session = session
+        super().__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return f'JobRecord(uid={self.uid}, status={self.status}, user={self.user})'
+
+    def enqueue_job(self, data: bytes, params: dict, user=None, client=None) -> str:
+        """
+        :param client: who submitted the job, e.x. their address, see pipeline/scheduler.py
+        :return: the uid of a new queued job converting data as the /ansify form params say
+        """
+        uid = BaseDBSession.get_uuid()
+        timestamp = time.time()
+        self.session.add(JobRecord(
+            uid=uid,
+            status='queued',
+            user=user,
+            client=client,
+            created=timestamp,
+            updated=timestamp,
+            params=json.dumps(params),
+            input=data,
+            attempts=0,
+            progress=0))
+        self.session.commit()
+        return uid
+
+    def claim_job(self, worker: str, lease_s: float):
+        """
+        claims the oldest queued job, or the oldest running job whose lease ran out, for worker.
+        Claims are a conditional update, so two workers racing for a job can't both get it.
+        :return: dict of the job's uid, input, params, user, client, and attempts (including this
+            one), or None if there's nothing to do
+        """
+        for _ in range(3):  # only lost races retry
+            now = time.time()
+            claimable = or_(JobRecord.status == 'queued',
+                            and_(JobRecord.status == 'running', JobRecord.updated < now - lease_s))
+            uid = self.session.query(JobRecord.uid).filter(claimable).order_by(
+                JobRecord.created).limit(1).scalar()
+            if uid is None:
+                self.session.commit()
+                return None
+            claimed = self.session.query(JobRecord).filter(JobRecord.uid == uid, claimable).update(
+                {JobRecord.status: 'running', JobRecord.worker: worker, JobRecord.updated: now,
+                 JobRecord.attempts: JobRecord.attempts + 1},
+                synchronize_session=False)
+            self.session.commit()
+            if claimed:
+                row = self.session.query(JobRecord.uid, JobRecord.input, JobRecord.params,
+                                         JobRecord.user, JobRecord.client,
+                                         JobRecord.attempts).filter(
+                    JobRecord.uid == uid).first()
+                job = row._asdict()
+                job['params'] = json.loads(job['params'])
+                return job
+        return None
+
+    def update_job(self, uid: str, worker: str, progress: int) -> bool:
+        """ records progress and renews worker's lease; :return: whether worker still holds it """
+        return self._update_claimed_job(uid, worker, {'progress': progress})
+
+    def requeue_job(self, uid: str, worker: str) -> bool:
+        """ gives a claimed job back to the queue without counting it as an attempt """
+        return self._update_claimed_job(uid, worker, {'status': 'queued', 'worker': None,
+                                                      'attempts': JobRecord.attempts - 1})
+
+    def finish_job(self, uid: str, worker: str, result: str, headers: dict) -> bool:
+        return self._update_claimed_job(uid, worker, {'status': 'done', 'result': result,
+                                                      'headers': json.dumps(headers), 'input': None})
+
+    def fail_job(self, uid: str, worker: str, error: str, error_code: int) -> bool:
+        return self._update_claimed_job(uid, worker, {'status': 'failed', 'error': error,
+                                                      'error_code': error_code, 'input': None})
+
+    def _update_claimed_job(self, uid: str, worker: str, values: dict) -> bool:
+        values['updated'] = time.time()
+        updated = self.session.query(JobRecord).filter(
+            JobRecord.uid == uid, JobRecord.worker == worker, JobRecord.status == 'running').update(
+            {getattr(JobRecord, name): value for name, value in values.items()},
+            synchronize_session=False)
+        self.session.commit()
+        return updated != 0
+
+    def get_job(self, uid: str, user=None):
+        """
+        :return: dict of a job's uid, status, progress, error, error_code, created, and updated,
+            or None if there's no such job or it belongs to someone other than user
+        """
+        return self._job_columns(uid, user)
+
+    def retrieve_job_result(self, uid: str, user=None):
+        """ like get_job, plus the job's result and headers, which are None until it's done """
+        job = self._job_columns(uid, user, JobRecord.result, JobRecord.headers)
+        if job is not None and job['headers'] is not None:
+            job['headers'] = json.loads(job['headers'])
+        return job
+
+    def _job_columns(self, uid: str, user, *extra_columns):
+        # selecting columns rather than records means every call reads the current row
+        row = self.session.query(
+            JobRecord.uid, JobRecord.status, JobRecord.progress, JobRecord.error,
+            JobRecord.error_code, JobRecord.created, JobRecord.updated, JobRecord.user,
+            *extra_columns).filter(JobRecord.uid == uid).first()
+        if row is None or (row.user is not None and user != row.user):
+            return None
+        job = row._asdict()
+        del job['user']
+        return job
+
+    def delete_jobs_before(self, timestamp: float) -> int:
+        """ deletes jobs that ended before timestamp; :return: how many """
+        deleted = self.session.query(JobRecord).filter(
+            JobRecord.status.in_(('done', 'failed')), JobRecord.updated < timestamp).delete(
+            synchronize_session=False)
+        self.session.commit()
+        return deleted
+
+
 # Database Session handler
 #
 #
+class _SessionRegistry:
+    """
+    everything BaseDBSession instances bound to the same engine can share;
+    built once per engine, which is also when the schema gets created
+    """
+    def __init__(self, engine: Engine, blob_store=None):
+        BaseRecord.metadata.create_all(engine)
+        # create_all skips tables that already exist,
+        # so columns and indexes added to existing tables need this
+        self._add_missing_columns(engine)
+        for table in BaseRecord.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        self.session = scoped_session(sessionmaker(bind=engine))
+        self.records = [
+            AnsiArtRecord(self.session, blob_store),
+            UserRecord(self.session),
+            JobRecord(self.session)
+        ]
+        self.methods = []
+        for Record in self.records:
+            for name in dir(Record):
+                if name.startswith('_'):
+                    continue
+                attr = getattr(Record, name)
+                if callable(attr):
+                    self.methods.append((name, attr))
+
+    @staticmethod
+    def _add_missing_columns(engine: Engine) -> None:
+        """ only handles nullable columns, which existing rows can simply leave empty """
+        inspector = inspect(engine)
+        quote = engine.dialect.identifier_preparer.quote
+        for table in BaseRecord.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise ValueError(f'cannot add non-nullable column {column.name} to {table.name}')
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as con:
+                    con.execute(text(f'ALTER TABLE {quote(table.name)} '
+                                     f'ADD COLUMN {quote(column.name)} {column_type}'))
+
+
 class BaseDBSession(ABC):
     """
     Exposes database query routines
     TODO separate concerns of session management vs query logic without breaking interface
     """
-    def __init__(self, engine: Engine):
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
+    _engines = {}  # concrete BaseDBSession subclass -> its one Engine for this process
+    _registries = {}  # Engine -> _SessionRegistry
+    _lock = threading.Lock()
+    blob_store = None  # see data_model/blob_store.py; configured in data_model/__init__.py
 
-        BaseRecord.metadata.create_all(engine)
-        self._records = [
-            AnsiArtRecord(self.session),
-            UserRecord(self.session)
-        ]
-        self._register_record_methods()
+    def __init__(self, engine: Engine):
+        registry = self._registry_for(engine, self.blob_store)
+        self.session = registry.session
+        self._records = registry.records
+        self._register_record_methods(registry.methods)
 
 
-    def _register_record_methods(self):
+    def _register_record_methods(self, methods):
         """
         this makes sense to do at runtime right now, because it's easier to maintain self._records
         than it is to manually maintain a set of wrapper functions, but it may hurt observability
         or confuse development tooling, LSP, typecheckers
+        the reflection itself happens once per engine in _SessionRegistry; this just binds the results
         """
-        for Record in self._records:
-            for name in dir(Record):
-                if name.startswith('_'):
-                    continue
-                attr = getattr(Record, name)
-                if callable(attr) and not hasattr(self, name):
-                    setattr(self, name, attr)  # TODO does this hurt debugability? functools.wrap?
+        for name, attr in methods:
+            if not hasattr(self, name):
+                setattr(self, name, attr)  # TODO does this hurt debugability? functools.wrap?
+
+
+    @classmethod
+    def create_engine(cls) -> Engine:
+        """ concrete backends override this to build their engine; see get_engine """
+        raise NotImplementedError(f'{cls.__name__} does not define create_engine')
+
+
+    @classmethod
+    def get_engine(cls) -> Engine:
+        """ :return: this backend's engine, creating it on the first call in this process """
+        with BaseDBSession._lock:
+            engine = BaseDBSession._engines.get(cls)
+            if engine is None:
+                engine = BaseDBSession._engines[cls] = cls.create_engine()
+        return engine
+
+
+    @classmethod
+    def init_schema(cls) -> None:
+        """
+        creates the engine, tables, and session registry up front,
+        so that the first request doesn't have to
+        """
+        cls._registry_for(cls.get_engine(), cls.blob_store)
+
+
+    @staticmethod
+    def _registry_for(engine: Engine, blob_store=None) -> _SessionRegistry:
+        with BaseDBSession._lock:
+            registry = BaseDBSession._registries.get(engine)
+            if registry is None:
+                registry = BaseDBSession._registries[engine] = _SessionRegistry(engine, blob_store)
+        return registry
+
+
+    @staticmethod
+    def remove_sessions() -> None:
+        """ closes the current thread's sessions, returning their connections to the pool """
+        with BaseDBSession._lock:
+            registries = list(BaseDBSession._registries.values())
+        for registry in registries:
+            registry.session.remove()
+
+
+    @staticmethod
+    def engine_pool_options() -> dict:
+        """
+        connection pool tuning shared by networked backends, read from the environment:
+            ANSIFIER_DB_POOL_SIZE: connections kept open per process (default 5)
+            ANSIFIER_DB_MAX_OVERFLOW: extra connections allowed under load (default 10)
+            ANSIFIER_DB_POOL_PRE_PING: whether to test connections before use (default true)
+            ANSIFIER_DB_POOL_RECYCLE: seconds before a connection is replaced (default 1800)
+        """
+        return {
+            'pool_size': int(environ.get('ANSIFIER_DB_POOL_SIZE', 5)),
+            'max_overflow': int(environ.get('ANSIFIER_DB_MAX_OVERFLOW', 10)),
+            'pool_pre_ping': environ.get('ANSIFIER_DB_POOL_PRE_PING', 'true').lower() == 'true',
+            'pool_recycle': int(environ.get('ANSIFIER_DB_POOL_RECYCLE', 1800)),
+        }
 
 
     @staticmethod
@@ -0,0 +1,107 @@
+"""
+Storage for art that is too large to keep in the database comfortably.
+
+Arts at or above a blob store's threshold_b are written to the store by AnsiArtRecord.insert_art,
+and their row in the art table keeps only a pointer (blob_key) and metadata.
+Blobs are content addressed - a blob's key is the sha256 of its bytes - so identical arts share one
+blob, and writing a blob that already exists is a no-op.
+
+To add a new kind of store, inherit from BaseBlobStore, implement put/open/delete/exists and
+from_environ, and add it to the blob_stores map in data_model/__init__.py.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from abc import ABC, abstractmethod
+from typing import BinaryIO
+
+
+class BaseBlobStore(ABC):
+    def __init__(self, threshold_b: int):
+        self.threshold_b = threshold_b
+
+    @classmethod
+    @abstractmethod
+    def from_environ(cls):
+        """ builds the store from env vars """
+        pass
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """ stores data if it isn't stored already, returning its key """
+        pass
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """ :return: a readable binary file object over the blob; the caller must close it """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    def read(self, key: str) -> bytes:
+        with self.open(key) as rf:
+            return rf.read()
+
+    @staticmethod
+    def key_for(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore(BaseBlobStore):
+    """
+    keeps blobs on the local filesystem under root, fanned out by key prefix
+    (root/ab/cd/abcd...) so no one directory grows too large
+    env vars:
+        ANSIFIER_BLOB_DIR: root directory (default ./blobs)
+        ANSIFIER_BLOB_THRESHOLD_KB: arts at least this large go to the store (default 256)
+    """
+    def __init__(self, root: str, threshold_b: int):
+        super().__init__(threshold_b)
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def __repr__(self):
+        return f'LocalBlobStore(root={self.root}, threshold_b={self.threshold_b})'
+
+    @classmethod
+    def from_environ(cls):
+        return cls(os.environ.get('ANSIFIER_BLOB_DIR', 'blobs'),
+                   int(float(os.environ.get('ANSIFIER_BLOB_THRESHOLD_KB', 256)) * 1000))
+
+    def _path(self, key: str) -> str:
+        if len(key) < 4 or not all(c in '0123456789abcdef' for c in key):
+            raise ValueError(f'invalid blob key {key}')
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data: bytes) -> str:
+        key = self.key_for(data)
+        path = self._path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as wf:
+            wf.write(data)
+        os.replace(tmp_path, path)
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), 'rb')
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
@@ -9,6 +9,10 @@ class GcpMySQLDBSession(BaseDBSession):
     Interfaces with GCP MySQL cloud db according to the env vars below
     """
     def __init__(self):
+        super().__init__(self.get_engine())  # opens self.session for queries
+
+    @classmethod
+    def create_engine(cls):
         db_env = environ.get("DB_ENV")  # "prod" or "test"
         db_host = environ.get("INSTANCE_HOST")  # an IP address
         db_user = environ.get("DB_USER")  # e.g. 'my-db-user'
@@ -40,7 +44,6 @@ class GcpMySQLDBSession(BaseDBSession):
             port=db_port,
             database=db_name)
         print(f'logging into {db_host} port {db_port} db {db_name} with username {db_user}')
-        engine = sqlalchemy.create_engine(url, connect_args=ssl_args)
+        engine = sqlalchemy.create_engine(url, connect_args=ssl_args, **cls.engine_pool_options())
         print(f'engine {engine}')
-
-        super().__init__(engine)  # opens self.session for queries
+        return engine
@@ -8,5 +8,8 @@ DB_NAME = 'test.db'
 
 class Sqlite3DBSession(BaseDBSession):
     def __init__(self):
-        engine = sqlalchemy.create_engine(f'sqlite:///{DB_NAME}')
-        super().__init__(engine)
+        super().__init__(self.get_engine())
+
+    @classmethod
+    def create_engine(cls):
+        return sqlalchemy.create_engine(f'sqlite:///{DB_NAME}', **cls.engine_pool_options())
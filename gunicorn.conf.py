@@ -0,0 +1,40 @@
+"""
+gunicorn settings for production, see `make prod`
+
+The app is imported once in the arbiter, which warms it up (see warmup in app.py) before forking, so
+every worker starts with the database engine, the schema, and the conversion stack already loaded.
+Each worker then starts its own conversion worker processes and async job runners before it accepts
+requests.
+
+Workers are threaded: a client following a job over /job/<id>/events holds its request open for up
+to JOB_EVENTS_TIMEOUT_S (see app.py), which would take a whole sync worker off other requests for
+that long and get it killed for missing its timeout. Threaded workers heartbeat from their main
+thread whatever their requests are doing, and timeout is kept past that lifetime regardless.
+"""
+import os
+
+bind = os.environ.get('ANSIFIER_BIND', '0.0.0.0:443')
+workers = int(os.environ.get('ANSIFIER_WEB_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('ANSIFIER_WEB_THREADS', 16))
+timeout = 630  # longer than app.JOB_EVENTS_TIMEOUT_S
+preload_app = True
+
+
+def when_ready(server):
+    import app
+    app.warmup()
+    server.log.info(f'app imported in {app.startup_seconds["import"]:.3f}s, '
+                    f'warmed up in {app.startup_seconds["warmup"]:.3f}s')
+
+
+def post_worker_init(worker):
+    import app
+    app.start_conversion_workers()
+    worker.log.info(f'worker {worker.pid} started its conversion workers in '
+                    f'{app.startup_seconds["conversion_workers"]:.3f}s')
+
+
+def worker_exit(server, worker):
+    import app
+    app.gallery_writer.close()  # writes gallery submissions still waiting to be batched
@@ -0,0 +1,7 @@
+"""
+Building blocks for the /ansify request pipeline that are independent of Flask routing;
+app.py wires these together.
+
+Modules in this package MUST NOT import app.py, since app.py imports them.
+Errors meant for the client are raised as errors.AnsifierError, which main() turns into a response.
+"""
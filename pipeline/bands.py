@@ -0,0 +1,112 @@
+"""
+Band-parallel conversion of one frame.
+
+The first frame of an input is decoded and resized once, in the request thread, then split into
+horizontal bands of rows that are converted on the conversion executor, as many at once as the
+request's share of the workers. Converted bands are yielded in order as soon as they're ready, so a response can start going
+out when its first band is done rather than when the whole frame is, and a large frame takes about
+as long as its slowest band instead of as long as all of them.
+ansify converts frames row by row, so the bands joined back together are exactly what converting the
+whole frame would have produced; see convert.convert_band.
+"""
+import logging
+
+from collections import deque
+from collections.abc import Iterator
+from contextlib import ExitStack
+
+from .buffers import ImageBuffer
+from .convert import convert_band
+from .frames import PREDECODE, open_frames, prepare_frame
+
+
+BAND_FORMATS = ('ansi-escaped', 'html/css')  # html/classes needs the whole frame, see html_palette
+MIN_BAND_ROWS = 8  # below this, a band costs more to hand to a worker than to convert
+
+logger = logging.getLogger('debugLogger')
+
+
+def split_bands(size: tuple[int, int], pixels: bytes, n_bands: int):
+    """
+    :param size: (width, height) of a frame, see frames.prepare_frame
+    :return: [(size, pixels)] of n_bands bands of consecutive rows, or fewer for short frames
+    """
+    width, height = size
+    n_bands = max(1, min(n_bands, height))
+    row_bytes = width * 4  # RGBA
+    bounds = [height * n // n_bands for n in range(n_bands + 1)]
+    return [((width, end - start), pixels[start * row_bytes:end * row_bytes])
+            for start, end in zip(bounds, bounds[1:])]
+
+
+class BandStream(Iterator):
+    """
+    iterates over the converted bands of an input's first frame, in order.
+    Anything wrong with the request (a full executor, an unreadable input, a bad format) is raised
+    from the constructor, before any output is produced.
+    Holds one executor admission ticket until exhausted or closed, like frames.FrameStream.
+    :param on_complete: optional, called with the whole output once every band has been yielded
+    :param predecode: see ConversionEngine.convert
+    :param admission: see ConversionExecutor.admit
+    """
+    def __init__(self, executor, data: bytes, output_format: str, characters: str,
+                 height: int, width: int, on_complete=None, predecode: bool = False,
+                 admission=None):
+        if output_format not in BAND_FORMATS:
+            raise ValueError(f'{output_format} can not be converted in bands; must be one of '
+                             f'{list(BAND_FORMATS)}')
+        self._executor = executor
+        self._on_complete = on_complete
+        self._futures = deque()
+        self._ticket = executor.admit(admission)
+        try:
+            with ExitStack() as stack:
+                image = stack.enter_context(ImageBuffer.from_bytes(data, len(data)))
+                input_file = stack.enter_context(image.input_file())
+                frame = next(open_frames(stack, input_file, image.mime(), 0, 1, 1), None)
+                if frame is None:
+                    raise ValueError('input has no frames')
+                size, pixels = prepare_frame(frame, height, width, predecode or PREDECODE)
+            n_bands = min(max(executor.workers, 1) * 2, size[1] // MIN_BAND_ROWS)
+            bands = split_bands(size, pixels, n_bands)
+            logger.debug(f'converting {size[0]}x{size[1]} frame in {len(bands)} bands')
+            self._bands_left = deque(
+                (convert_band, band_size, band_pixels, output_format, characters,
+                 n == 0, n == len(bands) - 1)
+                for n, (band_size, band_pixels) in enumerate(bands))
+            self._submit()
+        except Exception:
+            self.close()
+            raise
+        self._output = self._bands()
+
+    def _submit(self) -> None:
+        while self._bands_left and len(self._futures) < self._executor.share():
+            self._futures.append(self._executor.submit(*self._bands_left.popleft()))
+
+    def _bands(self):
+        converted = []
+        while self._futures:
+            converted.append(self._futures.popleft().result())
+            self._submit()
+            yield converted[-1]
+        if self._on_complete is not None:
+            self._on_complete(''.join(converted))
+
+    def __next__(self) -> str:
+        try:
+            return next(self._output)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._ticket is None:
+            return
+        output = getattr(self, '_output', None)
+        if output is not None:
+            output.close()
+        for future in self._futures:
+            future.cancel()  # bands nobody will read, if the client went away
+        self._executor.release(self._ticket)
+        self._ticket = None
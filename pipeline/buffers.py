@@ -0,0 +1,131 @@
+"""
+Per-request storage for input media.
+
+Every request gets its own ImageBuffer, so concurrent requests in a threaded or multi-worker server
+never share a file on disk. Small inputs stay in memory; anything past SPOOL_MAX_B spills over to an
+anonymous temporary file that is removed as soon as the buffer is closed.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+
+from contextlib import contextmanager
+from filetype import guess
+
+from .errors import AnsifierError
+
+
+CHUNK_SIZE_B = 64 * 1024
+SPOOL_MAX_B = 8 * 1024 * 1024  # larger than MAX_FILESIZE_B, so uploads normally never touch disk
+
+logger = logging.getLogger('debugLogger')
+
+
+class ImageBuffer:
+    """
+    An isolated, size-capped buffer holding the raw bytes of one input image or video.
+    The size cap is enforced as bytes are written, so oversized inputs are rejected without
+    ever being read into memory in full.
+    """
+    def __init__(self, max_size_b: int):
+        self.max_size_b = max_size_b
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_B)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f'ImageBuffer(size={self.size}, max_size_b={self.max_size_b})'
+
+    @classmethod
+    def from_stream(cls, stream, max_size_b: int, chunk_size: int = CHUNK_SIZE_B):
+        """ copies a readable binary stream into a new buffer chunk by chunk """
+        buffer = cls(max_size_b)
+        try:
+            chunk = stream.read(chunk_size)
+            while chunk:
+                buffer.write(chunk)
+                chunk = stream.read(chunk_size)
+        except Exception:
+            buffer.close()
+            raise
+        return buffer
+
+    @classmethod
+    def from_bytes(cls, content: bytes, max_size_b: int):
+        buffer = cls(max_size_b)
+        try:
+            buffer.write(content)
+        except Exception:
+            buffer.close()
+            raise
+        return buffer
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_size_b:
+            raise AnsifierError(f'File must not exceed {self.max_size_b/1e6:g} MB',
+                                http_code=400)
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def digest(self) -> str:
+        """ :return: hex sha256 of everything written so far, computed as the bytes streamed in """
+        return self._hash.hexdigest()
+
+    # read, readline and seek let Werkzeug parse uploads straight into a buffer, see app.py
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def getvalue(self) -> bytes:
+        self._file.seek(0)
+        return self._file.read()
+
+    def open(self):
+        """ :return: the underlying file object, rewound to the start of the data """
+        self._file.seek(0)
+        return self._file
+
+    def mime(self) -> str | None:
+        kind = guess(self.open())
+        return kind.mime if kind is not None else None
+
+    @contextmanager
+    def input_file(self):
+        """
+        yields something ansify can read the input from;
+        images are read straight out of the buffer, but opencv can only open videos by path,
+        so videos are copied to a private named temporary file for the duration of the context
+        """
+        mime = self.mime()
+        if mime is None or not mime.startswith('video'):
+            yield self.open()
+            return
+
+        fd, path = tempfile.mkstemp(prefix='ansifier-')
+        try:
+            with os.fdopen(fd, 'wb') as wf:
+                src = self.open()
+                chunk = src.read(CHUNK_SIZE_B)
+                while chunk:
+                    wf.write(chunk)
+                    chunk = src.read(CHUNK_SIZE_B)
+            logger.debug(f'spilled {self.size} byte {mime} input to {path} for opencv')
+            yield path
+        finally:
+            os.remove(path)
+
+    def close(self) -> None:
+        self._file.close()
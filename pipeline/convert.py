@@ -0,0 +1,82 @@
+"""
+The conversion step itself.
+Functions here may run in conversion worker processes (see executor.py), so they must be importable
+without app.py and must only take and return picklable values.
+ansifier (which brings numpy and OpenCV along) is imported on first use rather than with this module,
+since the web process only needs it when converting inline; see warmup in app.py.
+The pixel to text work itself is done by the conversion engine chosen in engines.py.
+"""
+from PIL import Image
+
+from .buffers import ImageBuffer
+from .engines import get_engine
+from .html_palette import BASE_FORMAT, PALETTE_FORMAT, compact_html
+
+
+def preload_conversion() -> None:
+    """ imports ansifier and its dependencies, and sets up the engine, ahead of the first conversion """
+    import ansifier  # noqa: F401
+    import numpy  # noqa: F401
+    get_engine()
+
+
+def convert(data: bytes, output_format: str, characters: str, height: int, width: int,
+            predecode: bool = False) -> str:
+    """
+    converts raw image or video bytes into the text of their first frame;
+    only the first frame is decoded, even for animated inputs
+    :param predecode: see ConversionEngine.convert
+    raises a ValueError for inputs or arguments ansify can't handle
+    """
+    if output_format == PALETTE_FORMAT:
+        return compact_html(convert(data, BASE_FORMAT, characters, height, width, predecode))
+    with ImageBuffer.from_bytes(data, len(data)) as image, image.input_file() as input_file:
+        return get_engine().convert(input_file, image.mime(), output_format, characters,
+                                    height, width, predecode)
+
+
+def convert_frame(size: tuple[int, int], pixels: bytes, output_format: str, characters: str) -> str:
+    """
+    converts one already-decoded, already-resized frame (see frames.prepare_frame) into text,
+    exactly as ansify would have converted it
+    :param size: (width, height) of the frame in pixels
+    :param pixels: the frame's raw RGBA bytes
+    """
+    if output_format == PALETTE_FORMAT:
+        return compact_html(convert_frame(size, pixels, BASE_FORMAT, characters))
+    return get_engine().convert_frame(Image.frombytes('RGBA', size, pixels), output_format,
+                                      characters)
+
+
+def convert_band(size: tuple[int, int], pixels: bytes, output_format: str, characters: str,
+                 first: bool, last: bool) -> str:
+    """
+    like convert_frame, for a horizontal band of a frame's rows (see bands.py); the output format's
+    wrapper is left off, except for its opening in the first band and its closing in the last,
+    so that the bands of a frame joined in order are exactly the converted frame
+    """
+    from ansifier.output_formats import OUTPUT_FORMATS
+    text = convert_frame(size, pixels, output_format, characters)
+    wrapper = [None]
+    OUTPUT_FORMATS[output_format].wrap_output(wrapper)  # inserts around what the frame would be
+    split = wrapper.index(None)
+    opening, closing = ''.join(wrapper[:split]), ''.join(wrapper[split + 1:])
+    return text[0 if first else len(opening):len(text) if last else len(text) - len(closing)]
+
+
+def convert_frame_cells(size: tuple[int, int], pixels: bytes, characters: str) -> list[list[str]]:
+    """
+    like convert_frame for ansi-escaped output, but returns the frame as rows of cells,
+    each cell being the exact escape sequence and characters ansify would emit for it;
+    used by delta.DeltaEncoder, which needs to compare frames cell by cell
+    """
+    import numpy as np
+    from ansifier.output_formats import OUTPUT_FORMATS
+    image = Image.frombytes('RGBA', size, pixels)
+    chars = list(characters)
+    chars.reverse()
+    ceiling = 255  # transparency, as in ansify's default
+    charmap = {i: chars[min(i // (ceiling//len(chars)), len(chars)-1)] for i in range(ceiling+1)}
+    char_to_cell = OUTPUT_FORMATS['ansi-escaped'].char_to_cell
+    return [[char_to_cell(charmap[pixel[3]], pixel[0], pixel[1], pixel[2]) for pixel in row]
+            for row in np.array(image)]
@@ -0,0 +1,56 @@
+"""
+The "ansi-delta" output format: animated ansi output that only redraws what changed.
+
+Every keyframe_interval-th frame is a keyframe: a clear-screen escape followed by the frame exactly
+as "ansi-escaped" renders it. Every other frame is a delta against the frame before it, made of
+cursor-addressed writes of just the cells that changed, each run of adjacent changed cells in a row
+sharing one cursor movement. Deltas end by parking the cursor below the image and resetting the
+color, just like a keyframe does, so output can be cut after any frame.
+Printing the output to a truecolor terminal plays the animation back.
+"""
+DELTA_FORMAT = 'ansi-delta'
+CLEAR = '\033[2J\033[H'
+RESET = '\033[38;2;255;255;255m'  # what ansify leaves the color at after every frame
+DEFAULT_KEYFRAME_INTERVAL = 30
+
+
+def _move(row: int, col: int) -> str:
+    """ cursor position escape for a cell; cells are two characters wide, terminals count from 1 """
+    return f'\033[{row + 1};{2 * col + 1}H'
+
+
+class DeltaEncoder:
+    """
+    encodes a sequence of frames, each given as rows of cells (see convert.convert_frame_cells),
+    one frame at a time
+    """
+    def __init__(self, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self._previous = None
+        self._frame_n = 0
+
+    def encode(self, cells: list[list[str]]) -> str:
+        previous = self._previous
+        keyframe = (previous is None
+                    or self._frame_n % self.keyframe_interval == 0
+                    or len(previous) != len(cells)
+                    or any(len(a) != len(b) for a, b in zip(previous, cells)))
+        self._previous = cells
+        self._frame_n += 1
+        if keyframe:
+            return CLEAR + ''.join(''.join(row) + '\n' for row in cells) + RESET
+
+        ret = []
+        for row_n, (old_row, new_row) in enumerate(zip(previous, cells)):
+            in_run = False
+            for col_n, (old_cell, new_cell) in enumerate(zip(old_row, new_row)):
+                if old_cell == new_cell:
+                    in_run = False
+                    continue
+                if not in_run:
+                    ret.append(_move(row_n, col_n))
+                    in_run = True
+                ret.append(new_cell)
+        ret.append(f'\033[{len(cells) + 1};1H')
+        ret.append(RESET)
+        return ''.join(ret)
@@ -0,0 +1,164 @@
+"""
+Conversion engines: what turns a decoded, resized frame into text.
+
+"ansifier" (the default) hands every conversion to ansifier, which builds the output one pixel at a
+time in Python. "numpy" produces exactly the same output with array operations instead: every piece
+of every cell's text (its color escape, split into one lookup table per channel, and its characters)
+is looked up for the whole frame at once, interleaved into one array, and joined in a single pass,
+so no per-cell strings are built at all. Decoding and resizing are left to PIL in both, since they
+have to match ansify's resize pixel for pixel.
+The engine is picked with ANSIFIER_ENGINE, once per process; conversion workers inherit it.
+
+To add an engine, inherit from ConversionEngine, implement convert_frame (and convert, if the engine
+decodes inputs its own way), and add it to ENGINES.
+"""
+import os
+
+from abc import ABC, abstractmethod
+from html import escape
+
+from PIL import Image
+
+
+class ConversionEngine(ABC):
+    name = None
+
+    def convert(self, input_file, mime: str | None, output_format: str, characters: str,
+                height: int, width: int, predecode: bool = False) -> str:
+        """
+        converts the first frame of an input, resized the way ansify resizes it
+        :param input_file: see ImageBuffer.input_file
+        :param mime: see ImageBuffer.mime
+        :param predecode: shrink the input before decoding it even if ANSIFIER_PREDECODE isn't set,
+            see frames.prepare_frame
+        raises a ValueError for inputs or arguments that can't be converted
+        """
+        from contextlib import ExitStack
+
+        from .frames import PREDECODE, open_frames, prepare_frame  # frames imports this module's users
+        with ExitStack() as stack:
+            frame = next(open_frames(stack, input_file, mime, 0, 1, 1), None)
+            if frame is None:
+                raise ValueError('input has no frames')
+            size, pixels = prepare_frame(frame, height, width, predecode or PREDECODE)
+        return self.convert_frame(Image.frombytes('RGBA', size, pixels), output_format, characters)
+
+    @abstractmethod
+    def convert_frame(self, image: Image.Image, output_format: str, characters: str) -> str:
+        """ converts one decoded, resized RGBA frame exactly as ansify would have converted it """
+        pass
+
+
+class AnsifierEngine(ConversionEngine):
+    name = 'ansifier'
+
+    def convert(self, input_file, mime, output_format, characters, height, width, predecode=False):
+        from .frames import PREDECODE
+        if predecode or PREDECODE:  # ansify can't shrink inputs before decoding them
+            return super().convert(input_file, mime, output_format, characters, height, width,
+                                   predecode)
+        from ansifier import ansify
+        return ansify(input_file, output_format=output_format, chars=list(characters),
+                      height=height, width=width, animate=False)[0]
+
+    def convert_frame(self, image, output_format, characters):
+        from ansifier.ansify import _process_frame  # ansifier is pinned, see requirements.txt
+        from ansifier.output_formats import OUTPUT_FORMATS
+        output_formatter = OUTPUT_FORMATS.get(output_format)
+        if output_formatter is None:
+            raise ValueError(f'{output_format} is not a valid output format; '
+                             f'must be one of {list(OUTPUT_FORMATS.keys())}')
+        chars = list(characters)
+        chars.reverse()  # ansify does the same before converting
+        return _process_frame(image=image, chars=chars, by_intensity=False,
+                              output_formatter=output_formatter)
+
+
+class _Tables:
+    """ lookup tables for one output format and list of characters, see NumpyEngine """
+    def __init__(self, output_format: str, characters: str):
+        import numpy as np
+        chars = list(characters)
+        chars.reverse()
+        ceiling = 255  # characters are picked by transparency, as in ansify's default
+        step = ceiling // len(chars)
+        self.char_index = np.array([min(i // step, len(chars) - 1) for i in range(ceiling + 1)],
+                                   dtype=np.intp)
+        self.blank = np.array([c == ' ' for c in chars])
+        if output_format == 'ansi-escaped':
+            # \033[38;2;{r};{g};{b}m{char*2}, or two spaces for blank cells
+            self.red = [f'\033[38;2;{v};' for v in range(256)]
+            self.green = [f'{v};' for v in range(256)]
+            self.blue = [f'{v}m' for v in range(256)]
+            self.chars = [c * 2 for c in chars]
+            self.blank_cell = '  '
+            self.line_break, self.opening, self.closing = '\n', '', '\033[38;2;255;255;255m'
+        elif output_format == 'html/css':
+            self.red = [f'<span style="color: rgb({v},' for v in range(256)]
+            self.green = [f'{v},' for v in range(256)]
+            self.blue = [f'{v})">' for v in range(256)]
+            self.chars = [escape(c) * 2 + '</span>' for c in chars]
+            self.blank_cell = '<span>&nbsp;&nbsp;</span>'
+            self.line_break = '<br/>'
+            self.opening = '<div style="font-family: monospace; line-height: 1.2;">'
+            self.closing = '</div>'
+        else:
+            raise ValueError(f'{output_format} is not a valid output format; '
+                             f'must be one of {list(NumpyEngine.FORMATS)}')
+        for name in ('red', 'green', 'blue', 'chars'):
+            setattr(self, name, np.array(getattr(self, name), dtype=object))
+
+
+class NumpyEngine(ConversionEngine):
+    name = 'numpy'
+    FORMATS = ('ansi-escaped', 'html/css')
+    PIECES = 4  # red, green, blue, and characters; see _Tables
+
+    def __init__(self):
+        self._tables = {}  # (output_format, characters): _Tables
+
+    def convert_frame(self, image, output_format, characters):
+        import numpy as np
+        key = (output_format, characters)
+        tables = self._tables.get(key)
+        if tables is None:
+            tables = self._tables[key] = _Tables(output_format, characters)
+
+        pixels = np.asarray(image)
+        height, width = pixels.shape[:2]
+        char_index = tables.char_index[pixels[..., 3]]
+        pieces = np.empty((height, width * self.PIECES + 1), dtype=object)
+        pieces[:, 0:-1:self.PIECES] = tables.red[pixels[..., 0]]
+        pieces[:, 1:-1:self.PIECES] = tables.green[pixels[..., 1]]
+        pieces[:, 2:-1:self.PIECES] = tables.blue[pixels[..., 2]]
+        pieces[:, 3:-1:self.PIECES] = tables.chars[char_index]
+        blank = tables.blank[char_index]
+        if blank.any():
+            rows, columns = np.nonzero(blank)
+            columns = columns * self.PIECES
+            pieces[rows, columns] = tables.blank_cell
+            for offset in range(1, self.PIECES):
+                pieces[rows, columns + offset] = ''
+        pieces[:, -1] = tables.line_break
+        return tables.opening + ''.join(pieces.ravel().tolist()) + tables.closing
+
+
+ENGINES = {
+    'ansifier': AnsifierEngine,
+    'numpy': NumpyEngine,
+}
+
+_engine = None
+
+
+def get_engine() -> ConversionEngine:
+    """ :return: this process's engine, as chosen by ANSIFIER_ENGINE (default ansifier) """
+    global _engine
+    if _engine is None:
+        name = os.environ.get('ANSIFIER_ENGINE', 'ansifier')
+        Engine = ENGINES.get(name)
+        if Engine is None:
+            raise ValueError(f'{name} is not a valid conversion engine, must be one of: '
+                             + ', '.join(ENGINES.keys()))
+        _engine = Engine()
+    return _engine
@@ -0,0 +1,9 @@
+class AnsifierError(Exception):
+    """
+    an error that should be reported to the client as-is, with the given HTTP response code
+    and any extra response headers (e.x. Retry-After)
+    """
+    def __init__(self, message, http_code, headers=None):
+        super().__init__(message)
+        self.http_code = http_code
+        self.headers = headers if headers is not None else {}
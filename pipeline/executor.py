@@ -0,0 +1,175 @@
+"""
+Runs CPU-bound conversions off of the request threads, behind a bounded admission queue.
+
+At most `workers` conversions run at once, in a process pool, and at most `queue_depth` more may
+wait for a free worker. Anything beyond that is turned away immediately with a 429 and a Retry-After
+estimated from recent conversion times, rather than letting latency grow without bound.
+Waiting conversions are admitted by cost and by client rather than first come, first served, and
+clients sending more work than their share are turned away too; see scheduler.py.
+A worker process that dies only fails the conversions it was running; the pool is then replaced.
+"""
+import logging
+import math
+import multiprocessing
+import threading
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .errors import AnsifierError
+from .scheduler import Admission, ClientBuckets, FairQueue
+
+
+EWMA_WEIGHT = 0.2  # how much each new conversion time moves the running average
+
+logger = logging.getLogger('debugLogger')
+
+
+class ConversionExecutor:
+    """
+    :param workers: size of the process pool; 0 runs conversions inline in the calling thread,
+        which keeps the admission limit but gives up isolation from the request threads
+    :param queue_depth: how many admitted conversions may wait for a worker
+    :param client_rate: cost per second each client may convert, see scheduler.ClientBuckets
+    :param client_burst: cost each client may convert at once
+    """
+    def __init__(self, workers: int, queue_depth: int, client_rate: float = 0,
+                 client_burst: float = 0):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._queue = FairQueue(max(workers, 1), queue_depth)
+        self._buckets = ClientBuckets(client_rate, client_burst)
+        self._in_flight = 0
+        self._avg_seconds = 1.0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def __repr__(self):
+        return f'ConversionExecutor(workers={self.workers}, queue_depth={self.queue_depth}, '\
+               f'in_flight={self._in_flight}, waiting={len(self._queue)})'
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # created lazily so that pre-fork servers don't share one pool between their workers;
+        # spawned rather than forked because the parent is multithreaded
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _replace_pool(self, pool: ProcessPoolExecutor) -> None:
+        # a worker process that died, e.x. killed for running out of memory, breaks its whole pool;
+        # the next submission starts a new one instead of every later conversion failing
+        with self._lock:
+            if self._pool is not pool:
+                return  # already replaced
+            self._pool = None
+        logger.warning(f'{self} lost a worker process, replacing its pool')
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _on_done(self, pool: ProcessPoolExecutor, future: Future) -> None:
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace_pool(pool)
+
+    def retry_after(self) -> int:
+        """ :return: rough number of seconds until a slot frees up """
+        with self._lock:
+            backlog = (self._in_flight + len(self._queue)) / max(self.workers, 1)
+            return max(1, math.ceil(backlog * self._avg_seconds))
+
+    def run(self, fn, *args, admission: Admission | None = None):
+        """
+        runs fn(*args) on the pool and blocks until it finishes, returning its result
+        raises an AnsifierError with code 429 if the admission queue is full
+        :param admission: see admit
+        """
+        ticket = self.admit(admission)
+        try:
+            return self.submit(fn, *args).result()
+        finally:
+            self.release(ticket)
+
+    def admit(self, admission: Admission | None = None) -> float:
+        """
+        takes an admission slot, for callers that submit more than one piece of work per request,
+        waiting for one in the admission queue if every worker is busy;
+        raises an AnsifierError with code 429 if the admission queue is full, or if the client has
+        used up its share
+        :param admission: who the work is for and what it costs; unattributed work costs one unit
+        :return: a ticket that MUST be passed to release once the caller's work is done
+        """
+        if admission is None:
+            admission = Admission()
+        wait_s = self._buckets.take(admission.client, admission.cost)
+        if wait_s:
+            retry_after = max(1, math.ceil(wait_s))
+            logger.debug(f'{admission} over its share, retry after {retry_after}s')
+            raise AnsifierError('You are sending too much work, please slow down',
+                                http_code=429, headers={'Retry-After': str(retry_after)})
+        if not self._queue.acquire(admission):
+            self._buckets.refund(admission.client, admission.cost)
+            retry_after = self.retry_after()
+            logger.debug(f'{self} full, rejecting conversion, retry after {retry_after}s')
+            raise AnsifierError('The server is busy, please try again later',
+                                http_code=429, headers={'Retry-After': str(retry_after)})
+        with self._lock:
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(self, ticket: float) -> None:
+        elapsed = time.monotonic() - ticket
+        with self._lock:
+            self._in_flight -= 1
+            self._avg_seconds += EWMA_WEIGHT * (elapsed - self._avg_seconds)
+        self._queue.release()
+
+    def share(self) -> int:
+        """
+        :return: how many pieces of work each ticket may have submitted and unfinished at once:
+            enough to keep every worker busy twice over, split between the tickets held, so that no
+            request's work queues up in the pool ahead of everyone else's
+        """
+        return max(1, 2 * max(self.workers, 1) // max(self._queue.in_use, 1))
+
+    def submit(self, fn, *args) -> Future:
+        """
+        hands fn(*args) to the pool without waiting for it; the caller must already hold a ticket,
+        and should keep no more than share() submissions unfinished
+        """
+        if self.workers > 0:
+            pool = self._get_pool()
+            try:
+                future = pool.submit(fn, *args)
+            except BrokenProcessPool:
+                # broken by work that hasn't noticed yet; only the work that was running fails
+                self._replace_pool(pool)
+                pool = self._get_pool()
+                future = pool.submit(fn, *args)
+            future.add_done_callback(lambda future: self._on_done(pool, future))
+            return future
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def prestart(self, fn, *args) -> None:
+        """
+        starts the pool's processes now instead of on the first submissions, running fn(*args) once
+        per worker so that each can import what it needs before the first real conversion;
+        bypasses admission, so it's meant to be run before serving requests
+        """
+        if self.workers > 0:
+            pool = self._get_pool()
+            for future in [pool.submit(fn, *args) for _ in range(self.workers)]:
+                future.result()
+        else:
+            fn(*args)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,120 @@
+"""
+Downloads remote images for url inputs.
+
+One ImageFetcher is shared by the whole process so that connections (and their TLS sessions) are
+pooled across requests. Bodies are streamed into an ImageBuffer, which aborts the download as soon as
+it grows past the size limit, whether or not the server sent a Content-Length.
+Recently fetched images are kept in a small LRU and revalidated with ETag/Last-Modified, so a popular
+URL costs a 304 instead of a full download.
+"""
+import logging
+import threading
+
+from collections import OrderedDict
+
+from .buffers import CHUNK_SIZE_B, ImageBuffer
+from .errors import AnsifierError
+
+
+logger = logging.getLogger('debugLogger')
+
+
+class _CachedImage:
+    def __init__(self, content: bytes, etag: str | None, last_modified: str | None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ImageFetcher:
+    """
+    :param max_size_b: downloads larger than this are rejected with a 400
+    :param cache_max_bytes: budget for the revalidation cache; 0 disables it
+    :param pool_size: max pooled connections kept per host
+    """
+    def __init__(self, max_size_b: int, cache_max_bytes: int, pool_size: int = 10,
+                 timeout: float = 10):
+        self.max_size_b = max_size_b
+        self.cache_max_bytes = cache_max_bytes
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None  # created on first use, so that requests is only imported then
+        self._cache = OrderedDict()  # url -> _CachedImage, least recently used first
+        self._cache_size = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'ImageFetcher(cached={len(self._cache)}, cache_bytes={self._cache_size})'
+
+    def fetch(self, url: str) -> ImageBuffer:
+        """
+        :return: ImageBuffer holding the image at url, which the caller is responsible for closing
+        """
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached is not None:
+                self._cache.move_to_end(url)
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        session = self._get_session()
+        with session.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 304 and cached is not None:
+                logger.debug(f'{url} not modified, serving cached copy')
+                return ImageBuffer.from_bytes(cached.content, self.max_size_b)
+
+            if resp.status_code < 200 or resp.status_code > 299:
+                raise AnsifierError(f'image url returned code {resp.status_code}',
+                                    http_code=500)
+            size = int(resp.headers.get('Content-Length', 0))
+            if size > self.max_size_b:
+                raise AnsifierError(f'File must not exceed {self.max_size_b/1e6:g} MB',
+                                    http_code=400)
+
+            buffer = ImageBuffer(self.max_size_b)
+            try:
+                for chunk in resp.iter_content(CHUNK_SIZE_B):
+                    buffer.write(chunk)
+            except Exception:
+                buffer.close()
+                raise
+            logger.debug(f'downloaded {buffer.size} bytes from {url}')
+
+            etag = resp.headers.get('ETag')
+            last_modified = resp.headers.get('Last-Modified')
+            if etag or last_modified:
+                self._cache_put(url, _CachedImage(buffer.getvalue(), etag, last_modified))
+            return buffer
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                          pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def _cache_put(self, url: str, entry: _CachedImage) -> None:
+        size = len(entry.content)
+        if size > self.cache_max_bytes:
+            return
+        with self._lock:
+            previous = self._cache.pop(url, None)
+            if previous is not None:
+                self._cache_size -= len(previous.content)
+            self._cache[url] = entry
+            self._cache_size += size
+            while self._cache_size > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_size -= len(evicted.content)
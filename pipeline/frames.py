@@ -0,0 +1,171 @@
+"""
+Multi-frame output for animated images and videos.
+
+Frames are decoded lazily in the request thread, only as far as the requested range reaches
+(video frames outside the range are skipped without being decoded), resized to the output grid,
+then converted on the conversion executor a few frames ahead of the one being sent.
+Converted frames are yielded in order as soon as they're ready, so a response can be streamed out
+frame by frame instead of after the whole clip has been converted.
+The "ansi-delta" format is only produced here, since it only makes sense for several frames;
+see delta.py.
+"""
+import logging
+import os
+
+from collections import deque
+from collections.abc import Iterator
+from contextlib import ExitStack
+
+from PIL import Image
+
+from .buffers import ImageBuffer
+from .convert import convert_frame, convert_frame_cells
+from .delta import DEFAULT_KEYFRAME_INTERVAL, DELTA_FORMAT, DeltaEncoder
+from .html_palette import PALETTE_FORMAT
+
+
+# written before every frame; for ansi output this clears the terminal and homes the cursor,
+# so a streamed response plays back as an animation when printed
+FRAME_SEPARATORS = {
+    'ansi-escaped': '\033[2J\033[H',
+}
+
+# shrink still images before converting them, rather than after like ansify; see prepare_frame
+PREDECODE = bool(os.environ.get('ANSIFIER_PREDECODE'))
+PREDECODE_MODES = ('RGB', 'L')  # these are resized in their own mode, and JPEGs decode to them
+
+logger = logging.getLogger('debugLogger')
+
+
+def prepare_frame(frame: Image.Image, height: int, width: int,
+                  predecode: bool = PREDECODE) -> tuple[tuple[int, int], bytes]:
+    """
+    resizes a decoded frame the same way ansify does, so it's small and cheap to send to a worker
+    :param predecode: shrink still RGB and greyscale images before converting them to RGBA;
+        thumbnail decodes JPEGs that haven't been loaded yet at a reduced scale (draft mode) and
+        resizes in steps (reducing_gap), so a multi-megapixel input is never decoded or converted
+        at full size. Colors come out a few levels off from ansify's, which is why it's optional
+    :return: (size, pixels), see convert.convert_frame
+    """
+    if predecode and frame.mode in PREDECODE_MODES and getattr(frame, 'n_frames', 1) == 1:
+        frame.thumbnail((width//2, height), Image.BICUBIC)
+        image = frame.convert('RGBA')
+    else:
+        image = frame.convert('RGBA')
+        image.thumbnail((width//2, height), Image.BICUBIC)
+    return image.size, image.tobytes()
+
+
+def _image_frames(rf, start: int, end: int, stride: int):
+    n_frames = getattr(rf, 'n_frames', 1)
+    for frame_n in range(start, min(end, n_frames), stride):
+        rf.seek(frame_n)
+        yield rf
+
+
+def _video_frames(capture, start: int, end: int, stride: int):
+    from cv2 import COLOR_BGR2RGB, cvtColor  # optional, like in ansifier; only needed for video
+    frame_n = 0
+    while frame_n < end:
+        if frame_n >= start and (frame_n - start) % stride == 0:
+            success, bgr_frame = capture.read()
+            if not success:
+                break
+            yield Image.fromarray(cvtColor(bgr_frame, COLOR_BGR2RGB))
+        elif not capture.grab():  # advances without decoding
+            break
+        frame_n += 1
+
+
+def open_frames(stack: ExitStack, input_file, mime: str | None, start: int, end: int, stride: int):
+    """
+    opens an image or video for reading, registering whatever has to be closed afterwards on stack
+    :param mime: see ImageBuffer.mime; videos are read with OpenCV, anything else with PIL
+    :return: iterator over the decoded frames [start, end), every stride-th frame
+    raises a ValueError if the input can't be opened
+    """
+    if mime is not None and mime.startswith('video'):
+        from cv2 import VideoCapture
+        capture = VideoCapture(input_file)
+        stack.callback(capture.release)
+        if not capture.isOpened():
+            raise ValueError('unable to open video input')
+        return _video_frames(capture, start, end, stride)
+    try:
+        rf = stack.enter_context(Image.open(input_file))
+    except Exception as e:
+        raise ValueError(f'unable to open image input\n{e}')
+    return _image_frames(rf, start, end, stride)
+
+
+class FrameStream(Iterator):
+    """
+    iterates over the converted frames [start, end) of an input, every stride-th frame.
+    Anything wrong with the request (a full executor, an unreadable input, a bad format) is raised
+    from the constructor, before any output is produced.
+    Holds one executor admission ticket and its own copy of the input until exhausted or closed;
+    Werkzeug closes response iterables once they've been sent.
+    :param predecode: see engines.ConversionEngine.convert
+    :param admission: see ConversionExecutor.admit
+    """
+    def __init__(self, executor, data: bytes, output_format: str, characters: str,
+                 height: int, width: int, start: int, end: int, stride: int,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL, predecode: bool = False,
+                 admission=None):
+        from ansifier.output_formats import OUTPUT_FORMATS  # deferred like in convert.py
+        if output_format not in OUTPUT_FORMATS and output_format not in (DELTA_FORMAT,
+                                                                         PALETTE_FORMAT):
+            raise ValueError(f'{output_format} is not a valid output format; must be one of '
+                             f'{list(OUTPUT_FORMATS.keys()) + [DELTA_FORMAT, PALETTE_FORMAT]}')
+        self._executor = executor
+        if output_format == DELTA_FORMAT:
+            self._convert = convert_frame_cells
+            self._args = (characters,)
+            self._encode = DeltaEncoder(keyframe_interval).encode
+        else:
+            separator = FRAME_SEPARATORS.get(output_format, '')
+            self._convert = convert_frame
+            self._args = (output_format, characters)
+            self._encode = lambda frame: separator + frame
+        self._dims = (height, width)
+        self._predecode = predecode or PREDECODE
+        self._stack = ExitStack()
+        self._ticket = executor.admit(admission)
+        try:
+            image = self._stack.enter_context(ImageBuffer.from_bytes(data, len(data)))
+            input_file = self._stack.enter_context(image.input_file())
+            self._frames = self._open(input_file, image.mime(), start, end, stride)
+        except Exception:
+            self.close()
+            raise
+        self._output = self._convert_frames()
+
+    def _open(self, input_file, mime, start, end, stride):
+        return open_frames(self._stack, input_file, mime, start, end, stride)
+
+    def _convert_frames(self):
+        pending = deque()
+        for frame in self._frames:
+            size, pixels = prepare_frame(frame, *self._dims, self._predecode)
+            pending.append(self._executor.submit(self._convert, size, pixels, *self._args))
+            while len(pending) >= self._executor.share():
+                yield self._encode(pending.popleft().result())
+        while pending:
+            yield self._encode(pending.popleft().result())
+
+    def __next__(self) -> str:
+        try:
+            return next(self._output)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._ticket is None:
+            return
+        output = getattr(self, '_output', None)
+        if output is not None:
+            output.close()
+        self._stack.close()
+        self._executor.release(self._ticket)
+        self._ticket = None
@@ -0,0 +1,159 @@
+"""
+Write-behind buffer for gallery submissions.
+
+Arts submitted to the galleries are given their uid right away and written to the database later,
+in batches of up to max_batch arts per transaction, by a background thread that flushes a batch once
+it's full or once its oldest art has waited max_delay_s. That keeps commit latency out of /ansify
+responses, and turns many small transactions into a few larger ones.
+Arts that haven't been written yet can still be read back from this process with get; other
+processes see them once they're flushed. A batch that fails to write is kept and retried; once it
+has failed MAX_ATTEMPTS times its arts are written one at a time instead, and any art that still
+can't be written is logged and dropped, so that one bad art can't hold up every art put after it.
+Whatever is still pending is written when the buffer is closed, e.x. when the server shuts down.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from itertools import islice
+
+
+RETRY_S = 1.0  # wait between attempts to write a batch the database rejected
+MAX_ATTEMPTS = 5  # attempts to write a batch before its arts are written, or dropped, one at a time
+
+logger = logging.getLogger('debugLogger')
+
+
+class GalleryWriter:
+    """
+    :param open_database: returns a Database, see data_model
+    :param max_batch: most arts written per transaction; a full batch is written right away
+    :param max_delay_s: longest an art waits to be written; 0 writes every art before put returns
+    :param max_pending: past this many unwritten arts, e.x. while the database is unreachable,
+        put writes them itself, so that callers get the database's errors instead of a growing buffer
+    """
+    def __init__(self, open_database, max_batch: int = 50, max_delay_s: float = 0.2,
+                 max_pending: int = 1000):
+        self.open_database = open_database
+        self.max_batch = max(1, max_batch)
+        self.max_delay_s = max_delay_s
+        self.max_pending = max(self.max_batch, max_pending)
+        self._pending = {}  # uid: entry, see insert_arts, in the order they were put
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one batch in flight at a time, so arts keep their order
+        self._attempts = 0  # failed attempts to write the oldest batch
+        self._closing = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return f'GalleryWriter(pending={len(self._pending)}, max_batch={self.max_batch}, '\
+               f'max_delay_s={self.max_delay_s})'
+
+    def put(self, art: str, format: str, user=None) -> str:
+        """ :return: the uid the art will be stored under """
+        uid = str(uuid.uuid4())
+        entry = {'uid': uid, 'art': art, 'format': format, 'user': user, 'timestamp': time.time()}
+        if self.max_delay_s <= 0:
+            self._write([entry])
+            return uid
+        with self._cond:
+            self._pending[uid] = entry
+            pending = len(self._pending)
+            if self._thread is None:
+                # started on first use, so that pre-fork servers start one per worker
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='gallery-writer')
+                self._thread.start()
+            if pending >= self.max_batch:
+                self._cond.notify()
+        if pending >= self.max_pending:
+            self.flush()
+        return uid
+
+    def get(self, uid: str, user=None):
+        """
+        :return: the art put under uid if it hasn't been written yet and user may see it, or None
+        """
+        with self._cond:
+            entry = self._pending.get(uid)
+        if entry is None or (entry['user'] is not None and user != entry['user']):
+            return None
+        return entry['art']
+
+    def flush(self) -> int:
+        """ writes every pending art, :return: how many were written rather than dropped """
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = list(islice(self._pending.values(), self.max_batch))
+                if not batch:
+                    return written
+                try:
+                    self._write(batch)
+                    self._attempts = 0
+                    written += len(batch)
+                except Exception:
+                    self._attempts += 1
+                    if self._attempts < MAX_ATTEMPTS:
+                        raise
+                    self._attempts = 0
+                    written += self._write_each(batch)
+                with self._cond:
+                    for entry in batch:
+                        del self._pending[entry['uid']]
+
+    def close(self) -> None:
+        """ stops the background thread and writes whatever is still pending """
+        self._closing.set()
+        with self._cond:
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        written = self.flush()
+        logger.debug(f'{self} closed, wrote {written} pending arts')
+
+    def _write(self, batch: list) -> None:
+        db = self.open_database()
+        try:
+            db.insert_arts(batch)
+        except Exception:
+            # rolls back whatever the failed transaction left behind, which would otherwise fail
+            # the retries with it
+            db.remove_sessions()
+            raise
+        logger.debug(f'wrote {len(batch)} gallery arts')
+
+    def _write_each(self, batch: list) -> int:
+        written = 0
+        for entry in batch:
+            try:
+                self._write([entry])
+                written += 1
+            except Exception:
+                logger.exception(f'{self} dropped art {entry["uid"]} ({entry["format"]}, user '
+                                 f'{entry["user"]}) after failing to write it {MAX_ATTEMPTS} times')
+        return written
+
+    def _run(self) -> None:
+        while not self._closing.is_set():
+            with self._cond:
+                while not self._pending and not self._closing.is_set():
+                    self._cond.wait()
+                if self._closing.is_set():
+                    return  # close flushes the rest
+                deadline = next(iter(self._pending.values()))['timestamp'] + self.max_delay_s
+                while len(self._pending) < self.max_batch and not self._closing.is_set():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f'{self} failed to write, retrying in {RETRY_S}s')
+                self._closing.wait(RETRY_S)
+            finally:
+                self.open_database().remove_sessions()
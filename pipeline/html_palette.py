@@ -0,0 +1,130 @@
+"""
+The "html/classes" output format: "html/css" output with its inline styles compacted into a palette.
+
+ansify's "html/css" output gives every cell its own span with an inline color style, which makes it
+the largest output we serve. compact_html rewrites it so that each distinct color is declared once,
+in a stylesheet at the start of the output, under a short class name (the most common colors get the
+shortest names), and runs of adjacent cells of the same color share one span. Colors used by too few
+runs to be worth a class keep an inline style, in short hex notation. Blank cells don't need
+a color at all, so they're written without a span, or inside the span around them if the colors on
+either side match. The stylesheet's rules are scoped to the output's own div, so several outputs can
+be inlined into one page, like on /gallery, without their palettes clashing.
+"""
+import hashlib
+import re
+
+from collections import Counter
+from string import ascii_lowercase
+
+
+PALETTE_FORMAT = 'html/classes'
+BASE_FORMAT = 'html/css'  # what gets converted before compacting
+CELL = re.compile(r'<span(?: style="color: rgb\((\d+),(\d+),(\d+)\)")?>(.*?)</span>|(<br/>)')
+DIV_OPEN = '<div style="font-family: monospace; line-height: 1.2;">'
+DIV_CLOSE = '</div>'
+BLANK = '&nbsp;'
+LINE_BREAK = '<br/>'
+
+
+def _class_name(n: int) -> str:
+    """ a, b, ..., z, aa, ab, ...; letters only, since css class names can't start with a digit """
+    name = ''
+    n += 1
+    while n:
+        n, remainder = divmod(n - 1, len(ascii_lowercase))
+        name = ascii_lowercase[remainder] + name
+    return name
+
+
+def _hex(r: int, g: int, b: int) -> str:
+    """ :return: the shortest css hex notation for a color """
+    color = f'{r:02x}{g:02x}{b:02x}'
+    if all(color[i] == color[i + 1] for i in (0, 2, 4)):
+        color = color[0] + color[2] + color[4]
+    return '#' + color
+
+
+def _runs(cells):
+    """
+    merges cells into runs of one color
+    :param cells: (color, or None for blank cells and line breaks, text) for each cell in order
+    :return: (color, text) for each run, with a color of None for text that needs no span
+    """
+    runs = []
+    current, text = None, []  # the open run
+    blanks = []  # blank cells waiting to see whether the next colored cell continues the run
+    for color, cell_text in cells:
+        if color is None and cell_text != LINE_BREAK:
+            blanks.append(cell_text)
+            continue
+        if color is not None and color == current:
+            text.extend(blanks)
+        else:
+            if current is not None:
+                runs.append((current, ''.join(text)))
+            runs.append((None, ''.join(blanks)))
+            current, text = color, []
+        blanks = []
+        if color is None:  # a line break always ends the run
+            runs.append((None, cell_text))
+        else:
+            text.append(cell_text)
+    if current is not None:
+        runs.append((current, ''.join(text)))
+    runs.append((None, ''.join(blanks)))
+    return [run for run in runs if run[1]]
+
+
+def compact_html(html: str) -> str:
+    """
+    :param html: one frame of "html/css" output, as ansify renders it
+    :return: the same frame, rendering identically, with a class-based palette;
+             anything that doesn't look like ansify's output is returned unchanged
+    """
+    if not (html.startswith(DIV_OPEN) and html.endswith(DIV_CLOSE)):
+        return html
+    body = html[len(DIV_OPEN):-len(DIV_CLOSE)]
+    cells = []
+    position = 0
+    for match in CELL.finditer(body):
+        if match.start() != position:
+            return html
+        position = match.end()
+        r, g, b, text, line_break = match.groups()
+        if line_break:
+            cells.append((None, line_break))
+        elif r is None or text.replace(BLANK, '') == '':
+            cells.append((None, text))
+        else:
+            cells.append((_hex(int(r), int(g), int(b)), text))
+    if position != len(body):
+        return html
+    runs = _runs(cells)
+
+    # a color only gets a class if declaring it once is cheaper than styling each of its runs inline,
+    # which isn't the case for colors that only appear once or twice in photos
+    scope = 'p' + hashlib.sha1(html.encode()).hexdigest()[:7]
+    counts = Counter(color for color, _ in runs if color is not None)
+    rules, opening_tags = [], {}
+    for color, count in counts.most_common():
+        inline = f'<span style="color:{color}">'
+        name = _class_name(len(rules))
+        rule = f'.{scope} .{name}{{color:{color}}}'
+        tag = f'<span class="{name}">'
+        if len(rule) + count * len(tag) < count * len(inline):
+            rules.append(rule)
+            opening_tags[color] = tag
+        else:
+            opening_tags[color] = inline
+
+    if rules:
+        ret = ['<style>', *rules, f'</style><div class="{scope}"{DIV_OPEN[4:]}']
+    else:
+        ret = [DIV_OPEN]
+    for color, text in runs:
+        if color is None:
+            ret.append(text)
+        else:
+            ret.extend((opening_tags[color], text, '</span>'))
+    ret.append(DIV_CLOSE)
+    return ''.join(ret)
@@ -0,0 +1,150 @@
+"""
+Runs asynchronous /ansify jobs in the background.
+
+Jobs are queued in the database (see JobRecord in data_model/base_model.py), so every server process
+can pick up work no matter which one accepted it, and queued jobs outlive restarts. Each process
+runs a few JobRunner threads, which claim jobs one at a time, run them through a handler supplied
+by the app, and record the result or the error. Conversions still go through the conversion
+executor, so jobs share its admission limit with synchronous requests; a job turned away because the
+executor is full goes back to the queue instead of failing.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+from .errors import AnsifierError
+
+
+DEFAULT_LEASE_S = 600  # a worker that hasn't reported progress for this long is presumed dead
+DEFAULT_KEEP_S = 24 * 3600
+PURGE_INTERVAL_S = 3600
+
+logger = logging.getLogger('debugLogger')
+
+
+class JobRunner:
+    """
+    :param open_database: returns a Database, see data_model
+    :param handler: handler(data, params, user, client, progress) -> (result, headers) runs one
+        job; data is the input, params the /ansify form, user who submitted it (or None), client
+        who it was submitted from (or None), and progress(n) is to be called with the number of
+        frames converted so far.
+        An AnsifierError fails the job with its message and http code, except for a 429, which puts
+        the job back in the queue
+    :param threads: how many jobs this process runs at once; 0 leaves jobs to other processes
+    :param lease_s: how long a claimed job may go without progress before it's claimed again
+    :param keep_s: how long ended jobs and their results are kept
+    :param max_attempts: jobs are failed after being claimed this many times without ending,
+        e.x. because they keep crashing their worker
+    """
+    def __init__(self, open_database, handler, threads: int = 1, poll_s: float = 1.0,
+                 lease_s: float = DEFAULT_LEASE_S, keep_s: float = DEFAULT_KEEP_S,
+                 max_attempts: int = 3):
+        self.open_database = open_database
+        self.handler = handler
+        self.threads = threads
+        self.poll_s = poll_s
+        self.lease_s = lease_s
+        self.keep_s = keep_s
+        self.max_attempts = max_attempts
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'JobRunner(threads={self.threads}, running={len(self._threads)})'
+
+    def start(self) -> None:
+        """ starts this process's runner threads, unless they're already running """
+        with self._lock:
+            if self._threads or self.threads <= 0:
+                return
+            self._stopping.clear()
+            for n in range(self.threads):
+                worker = f'{socket.gethostname()}:{os.getpid()}:{n}'
+                thread = threading.Thread(target=self._run, args=(worker,), daemon=True,
+                                          name=f'job-runner-{n}')
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """ stops the runner threads once they're done with their current jobs """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def notify(self) -> None:
+        """ has an idle runner thread look for work now instead of at its next poll """
+        self._wakeup.set()
+
+    def _run(self, worker: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                found = self.run_once(worker)
+                self._purge()
+            except Exception:
+                logger.exception(f'{worker} failed to run a job')
+                found = False
+            if not found:
+                self._wakeup.wait(self.poll_s)
+                self._wakeup.clear()
+
+    def run_once(self, worker: str) -> bool:
+        """
+        claims and runs one job as worker
+        :return: whether there was a job to run
+        """
+        db = self.open_database()
+        try:
+            job = db.claim_job(worker, self.lease_s)
+            if job is None:
+                return False
+            uid = job['uid']
+            if job['attempts'] > self.max_attempts:
+                db.fail_job(uid, worker, f'gave up after {self.max_attempts} attempts', 500)
+                return True
+            logger.debug(f'{worker} running job {uid}, attempt {job["attempts"]}')
+
+            def progress(n: int) -> None:
+                db.update_job(uid, worker, n)
+
+            try:
+                result, headers = self.handler(job['input'], job['params'], job['user'],
+                                               job['client'], progress)
+            except AnsifierError as e:
+                if e.http_code == 429:
+                    logger.debug(f'{worker} requeueing job {uid}: {e}')
+                    db.requeue_job(uid, worker)
+                    return False  # wait before trying again
+                db.fail_job(uid, worker, str(e), e.http_code)
+            except Exception:
+                logger.exception(f'{worker} crashed running job {uid}')
+                db.fail_job(uid, worker, 'Sorry, something went wrong', 500)
+            else:
+                if not db.finish_job(uid, worker, result, headers):
+                    logger.debug(f'{worker} lost its claim on job {uid} before finishing it')
+            return True
+        finally:
+            db.remove_sessions()
+
+    def _purge(self) -> None:
+        """ deletes expired jobs, at most once every PURGE_INTERVAL_S per process """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + PURGE_INTERVAL_S
+        db = self.open_database()
+        try:
+            deleted = db.delete_jobs_before(time.time() - self.keep_s)
+            if deleted:
+                logger.debug(f'deleted {deleted} expired jobs')
+        finally:
+            db.remove_sessions()
@@ -0,0 +1,120 @@
+"""
+Per-stage timing for /ansify requests.
+
+Each request gets a RequestTimings, and each stage of the request (validating, downloading, saving,
+converting, storing...) is wrapped in RequestTimings.stage, which adds up how long the stage took and
+how many bytes it handled. When the request ends, its timings are sent back in a Server-Timing header
+(see server_timing) and recorded into a Metrics registry, which keeps a histogram of durations and a
+byte counter per stage and renders them in the Prometheus text format for /metrics.
+Metrics are kept per process; with several server processes, each one reports its own.
+"""
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# upper bounds of the duration histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class StageTiming:
+    __slots__ = ('seconds', 'bytes')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def count(self, n_bytes: int) -> None:
+        self.bytes += n_bytes
+
+    def count_text(self, text: str) -> None:
+        self.bytes += len(text.encode())
+
+
+class UntimedStage(StageTiming):
+    """ stands in for every stage when metrics are off, so counting costs nothing """
+    __slots__ = ()
+
+    def count(self, n_bytes: int) -> None:
+        pass
+
+    def count_text(self, text: str) -> None:
+        pass
+
+
+class RequestTimings:
+    """ the stages of one request, in the order they first ran """
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        times the body of a with block; the yielded StageTiming counts the bytes the stage handles.
+        A stage that runs more than once in a request adds up.
+        """
+        timing = self.stages.get(name)
+        if timing is None:
+            timing = self.stages[name] = StageTiming()
+        start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds += time.perf_counter() - start
+
+    def server_timing(self) -> str:
+        """ :return: the value of a Server-Timing header reporting every stage, in milliseconds """
+        return ', '.join(
+            f'{name};dur={timing.seconds * 1000:.1f}'
+            + (f';desc="{timing.bytes} B"' if timing.bytes else '')
+            for name, timing in self.stages.items())
+
+
+class Metrics:
+    """
+    thread-safe histograms of stage durations and counters of stage bytes
+    :param startup_seconds: optional {phase: seconds} the process took to start up, reported as is
+    """
+    def __init__(self, buckets=BUCKETS, startup_seconds: dict | None = None):
+        self.buckets = buckets
+        self.startup_seconds = startup_seconds if startup_seconds is not None else {}
+        self._lock = threading.Lock()
+        self._histograms = {}  # stage: [count per bucket..., count, sum]
+        self._bytes = {}
+
+    def observe(self, timings: RequestTimings) -> None:
+        with self._lock:
+            for name, timing in timings.stages.items():
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = [0] * (len(self.buckets) + 1) + [0.0]
+                for i, bound in enumerate(self.buckets):
+                    if timing.seconds <= bound:
+                        histogram[i] += 1
+                histogram[-2] += 1
+                histogram[-1] += timing.seconds
+                self._bytes[name] = self._bytes.get(name, 0) + timing.bytes
+
+    def render(self) -> str:
+        """ :return: every metric in the Prometheus text exposition format """
+        with self._lock:
+            histograms = {name: list(h) for name, h in self._histograms.items()}
+            stage_bytes = dict(self._bytes)
+        lines = ['# HELP ansifier_stage_seconds Time spent in each stage of /ansify requests',
+                 '# TYPE ansifier_stage_seconds histogram']
+        for name, histogram in sorted(histograms.items()):
+            for bound, count in zip(self.buckets, histogram):
+                lines.append(f'ansifier_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'ansifier_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram[-2]}')
+            lines.append(f'ansifier_stage_seconds_sum{{stage="{name}"}} {histogram[-1]}')
+            lines.append(f'ansifier_stage_seconds_count{{stage="{name}"}} {histogram[-2]}')
+        lines += ['# HELP ansifier_stage_bytes_total Bytes handled by each stage of /ansify requests',
+                  '# TYPE ansifier_stage_bytes_total counter']
+        for name, count in sorted(stage_bytes.items()):
+            lines.append(f'ansifier_stage_bytes_total{{stage="{name}"}} {count}')
+        lines += ['# HELP ansifier_startup_seconds Time this process spent on each phase of startup',
+                  '# TYPE ansifier_startup_seconds gauge']
+        for phase, seconds in sorted(self.startup_seconds.items()):
+            lines.append(f'ansifier_startup_seconds{{phase="{phase}"}} {seconds}')
+        return '\n'.join(lines) + '\n'
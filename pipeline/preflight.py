@@ -0,0 +1,148 @@
+"""
+Pre-flight inspection of inputs, before any of their pixels are decoded.
+
+MAX_FILESIZE_B only bounds an input's compressed size; a few megabytes of PNG or GIF can decode to
+gigabytes of pixels, or to thousands of frames. inspect_input finds out what an input really is from
+its magic bytes (PIL picks an image plugin by the first bytes of a file, filetype recognizes videos),
+and reads its dimensions and frame count from its header without decoding it; PIL reads images',
+OpenCV reads videos' from their containers. plan_decode then
+estimates how much memory decoding it would take against a per-request budget: JPEGs over budget are
+decoded at a reduced scale instead (see frames.prepare_frame), anything else over budget is refused,
+as are requests for frames so far into an animation or video that reaching them means decoding too
+many. Videos are never decoded at a reduced scale, so their frames have to fit the budget as they are.
+"""
+import logging
+
+from PIL import Image
+
+from .buffers import ImageBuffer
+from .frames import PREDECODE_MODES
+
+
+DRAFT_FORMATS = ('JPEG',)  # can be decoded at a reduced scale, see Image.draft
+MAX_DRAFT_SCALE = 8  # the most a JPEG can be reduced, per side, while it's decoded
+REDUCING_GAP = 2.0  # Image.thumbnail's default, which decides how far it drafts
+RGBA_BYTES = 4  # every frame is converted to RGBA before it's converted to text
+
+logger = logging.getLogger('debugLogger')
+
+
+class InputInfo:
+    """
+    what an input is, as far as its header tells
+    :param format: PIL's name for the image format, e.x. PNG, or None for videos
+    :param size: (width, height) of the image in pixels
+    :param frames: how many frames it has, or 0 for videos whose containers don't say
+    """
+    def __init__(self, mime: str | None, format: str | None, size: tuple[int, int] = (0, 0),
+                 mode: str | None = None, frames: int = 1):
+        self.mime = mime
+        self.format = format
+        self.size = size
+        self.mode = mode
+        self.frames = frames
+
+    def __repr__(self):
+        return f'InputInfo(mime={self.mime}, format={self.format}, size={self.size}, '\
+               f'mode={self.mode}, frames={self.frames})'
+
+    @property
+    def video(self) -> bool:
+        return self.mime is not None and self.mime.startswith('video')
+
+
+def inspect_input(image: ImageBuffer) -> InputInfo:
+    """
+    raises a ValueError for inputs that are neither images PIL can read nor videos,
+    or that are larger than PIL agrees to open at all (see Image.MAX_IMAGE_PIXELS)
+    """
+    mime = image.mime()
+    if mime is not None and mime.startswith('video'):
+        info = _inspect_video(image, mime)
+        logger.debug(f'inspected {info}')
+        return info
+    try:
+        # opening only reads the header, and n_frames skips over frames without decoding them
+        with Image.open(image.open()) as rf:
+            info = InputInfo(mime, rf.format, rf.size, rf.mode, getattr(rf, 'n_frames', 1))
+    except Image.DecompressionBombError as e:
+        raise ValueError(f'input is too large to decode\n{e}')
+    except Image.UnidentifiedImageError:
+        raise ValueError('unable to recognize input format')
+    except Exception as e:
+        raise ValueError(f'unable to open image input\n{e}')
+    logger.debug(f'inspected {info}')
+    return info
+
+
+def _inspect_video(image: ImageBuffer, mime: str) -> InputInfo:
+    # optional, like in ansifier; only needed for video
+    from cv2 import CAP_PROP_FRAME_COUNT, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FRAME_WIDTH, VideoCapture
+    with image.input_file() as input_file:
+        capture = VideoCapture(input_file)
+        try:
+            if not capture.isOpened():
+                raise ValueError('unable to open video input')
+            size = (int(capture.get(CAP_PROP_FRAME_WIDTH)), int(capture.get(CAP_PROP_FRAME_HEIGHT)))
+            frames = max(int(capture.get(CAP_PROP_FRAME_COUNT)), 0)
+        finally:
+            capture.release()
+    # OpenCV decodes to BGR, which frames.open_frames converts to an RGB image
+    return InputInfo(mime, None, size, 'RGB', frames)
+
+
+def frame_bytes(size: tuple[int, int], mode: str | None, animated: bool = False) -> int:
+    """
+    :param animated: PIL keeps the previous frame of an animation around to draw the next one over
+    :return: estimated bytes it takes to hold one decoded frame and its RGBA copy
+    """
+    try:
+        bands = Image.getmodebands(mode)
+    except Exception:
+        bands = RGBA_BYTES  # modes PIL can't convert without widening, e.x. I;16, are rare
+    if animated:
+        bands += RGBA_BYTES
+    return size[0] * size[1] * (bands + RGBA_BYTES)
+
+
+def draft_scale(size: tuple[int, int], box: tuple[int, int]) -> int:
+    """
+    :param box: (width, height) a frame is shrunk to fit in, see frames.prepare_frame
+    :return: the factor a JPEG of size is reduced by while decoding it to fit box, like
+        Image.thumbnail reduces it
+    """
+    ratio = min(box[0] / size[0], box[1] / size[1]) * REDUCING_GAP
+    scale = 1
+    while scale < MAX_DRAFT_SCALE and ratio * scale * 2 <= 1:
+        scale *= 2
+    return scale
+
+
+def plan_decode(info: InputInfo, frames: int, box: tuple[int, int], budget_b: int,
+                max_frames: int = 0) -> bool:
+    """
+    :param frames: which frame is the last that has to be decoded, counting from 1; PIL decodes every
+        frame before the one it's asked for
+    :param box: see draft_scale
+    :param budget_b: most bytes decoded pixels may take up at once in one request, 0 for no limit
+    :param max_frames: most frames one request may decode, 0 for no limit
+    :return: whether the input has to be decoded at a reduced scale to stay within budget_b
+    raises a ValueError if it can't be
+    """
+    if info.frames > 0:
+        frames = min(frames, info.frames)
+    frames = max(1, frames)
+    if 0 < max_frames < frames:
+        raise ValueError(f'reaching the frames asked for would take decoding {frames} frames, '
+                         f'more than the {max_frames} allowed per request')
+    needed = frame_bytes(info.size, info.mode, info.frames > 1 and not info.video)
+    if budget_b <= 0 or needed <= budget_b:
+        return False
+    if info.format in DRAFT_FORMATS and info.mode in PREDECODE_MODES and info.frames == 1:
+        scale = draft_scale(info.size, box)
+        drafted = frame_bytes((-(-info.size[0] // scale), -(-info.size[1] // scale)), info.mode)
+        if drafted <= budget_b:
+            logger.debug(f'decoding {info} at 1/{scale} scale to fit {budget_b} bytes')
+            return True
+    raise ValueError(f'decoding {info.size[0]}x{info.size[1]} pixels would take about '
+                     f'{needed / 1e6:.0f} MB, more than the {budget_b / 1e6:g} MB allowed per request')
@@ -0,0 +1,221 @@
+"""
+Content-addressed cache of conversion results.
+
+Results are keyed on a hash of the input bytes plus the normalized conversion parameters, so the
+same image converted the same way is only ever run through ansify once per cache lifetime.
+There are two tiers:
+    - a bounded in-memory LRU, always on
+    - an optional on-disk tier under a directory, evicted oldest-first once it outgrows its budget;
+      its size is tallied as entries are written, so the directory is only scanned at startup and
+      when it has to be evicted from
+Concurrent lookups of the same missing key are collapsed into a single computation (single-flight);
+the other callers block until the first one finishes and share its result.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+
+logger = logging.getLogger('debugLogger')
+
+
+def make_key(digest: str, **params) -> str:
+    """
+    :param digest: hex digest of the input bytes, see ImageBuffer.digest
+    :param params: the conversion parameters that affect the output, already normalized
+    :return: a hex string that is safe to use as a file name
+    """
+    normalized = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f'{digest}:{normalized}'.encode()).hexdigest()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    thread-safe two-tier result cache; see module docstring
+    """
+    def __init__(self, max_bytes: int, disk_dir: str | None = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # key -> str, least recently used first
+        self._size = 0
+        self._in_flight = {}  # key -> _InFlight
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'collapsed': 0,
+                       'evictions': 0, 'disk_evictions': 0}
+        self._disk_size = 0  # bytes on disk, as of the last scan plus what's been written since
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_size = sum(size for _, size, _ in self._disk_entries())
+
+    def __repr__(self):
+        return f'ResultCache(entries={len(self._entries)}, bytes={self._size}, '\
+               f'max_bytes={self.max_bytes}, disk_dir={self.disk_dir})'
+
+    def stats(self) -> dict:
+        with self._lock:
+            ret = dict(self._stats)
+            ret['entries'] = len(self._entries)
+            ret['bytes'] = self._size
+        return ret
+
+    def get_or_compute(self, key: str, compute) -> tuple[str, str]:
+        """
+        :param compute: zero-argument callable producing the result on a miss;
+            exceptions it raises are passed on to every caller waiting on the key, never cached
+        :return: (result, status) where status is one of "hit", "miss", or "collapsed"
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return self._entries[key], 'hit'
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self._stats['collapsed'] += 1
+                leader = False
+            else:
+                flight = self._in_flight[key] = _InFlight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, 'collapsed'
+
+        try:
+            result = self._disk_get(key)
+            if result is not None:
+                status = 'hit'
+                with self._lock:
+                    self._stats['disk_hits'] += 1
+            else:
+                status = 'miss'
+                with self._lock:
+                    self._stats['misses'] += 1
+                result = compute()
+                self._disk_put(key, result)
+            self._memory_put(key, result)
+            flight.result = result
+            return result, status
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+
+    def get(self, key: str) -> str | None:
+        """
+        :return: the cached result for key, or None on a miss;
+            for callers that produce results themselves, e.x. as a stream, and put them when done
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return self._entries[key]
+        result = self._disk_get(key)
+        with self._lock:
+            self._stats['disk_hits' if result is not None else 'misses'] += 1
+        if result is not None:
+            self._memory_put(key, result)
+        return result
+
+    def put(self, key: str, result: str) -> None:
+        self._disk_put(key, result)
+        self._memory_put(key, result)
+
+    def _memory_put(self, key: str, result: str) -> None:
+        size = len(result.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = result
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.encode())
+                self._stats['evictions'] += 1
+
+    # disk tier
+    #
+    #
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key)  # pyright:ignore
+
+    def _disk_get(self, key: str) -> str | None:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as rf:
+                result = rf.read()
+            os.utime(path)  # mtime doubles as last access time for eviction
+            return result
+        except FileNotFoundError:
+            return None
+
+    def _disk_put(self, key: str, result: str) -> None:
+        if self.disk_dir is None:
+            return
+        # write-then-rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as wf:
+            wf.write(result)
+        size = os.stat(tmp_path).st_size
+        path = self._disk_path(key)
+        with self._disk_lock:
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._disk_size += size - replaced
+            if self._disk_size > self.disk_max_bytes:
+                self._disk_evict()
+
+    def _disk_entries(self) -> list:
+        """ :return: [(mtime, size, path)] of every entry on disk """
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.tmp-'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _disk_evict(self) -> None:
+        # the caller holds _disk_lock; rescanning also picks up what other processes sharing
+        # disk_dir have written since
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self._stats['disk_evictions'] += 1
+        self._disk_size = total
@@ -0,0 +1,165 @@
+"""
+Cost-aware, per-client admission for conversions, see executor.py.
+
+Each request for a conversion comes with an Admission: who's asking (a user, or an address), how
+much converting it will cost, estimated from its input's size and how many cells and frames it asks
+for before anything is decoded, and how much it weighs against other requests. Two things use that:
+  * ClientBuckets gives every client a token bucket of cost that refills at a steady rate; a client
+    that has used it all up is turned away until it refills, however idle the workers are.
+  * FairQueue orders the requests waiting for a worker: each gets a finish tag, its client's place
+    in virtual time plus its cost over its weight, and the lowest tag runs next. A client's backlog
+    of large requests then only holds up that client, and small requests from everyone else go
+    ahead of it, instead of queueing behind it first come, first served.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+
+BYTES_PER_CELL = 200  # decoding this much input takes about as long as converting one cell
+MAX_CLIENTS = 10000  # clients tracked at once, past which idle ones are forgotten
+
+
+def estimate_cost(input_b: int, width: int, height: int, frames: int = 1) -> float:
+    """
+    :param width: of the output in characters, two to a cell, see frames.prepare_frame
+    :param frames: how many frames will be converted
+    :return: estimated cost of a conversion, in cells
+    """
+    return (width // 2) * height * max(frames, 1) + input_b / BYTES_PER_CELL
+
+
+class Admission:
+    """
+    :param client: who the conversion is for, e.x. a user or an address; None shares one bucket
+    :param cost: see estimate_cost
+    :param weight: share of the workers relative to other requests, e.x. less for background jobs
+    """
+    def __init__(self, client: str | None = None, cost: float = 1.0, weight: float = 1.0):
+        self.client = client
+        self.cost = cost
+        self.weight = weight
+
+    def __repr__(self):
+        return f'Admission(client={self.client}, cost={self.cost:g}, weight={self.weight:g})'
+
+
+class ClientBuckets:
+    """
+    :param rate: cost each client's bucket refills by per second; 0 doesn't limit clients at all
+    :param burst: most cost a bucket holds. A request costing more than that is let through once its
+        client's bucket is full, leaving it in debt, so that the largest requests aren't refused
+        outright
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, rate)
+        self._buckets = {}  # client: [tokens, when they were counted]
+        self._lock = threading.Lock()
+
+    def take(self, client, cost: float) -> float:
+        """
+        takes cost out of client's bucket
+        :return: 0 if it was taken, or else how many seconds until it can be
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                if len(self._buckets) >= MAX_CLIENTS:
+                    self._forget(now)
+                bucket = self._buckets[client] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            needed = min(cost, self.burst)
+            if tokens < needed:
+                bucket[:] = [tokens, now]
+                return (needed - tokens) / self.rate
+            bucket[:] = [tokens - cost, now]
+            return 0.0
+
+    def refund(self, client, cost: float) -> None:
+        """ puts back what take took, for requests turned away for other reasons """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+
+    def _forget(self, now: float) -> None:
+        # clients whose buckets have refilled are no different from clients never seen
+        full = [client for client, (tokens, counted) in self._buckets.items()
+                if tokens + (now - counted) * self.rate >= self.burst]
+        for client in full:
+            del self._buckets[client]
+
+
+class _Waiter:
+    def __init__(self):
+        self.granted = threading.Event()
+
+
+class FairQueue:
+    """
+    lets at most `running` requests hold a slot at once, and at most `depth` more wait for one,
+    handing free slots to waiting requests in order of their finish tags (see module docstring)
+    """
+    def __init__(self, running: int, depth: int):
+        self.running = running
+        self.depth = depth
+        self.in_use = 0
+        self._virtual_time = 0.0
+        self._finish_tags = {}  # client: finish tag of its latest request
+        self._waiting = []  # heap of (finish tag, arrival, _Waiter)
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """ :return: how many requests are waiting """
+        with self._lock:
+            return len(self._waiting)
+
+    def acquire(self, admission: Admission) -> bool:
+        """
+        blocks until the admission gets a slot, which MUST then be given back with release
+        :return: False, without waiting, if it would have to wait and the queue is full
+        """
+        with self._lock:
+            if len(self._finish_tags) >= MAX_CLIENTS:
+                self._forget()
+            start = max(self._virtual_time, self._finish_tags.get(admission.client, 0.0))
+            finish = start + admission.cost / max(admission.weight, 1e-9)
+            if self.in_use < self.running and not self._waiting:
+                self.in_use += 1
+                self._finish_tags[admission.client] = finish
+                return True
+            if len(self._waiting) >= self.depth:
+                return False
+            self._finish_tags[admission.client] = finish
+            waiter = _Waiter()
+            heapq.heappush(self._waiting, (finish, next(self._arrivals), waiter))
+        waiter.granted.wait()
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiting:
+                finish, _, waiter = heapq.heappop(self._waiting)
+                self._virtual_time = max(self._virtual_time, finish)
+                waiter.granted.set()  # the slot passes straight to it
+                return
+            self.in_use -= 1
+            if self.in_use == 0:
+                # nobody is behind anybody when everything's idle
+                self._finish_tags.clear()
+                self._virtual_time = 0.0
+
+    def _forget(self) -> None:
+        # clients that are caught up with virtual time would start from it anyway
+        caught_up = [client for client, finish in self._finish_tags.items()
+                     if finish <= self._virtual_time]
+        for client in caught_up:
+            del self._finish_tags[client]
@@ -0,0 +1,129 @@
+"""
+Post-pass that shrinks ansi-escaped output by rewriting its SGR (color) escape sequences.
+
+ansify emits a full truecolor escape before every cell, even when the color hasn't changed, and even
+before cells that are only spaces. minimize_sgr replays the output against a model of the terminal's
+color state and only emits an escape right before a character whose rendering depends on it, with
+only the parameters that actually changed, foreground and background merged into one sequence.
+The result renders identically and leaves the terminal in the same final state.
+Optionally, colors can be quantized to the xterm 256 color palette, which is lossy but makes escapes
+shorter and lets more neighboring cells share one.
+"""
+import re
+
+
+SGR = re.compile('\033\\[([0-9;]*)m')
+CUBE_LEVELS = [0, 95, 135, 175, 215, 255]  # the 6x6x6 part of the xterm 256 color palette
+WHITESPACE = {' ', '\n'}  # characters whose rendering doesn't depend on the foreground color
+UNKNOWN = ('?', '?')  # color state after an escape this module doesn't model
+
+
+def quantize_256(r: int, g: int, b: int) -> int:
+    """ :return: the xterm 256 color index closest to an rgb color """
+    def nearest_level(value):
+        return min(range(6), key=lambda i: abs(CUBE_LEVELS[i] - value))
+    ri, gi, bi = nearest_level(r), nearest_level(g), nearest_level(b)
+    cube = (CUBE_LEVELS[ri], CUBE_LEVELS[gi], CUBE_LEVELS[bi])
+    gray_i = min(23, max(0, round(((r + g + b) / 3 - 8) / 10)))
+    gray = 8 + 10 * gray_i
+
+    def distance(color):
+        return (color[0] - r) ** 2 + (color[1] - g) ** 2 + (color[2] - b) ** 2
+    if distance((gray, gray, gray)) < distance(cube):
+        return 232 + gray_i
+    return 16 + 36 * ri + 6 * gi + bi
+
+
+def _parse(params: str, fg, bg, colors):
+    """
+    applies one SGR's parameters to the (fg, bg) state
+    :return: new (fg, bg), or None if the SGR does something this model doesn't track
+    """
+    codes = params.split(';') if params else ['0']
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        if code in ('', '0'):
+            fg, bg = None, None
+        elif code in ('38', '48'):
+            if codes[i + 1:i + 2] == ['2'] and len(codes) >= i + 5:
+                r, g, b = (int(c) for c in codes[i + 2:i + 5])
+                color = f'5;{quantize_256(r, g, b)}' if colors == 256 else f'2;{r};{g};{b}'
+                i += 4
+            elif codes[i + 1:i + 2] == ['5'] and len(codes) >= i + 3:
+                color = f'5;{codes[i + 2]}'
+                i += 2
+            else:
+                return None
+            if code == '38':
+                fg = color
+            else:
+                bg = color
+        elif code == '39':
+            fg = None
+        elif code == '49':
+            bg = None
+        elif code.isdigit() and (30 <= int(code) <= 37 or 90 <= int(code) <= 97):
+            fg = code
+        elif code.isdigit() and (40 <= int(code) <= 47 or 100 <= int(code) <= 107):
+            bg = code
+        else:
+            return None
+        i += 1
+    return fg, bg
+
+
+def _transition(current, target) -> str:
+    """ :return: the shortest SGR taking the terminal from the current (fg, bg) to target """
+    if current == target:
+        return ''
+    (fg, bg), (new_fg, new_bg) = current, target
+    params = []
+    if (new_fg is None and fg is not None) and (new_bg is None and bg is not None):
+        return '\033[0m'
+    if new_fg != fg:
+        params.append('39' if new_fg is None else new_fg if ';' not in new_fg else '38;' + new_fg)
+    if new_bg != bg:
+        params.append('49' if new_bg is None else new_bg if ';' not in new_bg else '48;' + new_bg)
+    return '\033[' + ';'.join(params) + 'm'
+
+
+def minimize_sgr(text: str, colors: int | None = None) -> str:
+    """
+    :param text: ansi-escaped output
+    :param colors: 256 to quantize truecolor escapes to the xterm 256 color palette, else None
+    :return: text with equivalent but minimal color escapes
+    """
+    ret = []
+    emitted = (None, None)  # the (fg, bg) the terminal has actually been set to so far
+    wanted = (None, None)  # the (fg, bg) the input has asked for so far
+    position = 0
+    for match in SGR.finditer(text):
+        emitted = _append_text(ret, text[position:match.start()], emitted, wanted)
+        position = match.end()
+        parsed = None if wanted is UNKNOWN else _parse(match.group(1), *wanted, colors)
+        if parsed is None:
+            # something this model doesn't understand; pass it through and stop assuming anything
+            if wanted is not UNKNOWN:
+                ret.append(_transition(emitted, wanted))
+            ret.append(match.group(0))
+            emitted = wanted = UNKNOWN
+        else:
+            wanted = parsed
+    emitted = _append_text(ret, text[position:], emitted, wanted)
+    if wanted is not UNKNOWN:
+        ret.append(_transition(emitted, wanted))  # leave the terminal how the input would have
+    return ''.join(ret)
+
+
+def _append_text(ret: list[str], segment: str, emitted, wanted):
+    """
+    appends segment to ret, preceded by a color change if its rendering depends on one
+    :return: what the terminal's colors are set to afterwards
+    """
+    if segment and emitted != wanted:
+        if wanted[1] is not None or not all(c in WHITESPACE for c in segment):
+            ret.append(_transition(emitted, wanted))
+            emitted = wanted
+    ret.append(segment)
+    return emitted
@@ -0,0 +1,242 @@
+"""
+Micro-benchmarks for the conversion pipeline, input handling, and the data model.
+
+Run from the repository root:
+
+    python -m tests.benchmark.bench                    # run everything, compare to baseline.json
+    python -m tests.benchmark.bench --save-baseline    # run everything, store it as the baseline
+    python -m tests.benchmark.bench --filter db/ --output results.json
+
+Every case is timed with timeit: it's run enough times per sample for a sample to take at least
+0.2s, and the median of --repeat samples is reported per call. Results are written as JSON
+(to --output, or stdout) and compared case by case with a baseline from an earlier run; the run
+fails with exit code 1 if any case got slower than the baseline by more than --threshold.
+Baselines are only comparable on the machine that recorded them, so none is checked in.
+
+Conversions run inline (ANSIFIER_CONVERT_WORKERS=0) with the result cache disabled, so they time
+the conversion itself, and the databases are throwaway SQLite files in a temporary directory.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+from itertools import chain
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_IMAGE = os.path.join(REPO_ROOT, 'tests', 'test.png')
+EXPECTED_FILE_OUTPUT = os.path.join(REPO_ROOT, 'tests', 'static', 'test_ansify_file_expected.txt')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+FORMATS = ['ansi-escaped', 'html/css', 'html/classes']
+DIMS = [20, 100, 333]
+TABLE_SIZES = [100, 1000, 5000]
+
+
+def process_imagefile_cases(app):
+    """ process_imagefile over a width/height/format matrix, as /ansify runs it for file uploads """
+    from flask import request
+
+    from pipeline.buffers import ImageBuffer
+
+    with open(TEST_IMAGE, 'rb') as rf:
+        data = rf.read()
+    with open(EXPECTED_FILE_OUTPUT, 'r') as rf:
+        expected = rf.read()
+
+    for format_ in FORMATS:
+        for dim in DIMS:
+            form = {'format': format_, 'height': str(dim), 'width': str(dim)}
+
+            def run(form=form):
+                with app.app.test_request_context('/ansify', method='POST', data=form), \
+                        ImageBuffer.from_bytes(data, app.MAX_FILESIZE_B) as image:
+                    result, _ = app.process_imagefile(request, 'benchmark', image)
+                return result
+
+            if format_ == 'ansi-escaped' and dim == 100:
+                # the same request as tests/functional/test_ansify_file.py
+                assert run() == expected, 'process_imagefile output does not match the fixture'
+            yield f'process_imagefile/{format_}/{dim}x{dim}', run
+
+
+def engine_cases(app):
+    """ each conversion engine on the same decoded frames, without decoding or resizing them """
+    from PIL import Image
+
+    from pipeline.engines import ENGINES
+    from pipeline.frames import prepare_frame
+
+    with Image.open(TEST_IMAGE) as image:
+        frames = {dim: Image.frombytes('RGBA', *prepare_frame(image, dim, dim)) for dim in DIMS}
+    for name, Engine in ENGINES.items():
+        engine = Engine()
+        for format_ in ('ansi-escaped', 'html/css'):
+            for dim, frame in frames.items():
+                def run(engine=engine, frame=frame, format_=format_):
+                    return engine.convert_frame(frame, format_, '█▓▒░ ')
+                yield f'engine/{name}/{format_}/{dim}x{dim}', run
+
+
+def save_image_cases(app):
+    """ buffering an upload from werkzeug's FileStorage vs from bytes already in memory """
+    from werkzeug.datastructures import FileStorage
+
+    with open(TEST_IMAGE, 'rb') as rf:
+        data = rf.read()
+
+    def werkzeug():
+        storage = FileStorage(stream=io.BytesIO(data), filename='test.png')
+        with app.save_image_werkzeug(storage) as image:
+            return image.size
+
+    def from_bytes():
+        with app.save_image_bytes(data) as image:
+            return image.size
+
+    yield 'save_image/werkzeug', werkzeug
+    yield 'save_image/bytes', from_bytes
+
+
+def db_cases(tmp_dir, wanted):
+    """
+    insert_art, retrieve_art, and most_recent_3 against art tables of several sizes
+    :param wanted: callable telling whether a case name is going to be run; tables are only filled
+        for sizes with a wanted case
+    """
+    import sqlalchemy
+
+    from data_model.base_model import BaseDBSession
+
+    with open(EXPECTED_FILE_OUTPUT, 'r') as rf:
+        art = rf.read()
+
+    for table_size in TABLE_SIZES:
+        if not any(wanted(f'db/{op}/{table_size}')
+                   for op in ('insert_art', 'retrieve_art', 'most_recent_3')):
+            continue
+        engine = sqlalchemy.create_engine(
+            f'sqlite:///{os.path.join(tmp_dir, f"bench-{table_size}.db")}')
+        db_session = BaseDBSession(engine)
+        # distinct arts, so that every row has its own body like real submissions do
+        uids = [db_session.insert_art(f'{art}{n}', 'ansi-escaped') for n in range(table_size)]
+        counter = iter(range(table_size, sys.maxsize))
+
+        def insert(db_session=db_session):
+            return db_session.insert_art(f'{art}{next(counter)}', 'ansi-escaped')
+
+        def retrieve(db_session=db_session, uids=uids):
+            return db_session.retrieve_art(uids[len(uids) // 2])
+
+        def recent(db_session=db_session):
+            return db_session.most_recent_3()
+
+        yield f'db/insert_art/{table_size}', insert
+        yield f'db/retrieve_art/{table_size}', retrieve
+        yield f'db/most_recent_3/{table_size}', recent
+
+
+def time_case(fn, repeat: int) -> dict:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {'median_s': statistics.median(samples),
+            'min_s': min(samples),
+            'mean_s': statistics.mean(samples),
+            'calls_per_sample': number,
+            'samples': repeat}
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_s: float) -> list[str]:
+    """ :return: a description of every case that regressed past threshold """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        slowdown = result['median_s'] / before['median_s'] - 1
+        result['baseline_median_s'] = before['median_s']
+        result['change'] = slowdown
+        # very fast cases are noisy; ignore changes too small to matter
+        if slowdown > threshold and result['median_s'] - before['median_s'] > min_delta_s:
+            regressions.append(f'{name}: {before["median_s"] * 1000:.3f}ms -> '
+                               f'{result["median_s"] * 1000:.3f}ms (+{slowdown:.0%})')
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='samples per case (default 5)')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare to')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown that counts as a regression (default 0.25, i.e. 25%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='ignore slowdowns smaller than this many ms per call (default 0.05)')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_ROOT)
+    os.environ['ANSIFIER_CONVERT_WORKERS'] = '0'
+    os.environ['ANSIFIER_CACHE_MAX_MB'] = '0'
+    os.environ.pop('ANSIFIER_CACHE_DIR', None)
+    os.environ.setdefault('ANSIFIER_DATABASE', 'Sqlite3')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)  # app.py creates the Sqlite3 backend's database in the working directory
+        try:
+            import app
+            def wanted(name):
+                return args.filter in name
+            cases = chain(process_imagefile_cases(app), engine_cases(app), save_image_cases(app),
+                          db_cases(tmp_dir, wanted))
+            for name, fn in cases:
+                if not wanted(name):
+                    continue
+                results[name] = time_case(fn, args.repeat)
+                print(f'{name:<40} {results[name]["median_s"] * 1000:10.3f}ms', file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+
+    report = {'meta': {'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'timestamp': time.time()},
+              'results': results}
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w') as wf:
+            json.dump(report, wf, indent=2)
+        print(f'saved baseline to {args.baseline}', file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as rf:
+            baseline = json.load(rf)['results']
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms / 1000)
+        report['regressions'] = regressions
+    else:
+        print(f'no baseline at {args.baseline}; run with --save-baseline to record one',
+              file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as wf:
+            json.dump(report, wf, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+"""
+End-to-end load test for /ansify, /gallery, and /login.
+
+Starts a local HTTPS image origin standing in for the remote hosts url_flow downloads from, then
+drives a mix of requests at a target concurrency and reports latency percentiles, throughput, and
+error rates per kind of request. Run from the repository root:
+
+    python -m tests.load.loadtest --concurrency 8 --duration 30
+
+By default the app is served in this process by werkzeug, which is quick to try out but shares this
+process (and its GIL) with the load generator. To size gunicorn workers, run gunicorn separately,
+trusting the origin's certificate, and point the harness at it:
+
+    python -m tests.load.loadtest --cert-dir loadtest-certs --make-cert-only
+    REQUESTS_CA_BUNDLE=loadtest-certs/cert.pem gunicorn -w 4 -b 127.0.0.1:8000 app:app
+    python -m tests.load.loadtest --cert-dir loadtest-certs --target http://127.0.0.1:8000
+
+The origin serves every --payload file (default tests/test.png) by its file name. Path prefixes
+change how a response is served, and the harness picks them per request from its options:
+    /delay/<ms>/...  waits that long before responding (--origin-latency-ms, --origin-jitter-ms)
+    /nolength/...    omits Content-Length and ends the body by closing the connection
+                     (--no-length-fraction)
+Unless --repeat-inputs is given, random bytes are appended to every payload, which image decoders
+ignore, so each request is a new input to the result cache instead of a cache hit.
+
+Needs the openssl command line tool to make the origin's self-signed certificate.
+"""
+import argparse
+import io
+import json
+import mimetypes
+import os
+import random
+import secrets
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_IMAGE = os.path.join(REPO_ROOT, 'tests', 'test.png')
+SCENARIOS = ['ansify-url', 'ansify-file', 'gallery', 'login']
+DEFAULT_MIX = 'ansify-url=4,ansify-file=4,gallery=1,login=1'
+CHUNK_SIZE_B = 64 * 1024
+
+
+# the image origin
+#
+#
+def make_cert(cert_dir: str) -> tuple[str, str]:
+    """ creates a self-signed certificate for 127.0.0.1 in cert_dir, unless there already is one """
+    cert, key = os.path.join(cert_dir, 'cert.pem'), os.path.join(cert_dir, 'key.pem')
+    if not (os.path.exists(cert) and os.path.exists(key)):
+        os.makedirs(cert_dir, exist_ok=True)
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                        '-keyout', key, '-out', cert, '-days', '30', '-subj', '/CN=127.0.0.1',
+                        '-addext', 'subjectAltName=IP:127.0.0.1'],
+                       check=True, capture_output=True)
+    return cert, key
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        delay_ms, send_length = 0.0, True
+        while len(parts) > 1:
+            if parts[0] == 'delay':
+                delay_ms, parts = float(parts[1]), parts[2:]
+            elif parts[0] == 'nolength':
+                send_length, parts = False, parts[1:]
+            else:
+                break
+        payload = self.server.payloads.get(parts[-1])
+        if payload is None:
+            self.send_error(404)
+            return
+        if self.server.vary_inputs:
+            payload += secrets.token_bytes(16)
+        time.sleep(delay_ms / 1000)
+
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(parts[-1])[0] or 'image/png')
+        if send_length:
+            self.send_header('Content-Length', str(len(payload)))
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        for i in range(0, len(payload), CHUNK_SIZE_B):
+            self.wfile.write(payload[i:i + CHUNK_SIZE_B])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_origin(payloads: dict, cert: str, key: str, vary_inputs: bool, port: int = 0):
+    """ :return: the running origin server; its url is https://127.0.0.1:<server_port> """
+    server = ThreadingHTTPServer(('127.0.0.1', port), OriginHandler)
+    server.daemon_threads = True
+    server.payloads = payloads
+    server.vary_inputs = vary_inputs
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app(work_dir: str):
+    """ serves app.py from this process, with its database in work_dir; :return: its base url """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    os.environ.setdefault('ANSIFIER_DATABASE', 'Sqlite3')
+    sys.path.insert(0, REPO_ROOT)
+    cwd = os.getcwd()
+    os.chdir(work_dir)  # the Sqlite3 backend keeps its database in the working directory
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    app.app.template_folder = os.path.join(REPO_ROOT, 'templates')
+    server = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+# the load generator
+#
+#
+class LoadTest:
+    def __init__(self, args, origin_url: str, payloads: dict):
+        self.args = args
+        self.origin_url = origin_url
+        self.payloads = payloads
+        self.mix = parse_mix(args.mix)
+        self.username = f'loadtest-{secrets.token_hex(4)}'
+        self.password = secrets.token_hex(8)
+        self.samples = []  # (scenario, seconds, status code or exception name)
+        self._lock = threading.Lock()
+        self._sent = 0
+
+    def image_url(self, rng: random.Random) -> str:
+        path = ''
+        latency = self.args.origin_latency_ms + rng.uniform(0, self.args.origin_jitter_ms)
+        if latency:
+            path += f'/delay/{latency:.0f}'
+        if rng.random() < self.args.no_length_fraction:
+            path += '/nolength'
+        return f'{self.origin_url}{path}/{rng.choice(list(self.payloads))}'
+
+    def form(self) -> dict:
+        return {'height': self.args.dim, 'width': self.args.dim, 'format': self.args.format}
+
+    def request(self, http: requests.Session, scenario: str, rng: random.Random):
+        target = self.args.target
+        if scenario == 'ansify-url':
+            return http.post(f'{target}/ansify', data={**self.form(), 'url': self.image_url(rng)})
+        if scenario == 'ansify-file':
+            name = rng.choice(list(self.payloads))
+            payload = self.payloads[name]
+            if not self.args.repeat_inputs:
+                payload += secrets.token_bytes(16)
+            return http.post(f'{target}/ansify', data=self.form(),
+                             files={'file': (name, io.BytesIO(payload))})
+        if scenario == 'gallery':
+            return http.get(f'{target}/gallery')
+        if scenario == 'login':
+            return http.post(f'{target}/login', allow_redirects=False,
+                             data={'username': self.username, 'password': self.password})
+        raise ValueError(f'unknown scenario {scenario}')
+
+    def setup(self):
+        """ creates the account the login scenario uses, and puts an art in the public gallery """
+        with requests.Session() as http:
+            response = http.post(f'{self.args.target}/create-account', allow_redirects=False,
+                                 data={'username': self.username, 'password': self.password})
+            if response.status_code >= 400:
+                raise RuntimeError(f'could not create a test account: {response.text}')
+            name = next(iter(self.payloads))
+            response = http.post(f'{self.args.target}/ansify',
+                                 data={**self.form(), 'public-gallery': 'true'},
+                                 files={'file': (name, io.BytesIO(self.payloads[name]))})
+            if response.status_code >= 400:
+                raise RuntimeError(f'could not seed the gallery: {response.text}')
+
+    def _next_request(self) -> bool:
+        with self._lock:
+            if self.args.requests and self._sent >= self.args.requests:
+                return False
+            self._sent += 1
+            return True
+
+    def worker(self, seed: int, deadline: float):
+        rng = random.Random(seed)
+        scenarios, weights = zip(*self.mix.items())
+        samples = []
+        with requests.Session() as http:
+            while time.monotonic() < deadline and self._next_request():
+                scenario = rng.choices(scenarios, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = self.request(http, scenario, rng)
+                    response.content  # the whole response, streamed ones included
+                    outcome = response.status_code
+                except requests.RequestException as e:
+                    outcome = type(e).__name__
+                samples.append((scenario, time.perf_counter() - start, outcome))
+        with self._lock:
+            self.samples.extend(samples)
+
+    def run(self) -> dict:
+        self.setup()
+        deadline = time.monotonic() + (self.args.duration if self.args.duration else 1e9)
+        threads = [threading.Thread(target=self.worker, args=(self.args.seed + n, deadline))
+                   for n in range(self.args.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(self.samples, time.perf_counter() - start)
+
+
+def parse_mix(mix: str) -> dict:
+    ret = {}
+    for item in mix.split(','):
+        scenario, _, weight = item.partition('=')
+        if scenario not in SCENARIOS:
+            raise ValueError(f'unknown scenario {scenario}, must be one of {SCENARIOS}')
+        ret[scenario] = float(weight or 1)
+    return ret
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """ nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))  # ceil
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples: list, elapsed_s: float) -> dict:
+    by_scenario = defaultdict(list)
+    for sample in samples:
+        by_scenario[sample[0]].append(sample)
+    by_scenario['all'] = samples
+
+    ret = {'elapsed_s': elapsed_s, 'scenarios': {}}
+    for scenario, scenario_samples in by_scenario.items():
+        latencies = sorted(seconds for _, seconds, _ in scenario_samples)
+        outcomes = Counter(str(outcome) for _, _, outcome in scenario_samples)
+        errors = sum(1 for _, _, outcome in scenario_samples
+                     if not isinstance(outcome, int) or outcome >= 400)
+        ret['scenarios'][scenario] = {
+            'requests': len(scenario_samples),
+            'throughput_rps': len(scenario_samples) / elapsed_s if elapsed_s else 0.0,
+            'error_rate': errors / len(scenario_samples) if scenario_samples else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'outcomes': dict(outcomes),
+        }
+    return ret
+
+
+def print_report(report: dict, file=sys.stderr):
+    print(f'{"scenario":<12} {"requests":>8} {"req/s":>8} {"errors":>7} '
+          f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}  outcomes', file=file)
+    for scenario, stats in sorted(report['scenarios'].items(), key=lambda i: i[0] == 'all'):
+        print(f'{scenario:<12} {stats["requests"]:>8} {stats["throughput_rps"]:>8.1f} '
+              f'{stats["error_rate"]:>7.1%} {stats["p50_ms"]:>9.1f} {stats["p95_ms"]:>9.1f} '
+              f'{stats["p99_ms"]:>9.1f}  {stats["outcomes"]}', file=file)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--target', help='base url of a running server (default: serve app.py '
+                                         'from this process)')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run for; 0 to run '
+                                                                   'until --requests are sent')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f'relative weights of each kind of request (default {DEFAULT_MIX})')
+    parser.add_argument('--format', default='ansi-escaped', help='output format to ask /ansify for')
+    parser.add_argument('--dim', type=int, default=100, help='output width and height to ask for')
+    parser.add_argument('--payload', action='append', help='image file for the origin to serve and '
+                        'to upload; may be repeated (default tests/test.png)')
+    parser.add_argument('--repeat-inputs', action='store_true',
+                        help='send identical inputs, so conversions can be served from cache')
+    parser.add_argument('--origin-latency-ms', type=float, default=0.0)
+    parser.add_argument('--origin-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--no-length-fraction', type=float, default=0.0,
+                        help='fraction of origin responses sent without Content-Length')
+    parser.add_argument('--origin-port', type=int, default=0)
+    parser.add_argument('--cert-dir', help='where to keep the origin certificate '
+                                           '(default: a temporary directory)')
+    parser.add_argument('--make-cert-only', action='store_true',
+                        help='create the certificate in --cert-dir and exit')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the report here as JSON')
+    args = parser.parse_args(argv)
+    if not args.duration and not args.requests:
+        parser.error('one of --duration or --requests is required')
+
+    payloads = {}
+    for path in args.payload or [TEST_IMAGE]:
+        with open(path, 'rb') as rf:
+            payloads[os.path.basename(path)] = rf.read()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cert, key = make_cert(args.cert_dir or os.path.join(work_dir, 'certs'))
+        if args.make_cert_only:
+            print(cert)
+            return 0
+        origin = start_origin(payloads, cert, key, not args.repeat_inputs, args.origin_port)
+        origin_url = f'https://127.0.0.1:{origin.server_port}'
+        if args.target is None:
+            os.environ['REQUESTS_CA_BUNDLE'] = cert  # so the in-process app trusts the origin
+            args.target = start_app(work_dir)
+        print(f'origin {origin_url}, target {args.target}, {args.concurrency} clients',
+              file=sys.stderr)
+
+        report = LoadTest(args, origin_url, payloads).run()
+        report['config'] = {k: v for k, v in vars(args).items() if k != 'payload'}
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as wf:
+                json.dump(report, wf, indent=2)
+        origin.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,8 @@
 import time
+
+import pytest
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from uuid import UUID, uuid4
 
 
@@ -58,5 +61,136 @@ class TestAnsiArtRecord():
         assert retrieved_art is None,\
             f'expected None when retrieving deleted art, found {retrieved_art}'
 
-    # TODO test_most_recent_3?
+    def test_most_recent_3(self, mock_db):
+        uids = [mock_db.insert_art(f'art{i}', 'ansi-escaped') for i in range(4)]
+        mock_db.insert_art('private art', 'ansi-escaped', 'someuser')
+        recent = mock_db.most_recent_3()
+        assert len(recent) == 3
+        assert uids[0] not in ''.join(recent), 'oldest art should be excluded'
+        assert 'private art' not in ''.join(recent)
+
+    def test_list_arts_pages(self, mock_db):
+        """
+        page through a feed with ties on timestamp and verify every entry is seen exactly once,
+        newest first, without loading the art column unless asked
+        """
+        uids = []
+        for i in range(7):
+            uids.append(mock_db.insert_art(f'art{i}', 'ansi-escaped', 'someuser'))
+        with mock_db.engine.connect() as con:
+            con.execute(text('UPDATE art SET timestamp = 1000 WHERE user = "someuser";'))
+            con.commit()
+        mock_db.insert_art('public art', 'ansi-escaped')
+
+        seen = []
+        cursor = None
+        while True:
+            arts, cursor = mock_db.list_arts(user='someuser', cursor=cursor, limit=3)
+            assert all('art' not in art for art in arts)
+            seen.extend(art['uid'] for art in arts)
+            if cursor is None:
+                break
+        assert sorted(seen) == sorted(uids)
+        assert seen == sorted(uids, reverse=True), 'uid breaks timestamp ties, descending'
+
+        arts, cursor = mock_db.list_arts(include_art=True)
+        assert [art['art'] for art in arts] == ['public art'] and cursor is None
+
+    def test_list_arts_bad_cursor(self, mock_db):
+        with pytest.raises(ValueError):
+            mock_db.list_arts(cursor='not a cursor')
+
+    def test_identical_arts_share_a_body(self, mock_db):
+        """
+        the same art submitted to both galleries is stored once,
+        and its body outlives the first of its entries to be deleted
+        """
+        with open('./tests/static/test_ansify_url_expected.txt', 'r') as rf:
+            ansi_art = rf.read()
+        public_uid = mock_db.insert_art(ansi_art, 'ansi-escaped')
+        private_uid = mock_db.insert_art(ansi_art, 'ansi-escaped', 'someuser')
+        count_bodies = text('SELECT COUNT(*) FROM art_bodies;')
+        with mock_db.engine.connect() as con:
+            assert con.execute(count_bodies).first()[0] == 1
+        assert mock_db.retrieve_art(public_uid) == ansi_art
+        assert mock_db.retrieve_art(private_uid, 'someuser') == ansi_art
+
+        mock_db.delete_art(public_uid)
+        assert mock_db.retrieve_art(private_uid, 'someuser') == ansi_art
+        mock_db.delete_art(private_uid)
+        with mock_db.engine.connect() as con:
+            assert con.execute(count_bodies).first()[0] == 0
+
+    def test_insert_retries_deadlocks(self, mock_db, monkeypatch):
+        """ an insert rolled back as a MySQL deadlock victim is run again """
+        with open('./tests/static/test_ansify_url_expected.txt', 'r') as rf:
+            ansi_art = rf.read()
+        commit = mock_db.session.commit
+        conflicts = [OperationalError('INSERT', {}, Exception(1213, 'Deadlock found')),
+                     OperationalError('INSERT', {}, Exception(1205, 'Lock wait timeout'))]
+
+        def conflicting_commit():
+            if conflicts:
+                raise conflicts.pop(0)
+            commit()
+
+        monkeypatch.setattr(mock_db.session, 'commit', conflicting_commit)
+        uid = mock_db.insert_art(ansi_art, 'ansi-escaped')
+        assert mock_db.retrieve_art(uid) == ansi_art
+
+        conflicts.append(OperationalError('INSERT', {}, Exception(2006, 'Server has gone away')))
+        with pytest.raises(OperationalError):
+            mock_db.insert_art(ansi_art, 'ansi-escaped')
+
+    def test_missing_body_raises(self, mock_db):
+        """ an entry whose body is gone is an error, not an empty art """
+        with open('./tests/static/test_ansify_url_expected.txt', 'r') as rf:
+            ansi_art = rf.read()
+        uid = mock_db.insert_art(ansi_art, 'ansi-escaped')
+        with mock_db.engine.begin() as con:
+            con.execute(text('DELETE FROM art_bodies;'))
+        with pytest.raises(LookupError):
+            mock_db.retrieve_art(uid)
+        with pytest.raises(LookupError):
+            mock_db.list_arts(include_art=True)
+
+    def test_insert_arts(self, mock_db):
+        """ a batch keeps given uids and timestamps, and shares bodies within itself too """
+        with open('./tests/static/test_ansify_url_expected.txt', 'r') as rf:
+            ansi_art = rf.read()
+        given_uid = str(uuid4())
+        uids = mock_db.insert_arts([
+            {'art': ansi_art, 'format': 'ansi-escaped', 'uid': given_uid, 'timestamp': 1},
+            {'art': ansi_art, 'format': 'ansi-escaped', 'user': 'someuser'},
+            {'art': 'tiny', 'format': 'html/css'}])
+        assert uids[0] == given_uid
+        assert mock_db.retrieve_art(uids[0]) == ansi_art
+        assert mock_db.retrieve_art(uids[1], 'someuser') == ansi_art
+        assert mock_db.retrieve_art(uids[2]) == 'tiny'
+        with mock_db.engine.connect() as con:
+            assert con.execute(text('SELECT COUNT(*) FROM art_bodies;')).first()[0] == 1
+            assert con.execute(text(f'SELECT timestamp FROM art WHERE uid="{given_uid}"')
+                               ).first()[0] == 1
+        assert mock_db.insert_arts([]) == []
+
+    def test_insert_arts_batches(self, mock_db):
+        arts = ({'art': f'art {n}', 'format': 'ansi-escaped', 'uid': f'uid-{n:02}'}
+                for n in range(25))
+        assert len(mock_db.insert_arts(arts, batch_size=10)) == 25
+        again = [{'art': 'new', 'format': 'ansi-escaped', 'uid': uid} for uid in ('uid-03', 'uid-99')]
+        assert mock_db.insert_arts(again, skip_existing=True) == ['uid-99']
+        assert mock_db.retrieve_art('uid-03') == 'art 3'
+
+    def test_iter_arts(self, mock_db):
+        with open('./tests/static/test_ansify_url_expected.txt', 'r') as rf:
+            ansi_art = rf.read()
+        uids = sorted(mock_db.insert_art(f'{ansi_art}{n}' if n % 2 else f'art {n}', 'ansi-escaped',
+                                         'someuser' if n % 3 else None) for n in range(7))
+        arts = list(mock_db.iter_arts(chunk_size=3))
+        assert [art['uid'] for art in arts] == uids
+        for art in arts:
+            assert art['art'] == mock_db.retrieve_art(art['uid'], art['user'])
+            assert set(art) == {'uid', 'format', 'timestamp', 'user', 'size', 'art'}
+        assert [art['uid'] for art in mock_db.iter_arts(chunk_size=3, after=uids[4])] == uids[5:]
+
     # TODO test negative case behaviors (uuid not found, etc)
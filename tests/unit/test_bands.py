@@ -0,0 +1,53 @@
+import pytest
+
+from pipeline.bands import BandStream, split_bands
+from pipeline.convert import convert
+from pipeline.executor import ConversionExecutor
+
+
+class TestBands():
+
+    def test_split_bands(self):
+        pixels = bytes(range(3 * 4)) * 10  # 3x10 RGBA
+        bands = split_bands((3, 10), pixels, 4)
+        assert [size for size, _ in bands] == [(3, 2), (3, 3), (3, 2), (3, 3)]
+        assert b''.join(band for _, band in bands) == pixels
+        assert len(split_bands((3, 2), pixels[:24], 4)) == 2
+
+    @pytest.mark.parametrize('output_format', ['ansi-escaped', 'html/css'])
+    def test_matches_whole_frame_conversion(self, output_format):
+        """ bands put back together are exactly what converting the whole image produces """
+        with open('./tests/test.png', 'rb') as rbf:
+            data = rbf.read()
+        executor = ConversionExecutor(workers=4, queue_depth=1)
+        try:
+            for dim in [4, 50, 100]:
+                bands = list(BandStream(executor, data, output_format, '█▓▒░ ', dim, dim))
+                assert len(bands) > 1 or dim == 4  # too few rows to be worth splitting
+                assert ''.join(bands) == convert(data, output_format, '█▓▒░ ', dim, dim)
+        finally:
+            executor.shutdown()
+
+    def test_on_complete_and_ticket(self):
+        with open('./tests/test.png', 'rb') as rbf:
+            data = rbf.read()
+        executor = ConversionExecutor(workers=0, queue_depth=0)
+        completed = []
+        stream = BandStream(executor, data, 'ansi-escaped', '█▓▒░ ', 40, 40, completed.append)
+        output = ''.join(stream)
+        assert completed == [output]
+        assert executor.run(lambda: 'admitted'), 'the stream gives back its ticket when exhausted'
+
+        stream = BandStream(executor, data, 'ansi-escaped', '█▓▒░ ', 40, 40, completed.append)
+        next(stream)
+        stream.close()
+        assert len(completed) == 1, 'abandoned streams are not complete'
+        assert executor.run(lambda: 'admitted'), 'the stream gives back its ticket when closed'
+
+    def test_bad_input(self):
+        executor = ConversionExecutor(workers=0, queue_depth=0)
+        with pytest.raises(ValueError):
+            BandStream(executor, b'not an image', 'ansi-escaped', '█▓▒░ ', 40, 40)
+        with pytest.raises(ValueError):
+            BandStream(executor, b'', 'html/classes', '█▓▒░ ', 40, 40)
+        assert executor.run(lambda: 'admitted')
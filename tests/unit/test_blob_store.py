@@ -0,0 +1,78 @@
+import pytest
+import sqlalchemy
+from sqlalchemy import text
+
+from data_model.base_model import BaseDBSession
+from data_model.blob_store import LocalBlobStore
+
+
+class TestLocalBlobStore():
+
+    def test_content_addressed(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path), threshold_b=0)
+        key = store.put(b'some art')
+        assert key == store.key_for(b'some art')
+        assert store.put(b'some art') == key, 'identical blobs share a key'
+        assert store.read(key) == b'some art'
+        store.delete(key)
+        assert not store.exists(key)
+
+    def test_rejects_bad_keys(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path), threshold_b=0)
+        with pytest.raises(ValueError):
+            store.open('../../etc/passwd')
+
+
+class TestBlobBackedArt():
+
+    @pytest.fixture
+    def blob_db(self, tmp_path):
+        class BlobDBSession(BaseDBSession):
+            blob_store = LocalBlobStore(str(tmp_path), threshold_b=1500)
+            def __init__(self):
+                self.engine = sqlalchemy.create_engine('sqlite:///:memory:')
+                super().__init__(self.engine)
+        return BlobDBSession()
+
+    def test_large_art_goes_to_blob_store(self, blob_db):
+        """ only a pointer is kept in the row for arts past the threshold; small arts stay inline """
+        big_art = '\033[38;2;1;2;3m██' * 100
+        big_uid = blob_db.insert_art(big_art, 'ansi-escaped')
+        small_uid = blob_db.insert_art('small', 'ansi-escaped')
+        with blob_db.engine.connect() as con:
+            rows = dict(con.execute(text('SELECT uid, art_bodies.blob_key FROM art LEFT JOIN '
+                                         'art_bodies ON art.body_hash = art_bodies.hash;')).all())
+        assert rows[big_uid] is not None and rows[small_uid] is None
+        assert blob_db.retrieve_art(big_uid) == big_art
+        assert ''.join(blob_db.retrieve_art_stream(big_uid, chunk_size=7)) == big_art
+        assert ''.join(blob_db.retrieve_art_stream(small_uid)) == 'small'
+        arts, _ = blob_db.list_arts(include_art=True)
+        assert sorted(art['art'] for art in arts) == sorted([big_art, 'small'])
+
+    def test_delete_releases_unreferenced_blob(self, blob_db):
+        big_art = 'x' * 3000
+        first = blob_db.insert_art(big_art, 'ansi-escaped')
+        second = blob_db.insert_art(big_art, 'ansi-escaped', 'someuser')
+        key = blob_db.blob_store.key_for(big_art.encode())
+        blob_db.delete_art(first)
+        assert blob_db.blob_store.exists(key), 'blob is still referenced by the second row'
+        blob_db.delete_art(second)
+        assert not blob_db.blob_store.exists(key)
+
+
+class TestSchemaUpgrade():
+
+    def test_adds_missing_columns(self):
+        """ tables created before a nullable column existed get it added on startup """
+        engine = sqlalchemy.create_engine('sqlite:///:memory:')
+        with engine.begin() as con:
+            con.execute(text('CREATE TABLE art (uid VARCHAR(37) PRIMARY KEY, art TEXT NOT NULL, '
+                             'format VARCHAR(64) NOT NULL, timestamp INTEGER NOT NULL, '
+                             'user VARCHAR(30));'))
+            con.execute(text('INSERT INTO art VALUES ("old", "old art", "ansi-escaped", 1, NULL);'))
+        class OldDBSession(BaseDBSession):
+            def __init__(self):
+                super().__init__(engine)
+        db = OldDBSession()
+        assert db.retrieve_art('old') == 'old art'
+        assert db.retrieve_art(db.insert_art('new art', 'ansi-escaped')) == 'new art'
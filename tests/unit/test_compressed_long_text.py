@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import text
+
+from data_model.base_model import CompressedLongText
+
+
+FIXTURES = ['./tests/static/test_ansify_file_expected.txt',
+            './tests/static/test_ansify_url_expected.txt']
+
+
+class TestCompressedLongText():
+
+    @pytest.mark.parametrize('fixture', FIXTURES)
+    def test_round_trip_and_ratio(self, fixture):
+        """ compression must be lossless, and should pay for itself many times over on real art """
+        with open(fixture, 'r') as rf:
+            art = rf.read()
+        column_type = CompressedLongText('zlib')
+        stored = column_type.process_bind_param(art, None)
+        ratio = len(art.encode()) / len(stored.encode())
+        print(f'{fixture}: {len(art.encode())} -> {len(stored.encode())} bytes, ratio {ratio:.1f}')
+        assert column_type.process_result_value(stored, None) == art
+        assert ratio > 3
+
+    def test_stored_compressed(self, mock_db):
+        """ art is compressed at rest and decompressed transparently on retrieval """
+        with open(FIXTURES[0], 'r') as rf:
+            art = rf.read()
+        uid = mock_db.insert_art(art, 'ansi-escaped')
+        with mock_db.engine.connect() as con:
+            stored = con.execute(text(f'SELECT art_bodies.art FROM art JOIN art_bodies '
+                                      f'ON art.body_hash = art_bodies.hash '
+                                      f'WHERE uid = "{uid}";')).first()[0]
+        assert stored.startswith(CompressedLongText.MAGIC)
+        assert len(stored) < len(art)
+        assert mock_db.retrieve_art(uid) == art
+
+    def test_reads_uncompressed_rows(self):
+        """ rows written before compression existed are returned unchanged """
+        with open(FIXTURES[1], 'r') as rf:
+            art = rf.read()
+        assert CompressedLongText('zlib').process_result_value(art, None) == art
+
+    def test_invalid_codec(self):
+        with pytest.raises(ValueError):
+            CompressedLongText('lzma')
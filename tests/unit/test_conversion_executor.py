@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+import pytest
+
+from concurrent.futures.process import BrokenProcessPool
+
+from pipeline.convert import convert
+from pipeline.errors import AnsifierError
+from pipeline.executor import ConversionExecutor
+
+
+class TestConversionExecutor():
+
+    def test_rejects_when_full(self):
+        """ once every worker is busy and every queue slot is taken, new work gets a 429 """
+        executor = ConversionExecutor(workers=0, queue_depth=1)
+        release = threading.Event()
+        started = threading.Semaphore(0)
+        def block():
+            started.release()
+            release.wait()
+            return 'done'
+        threads = [threading.Thread(target=executor.run, args=(block,)) for _ in range(2)]
+        threads[0].start()
+        started.acquire()
+        threads[1].start()  # waits for the only worker
+        while len(executor._queue) < 1:
+            time.sleep(0.01)
+        with pytest.raises(AnsifierError) as e:
+            executor.run(block)
+        assert e.value.http_code == 429
+        assert int(e.value.headers['Retry-After']) >= 1
+        release.set()
+        for t in threads:
+            t.join()
+        assert executor.run(lambda: 'admitted') == 'admitted'
+
+    def test_replaces_broken_pool(self):
+        """ a worker process dying fails the conversion it was running, and no other """
+        executor = ConversionExecutor(workers=1, queue_depth=0)
+        try:
+            with pytest.raises(BrokenProcessPool):
+                executor.run(os._exit, 1)
+            assert executor.run(abs, -1) == 1
+        finally:
+            executor.shutdown()
+
+    def test_share(self):
+        """ each ticket gets an even share of what the pool can have in flight """
+        executor = ConversionExecutor(workers=4, queue_depth=0)
+        tickets = [executor.admit()]
+        assert executor.share() == 8
+        tickets.append(executor.admit())
+        assert executor.share() == 4
+        tickets += [executor.admit(), executor.admit()]
+        assert executor.share() == 2
+        for ticket in tickets:
+            executor.release(ticket)
+
+    def test_process_pool_conversion(self):
+        """ conversions on the pool match the known-good output for the sample file """
+        with open('./tests/static/test_ansify_file_expected.txt', 'r') as rf:
+            expected = rf.read()
+        with open('./tests/test.png', 'rb') as rbf:
+            data = rbf.read()
+        executor = ConversionExecutor(workers=1, queue_depth=0)
+        try:
+            observed = executor.run(convert, data, 'ansi-escaped', '█▓▒░ ', 100, 100)
+            with pytest.raises(ValueError):
+                executor.run(convert, b'not an image', 'ansi-escaped', '█▓▒░ ', 100, 100)
+        finally:
+            executor.shutdown()
+        assert observed == expected
@@ -0,0 +1,34 @@
+import sqlalchemy
+
+from data_model.base_model import BaseDBSession
+
+
+class CountingDBSession(BaseDBSession):
+    engines_created = 0
+
+    def __init__(self):
+        super().__init__(self.get_engine())
+
+    @classmethod
+    def create_engine(cls):
+        cls.engines_created += 1
+        return sqlalchemy.create_engine('sqlite:///:memory:')
+
+
+class TestDBSession():
+
+    def test_engine_shared_across_instances(self):
+        """ constructing the backend repeatedly must not build new engines or session registries """
+        first = CountingDBSession()
+        second = CountingDBSession()
+        assert CountingDBSession.engines_created == 1
+        assert first.session is second.session
+        uid = first.insert_art('art', 'ansi-escaped')
+        assert second.retrieve_art(uid) == 'art'
+
+    def test_remove_sessions(self):
+        """ removing sessions at the end of a request leaves the backend usable for the next one """
+        db = CountingDBSession()
+        uid = db.insert_art('art', 'ansi-escaped')
+        BaseDBSession.remove_sessions()
+        assert CountingDBSession().retrieve_art(uid) == 'art'
@@ -0,0 +1,55 @@
+import io
+
+from PIL import Image
+
+from pipeline.delta import CLEAR, RESET, DeltaEncoder
+from pipeline.executor import ConversionExecutor
+from pipeline.frames import FrameStream
+
+
+def make_moving_square_gif(n_frames):
+    frames = []
+    for i in range(n_frames):
+        frame = Image.new('RGBA', (40, 40), (0, 100, 50, 255))
+        frame.paste((255, 0, 0, 255), (i * 2, i * 2, i * 2 + 4, i * 2 + 4))
+        frames.append(frame)
+    gif = io.BytesIO()
+    frames[0].save(gif, format='GIF', save_all=True, append_images=frames[1:])
+    return gif.getvalue()
+
+
+RED = '\033[38;2;255;0;0m██'
+BLUE = '\033[38;2;0;0;255m██'
+
+
+class TestDeltaEncoder():
+
+    def test_keyframe_matches_ansi_escaped(self):
+        """ a keyframe is a clear-screen escape plus exactly what ansi-escaped would have sent """
+        encoder = DeltaEncoder()
+        assert encoder.encode([[RED, '  '], [BLUE, RED]]) == \
+            CLEAR + RED + '  \n' + BLUE + RED + '\n' + RESET
+
+    def test_delta_only_changed_cells(self):
+        """ changed cells are written after one cursor movement per run """
+        encoder = DeltaEncoder()
+        encoder.encode([[RED, RED, RED], [RED, RED, RED]])
+        delta = encoder.encode([[RED, BLUE, BLUE], [RED, RED, '  ']])
+        assert delta == '\033[1;3H' + BLUE + BLUE + '\033[2;5H' + '  ' + '\033[3;1H' + RESET
+        assert encoder.encode([[RED, BLUE, BLUE], [RED, RED, '  ']]) == '\033[3;1H' + RESET
+
+    def test_keyframe_interval(self):
+        encoder = DeltaEncoder(keyframe_interval=2)
+        frames = [encoder.encode([[RED]]) for _ in range(4)]
+        assert [frame.startswith(CLEAR) for frame in frames] == [True, False, True, False]
+
+    def test_smaller_than_full_frames(self):
+        """ frames that barely change cost far less as deltas than as full frames """
+        executor = ConversionExecutor(workers=0, queue_depth=1)
+        gif = make_moving_square_gif(10)
+        full = list(FrameStream(executor, gif, 'ansi-escaped', '█▓▒░ ', 40, 40, 0, 10, 1))
+        delta = list(FrameStream(executor, gif, 'ansi-delta', '█▓▒░ ', 40, 40, 0, 10, 1))
+        assert delta[0] == full[0], 'keyframes match ansi-escaped frames exactly'
+        assert ''.join(delta).count(CLEAR) == 1
+        print(f'full frames: {len("".join(full))} chars, deltas: {len("".join(delta))} chars')
+        assert len(''.join(delta)) * 3 < len(''.join(full))
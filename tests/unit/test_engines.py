@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from PIL import Image
+
+from pipeline.engines import AnsifierEngine, NumpyEngine, get_engine
+from pipeline.frames import prepare_frame
+
+
+def make_transparent_png():
+    image = Image.new('RGBA', (50, 30), (0, 0, 0, 0))
+    image.paste((10, 200, 30, 128), (0, 0, 20, 30))
+    png = io.BytesIO()
+    image.save(png, format='PNG')
+    return png.getvalue()
+
+
+@pytest.fixture(params=['photo', 'transparent'])
+def frame(request):
+    if request.param == 'photo':
+        with open('./tests/test.png', 'rb') as rbf:
+            data = rbf.read()
+    else:
+        data = make_transparent_png()
+    size, pixels = prepare_frame(Image.open(io.BytesIO(data)), 200, 200)
+    return Image.frombytes('RGBA', size, pixels)
+
+
+class TestEngines():
+
+    @pytest.mark.parametrize('output_format', ['ansi-escaped', 'html/css'])
+    @pytest.mark.parametrize('characters', ['█▓▒░ ', ' .:-=+*#%@', '<>&"x '])
+    def test_numpy_matches_ansifier(self, frame, output_format, characters):
+        assert NumpyEngine().convert_frame(frame, output_format, characters) == \
+            AnsifierEngine().convert_frame(frame, output_format, characters)
+
+    def test_numpy_matches_fixture(self):
+        with open('./tests/test.png', 'rb') as rbf:
+            data = rbf.read()
+        with open('./tests/static/test_ansify_file_expected.txt', 'r') as rf:
+            expected = rf.read()
+        assert NumpyEngine().convert(io.BytesIO(data), 'image/png', 'ansi-escaped', '█▓▒░ ',
+                                     100, 100) == expected
+
+    def test_invalid_format(self, frame):
+        for engine in (AnsifierEngine(), NumpyEngine()):
+            with pytest.raises(ValueError):
+                engine.convert_frame(frame, 'ansi-delta', '█▓▒░ ')
+
+    def test_get_engine(self, monkeypatch):
+        monkeypatch.setattr('pipeline.engines._engine', None)
+        monkeypatch.setenv('ANSIFIER_ENGINE', 'numpy')
+        assert isinstance(get_engine(), NumpyEngine)
+        assert get_engine() is get_engine()
+        monkeypatch.setattr('pipeline.engines._engine', None)
+        monkeypatch.setenv('ANSIFIER_ENGINE', 'nonsense')
+        with pytest.raises(ValueError):
+            get_engine()
@@ -0,0 +1,48 @@
+import io
+
+from PIL import Image
+
+from pipeline.convert import convert
+from pipeline.executor import ConversionExecutor
+from pipeline.frames import FrameStream
+
+
+def make_gif(n_frames):
+    frames = [Image.new('RGBA', (40, 40), (i * 20, 100, 50, 255)) for i in range(n_frames)]
+    gif = io.BytesIO()
+    frames[0].save(gif, format='GIF', save_all=True, append_images=frames[1:])
+    return gif.getvalue()
+
+
+class TestFrameStream():
+
+    def test_frame_range_and_stride(self):
+        """ only frames start, start + stride, ... before end are produced, in order """
+        executor = ConversionExecutor(workers=0, queue_depth=1)
+        stream = FrameStream(executor, make_gif(10), 'ansi-escaped', '█▓▒░ ', 10, 10,
+                             start=2, end=9, stride=3)
+        frames = list(stream)
+        assert len(frames) == 3
+        assert [frame.split('m')[0] for frame in frames] == \
+            ['\033[2J\033[H\033[38;2;40;100;50', '\033[2J\033[H\033[38;2;100;100;50',
+             '\033[2J\033[H\033[38;2;160;100;50']
+        assert executor.run(lambda: 'admitted'), 'the stream gives back its ticket when exhausted'
+
+    def test_matches_single_frame_conversion(self):
+        """ a frame converted by the stream is identical to the same frame converted by ansify """
+        with open('./tests/test.png', 'rb') as rbf:
+            data = rbf.read()
+        executor = ConversionExecutor(workers=0, queue_depth=1)
+        for output_format in ['ansi-escaped', 'html/css']:
+            stream = FrameStream(executor, data, output_format, '█▓▒░ ', 50, 50,
+                                 start=0, end=10, stride=1)
+            separator = '\033[2J\033[H' if output_format == 'ansi-escaped' else ''
+            assert list(stream) == [separator + convert(data, output_format, '█▓▒░ ', 50, 50)]
+
+    def test_close_releases_ticket(self):
+        executor = ConversionExecutor(workers=0, queue_depth=0)
+        stream = FrameStream(executor, make_gif(3), 'ansi-escaped', '█▓▒░ ', 10, 10,
+                             start=0, end=3, stride=1)
+        next(stream)
+        stream.close()
+        assert executor.run(lambda: 'admitted') == 'admitted'
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+import sqlalchemy
+
+from data_model.base_model import BaseDBSession
+from pipeline.gallery_writer import MAX_ATTEMPTS, GalleryWriter
+
+
+class FileDBSession(BaseDBSession):
+    """ unlike an in-memory database, visible to the writer's thread """
+    def __init__(self, path):
+        super().__init__(sqlalchemy.create_engine(f'sqlite:///{path}'))
+
+
+class TestGalleryWriter():
+
+    def test_synchronous(self, mock_db):
+        writer = GalleryWriter(lambda: mock_db, max_delay_s=0)
+        uid = writer.put('art', 'ansi-escaped')
+        assert mock_db.retrieve_art(uid) == 'art'
+
+    def test_pending_arts_are_readable(self, mock_db):
+        writer = GalleryWriter(lambda: mock_db, max_delay_s=60)
+        uid = writer.put('art', 'ansi-escaped', 'someuser')
+        assert mock_db.retrieve_art(uid, 'someuser') is None
+        assert writer.get(uid, 'someuser') == 'art'
+        assert writer.get(uid) is None
+        writer.close()
+        assert writer.get(uid, 'someuser') is None
+        assert mock_db.retrieve_art(uid, 'someuser') == 'art'
+
+    def test_flushes_in_order(self, mock_db):
+        writer = GalleryWriter(lambda: mock_db, max_batch=2, max_delay_s=60)
+        uids = [writer.put(f'art {n}', 'ansi-escaped') for n in range(5)]
+        assert writer.flush() == 5
+        assert [art['uid'] for art in mock_db.list_arts()[0]] == uids[::-1]
+        writer.close()
+
+    def test_full_buffer_is_written_by_put(self, mock_db):
+        writer = GalleryWriter(lambda: mock_db, max_batch=2, max_delay_s=60, max_pending=3)
+        uids = [writer.put('art', 'ansi-escaped') for _ in range(3)]
+        assert all(mock_db.retrieve_art(uid) == 'art' for uid in uids)
+        writer.close()
+
+    def test_background_flush(self, tmp_path):
+        db = FileDBSession(tmp_path / 'gallery.db')
+        writer = GalleryWriter(lambda: db, max_delay_s=0.05)
+        try:
+            uid = writer.put('art', 'ansi-escaped')
+            deadline = time.monotonic() + 5
+            while writer.get(uid) is not None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert db.retrieve_art(uid) == 'art'
+        finally:
+            writer.close()
+
+    def test_failing_art_is_dropped(self, mock_db):
+        """ an art the database keeps rejecting doesn't hold up the ones put after it """
+        # a batch that isn't full, so that only these flushes write it
+        writer = GalleryWriter(lambda: mock_db, max_batch=10, max_delay_s=60)
+        uids = [writer.put('good', 'ansi-escaped'), writer.put('bad', None),  # format is required
+                writer.put('good', 'ansi-escaped')]
+        for _ in range(MAX_ATTEMPTS - 1):
+            with pytest.raises(sqlalchemy.exc.IntegrityError):
+                writer.flush()
+        assert writer.flush() == 2
+        assert [mock_db.retrieve_art(uid) for uid in uids] == ['good', None, 'good']
+        assert writer.get(uids[1]) is None
+        writer.close()
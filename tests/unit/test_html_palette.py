@@ -0,0 +1,122 @@
+import io
+import re
+
+from html.parser import HTMLParser
+
+import pytest
+
+from PIL import Image
+
+from pipeline.convert import convert
+from pipeline.html_palette import compact_html
+
+
+class Renderer(HTMLParser):
+    """ resolves each character of html output to the color it's displayed in """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rules = {}
+        self.colors = [None]
+        self.in_style = False
+        self.cells = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'style':
+            self.in_style = True
+        elif tag == 'br':
+            self.cells.append('\n')
+        elif tag == 'span':
+            color = self.colors[-1]
+            style = attrs.get('style')
+            if style:
+                color = self.css_color(style.split(':', 1)[1])
+            if 'class' in attrs:
+                color = self.rules[attrs['class']]
+            self.colors.append(color)
+
+    def handle_endtag(self, tag):
+        if tag == 'style':
+            self.in_style = False
+        elif tag == 'span':
+            self.colors.pop()
+
+    def handle_data(self, data):
+        if self.in_style:
+            for name, color in re.findall(r'\.\w+ \.(\w+)\{color:([^}]+)\}', data):
+                self.rules[name] = self.css_color(color)
+            return
+        for c in data:
+            # blank cells look the same in any color
+            self.cells.append((c, self.colors[-1] if c != '\xa0' else None))
+
+    @staticmethod
+    def css_color(value):
+        value = value.strip()
+        if value.startswith('rgb('):
+            return tuple(int(v) for v in value[4:-1].split(','))
+        value = value[1:]
+        if len(value) == 3:
+            value = ''.join(c * 2 for c in value)
+        return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def render(html):
+    renderer = Renderer()
+    renderer.feed(html)
+    return renderer.cells
+
+
+def make_flat_png():
+    image = Image.new('RGBA', (80, 80), (0, 100, 50, 255))
+    image.paste((255, 0, 0, 255), (10, 10, 40, 40))
+    image.paste((0, 0, 255, 255), (50, 30, 70, 70))
+    png = io.BytesIO()
+    image.save(png, format='PNG')
+    return png.getvalue()
+
+
+@pytest.fixture(params=['photo', 'flat'])
+def html_output(request):
+    if request.param == 'photo':
+        with open('tests/test.png', 'rb') as rf:
+            data = rf.read()
+    else:
+        data = make_flat_png()
+    return convert(data, 'html/css', '█▓▒░ ', 40, 40)
+
+
+class TestCompactHtml():
+
+    def test_renders_identically(self, html_output):
+        compacted = compact_html(html_output)
+        assert render(compacted) == render(html_output)
+        assert len(compacted) < len(html_output) * 0.75
+
+    def test_flat_colors_get_classes(self):
+        html = convert(make_flat_png(), 'html/css', '█▓▒░ ', 40, 40)
+        compacted = compact_html(html)
+        assert compacted.startswith('<style>')
+        body = compacted.split('</style>', 1)[1]
+        # only one-off colors at the shapes' antialiased edges are styled inline
+        assert body.count('class="') > body.count('style="color')
+        assert len(compacted) < len(html) * 0.4
+
+    def test_merges_adjacent_spans(self):
+        red = '<span style="color: rgb(255,0,0)">██</span>'
+        blank = '<span>&nbsp;&nbsp;</span>'
+        html = ('<div style="font-family: monospace; line-height: 1.2;">'
+                + red * 3 + blank + red + '<br/>' + red + '</div>')
+        compacted = compact_html(html)
+        assert render(compacted) == render(html)
+        assert compacted.count('<span') == 2
+
+    def test_unrecognized_input_is_unchanged(self):
+        assert compact_html('\033[38;2;1;2;3m██') == '\033[38;2;1;2;3m██'
+        html = '<div style="font-family: monospace; line-height: 1.2;"><b>hi</b></div>'
+        assert compact_html(html) == html
+
+    def test_convert_format(self):
+        data = make_flat_png()
+        assert convert(data, 'html/classes', '█▓▒░ ', 40, 40) == \
+            compact_html(convert(data, 'html/css', '█▓▒░ ', 40, 40))
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from pipeline.buffers import ImageBuffer
+from pipeline.errors import AnsifierError
+
+
+class TestImageBuffer():
+
+    def test_from_stream(self):
+        """ verify that a streamed image is buffered byte-for-byte """
+        with open('./tests/test.png', 'rb') as rbf:
+            expected = rbf.read()
+        with ImageBuffer.from_stream(io.BytesIO(expected), len(expected), chunk_size=1000) as buf:
+            assert buf.size == len(expected)
+            assert buf.getvalue() == expected
+            assert buf.mime() == 'image/png'
+
+    def test_from_stream_over_limit(self):
+        """ verify that the size limit is enforced before the whole stream is consumed """
+        stream = io.BytesIO(b'x' * 10000)
+        with pytest.raises(AnsifierError) as e:
+            ImageBuffer.from_stream(stream, 100, chunk_size=64)
+        assert e.value.http_code == 400
+        assert stream.tell() < 10000, 'stream should not be read past the limit'
+
+    def test_buffers_are_isolated(self):
+        """ two buffers must never share storage, unlike the old IMAGE_FILEPATH scheme """
+        with ImageBuffer.from_bytes(b'first', 100) as a, ImageBuffer.from_bytes(b'second', 100) as b:
+            assert a.getvalue() == b'first'
+            assert b.getvalue() == b'second'
+
+    def test_werkzeug_stream_factory(self):
+        """ uploads are parsed straight into buffers, and refused as soon as they're too large """
+        from werkzeug.test import EnvironBuilder
+        from werkzeug.formparser import parse_form_data
+
+        def parse(data, max_size_b):
+            environ = EnvironBuilder(method='POST', data={'file': (io.BytesIO(data), 'x.png'),
+                                                          'width': '10'}).get_environ()
+            return parse_form_data(environ, stream_factory=lambda **kw: ImageBuffer(max_size_b))
+
+        with open('./tests/test.png', 'rb') as rbf:
+            expected = rbf.read()
+        _, form, files = parse(expected, len(expected))
+        assert form['width'] == '10'
+        with files['file'].stream as buf:
+            assert isinstance(buf, ImageBuffer)
+            assert buf.getvalue() == expected and buf.mime() == 'image/png'
+        with pytest.raises(AnsifierError):
+            parse(expected, 100)
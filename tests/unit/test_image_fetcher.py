@@ -0,0 +1,66 @@
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pipeline.errors import AnsifierError
+from pipeline.fetcher import ImageFetcher
+
+
+with open('./tests/test.png', 'rb') as rbf:
+    TEST_IMAGE = rbf.read()
+ETAG = '"test-etag"'
+
+
+class ImageOrigin(BaseHTTPRequestHandler):
+    """ serves TEST_IMAGE at any path; /chunked omits Content-Length """
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        if self.path == '/chunked':
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Content-Length', str(len(TEST_IMAGE)))
+        self.end_headers()
+        self.wfile.write(TEST_IMAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    ImageOrigin.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageOrigin)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+class TestImageFetcher():
+
+    def test_fetch_and_revalidate(self, origin):
+        """ a second fetch of the same url revalidates with the ETag and reuses the cached body """
+        fetcher = ImageFetcher(max_size_b=len(TEST_IMAGE), cache_max_bytes=len(TEST_IMAGE))
+        with fetcher.fetch(origin + '/test.png') as buf:
+            assert buf.getvalue() == TEST_IMAGE
+        with fetcher.fetch(origin + '/test.png') as buf:
+            assert buf.getvalue() == TEST_IMAGE
+        assert ImageOrigin.requests_seen == [('/test.png', None), ('/test.png', ETAG)]
+
+    def test_size_cap_without_content_length(self, origin):
+        """ the cap must hold even when the origin doesn't say how big the body is """
+        fetcher = ImageFetcher(max_size_b=len(TEST_IMAGE) - 1, cache_max_bytes=0)
+        with pytest.raises(AnsifierError) as e:
+            fetcher.fetch(origin + '/chunked')
+        assert e.value.http_code == 400
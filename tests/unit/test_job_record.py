@@ -0,0 +1,79 @@
+import time
+
+from sqlalchemy import text
+
+
+class TestJobRecord():
+
+    def test_enqueue_and_claim(self, mock_db):
+        uid = mock_db.enqueue_job(b'input', {'format': 'html/css'}, 'someone', 'user:someone')
+        assert mock_db.get_job(uid, 'someone')['status'] == 'queued'
+        job = mock_db.claim_job('worker-1', lease_s=60)
+        assert job == {'uid': uid, 'input': b'input', 'params': {'format': 'html/css'},
+                       'user': 'someone', 'client': 'user:someone', 'attempts': 1}
+        assert mock_db.get_job(uid, 'someone')['status'] == 'running'
+        assert mock_db.claim_job('worker-2', lease_s=60) is None
+
+    def test_claims_oldest_first(self, mock_db):
+        first = mock_db.enqueue_job(b'1', {})
+        second = mock_db.enqueue_job(b'2', {})
+        assert mock_db.claim_job('worker', lease_s=60)['uid'] == first
+        assert mock_db.claim_job('worker', lease_s=60)['uid'] == second
+
+    def test_expired_lease_is_claimed_again(self, mock_db):
+        uid = mock_db.enqueue_job(b'input', {})
+        mock_db.claim_job('worker-1', lease_s=60)
+        with mock_db.engine.connect() as con:
+            con.execute(text('UPDATE jobs SET updated = :t'), {'t': time.time() - 120})
+            con.commit()
+        job = mock_db.claim_job('worker-2', lease_s=60)
+        assert job['uid'] == uid and job['attempts'] == 2
+        # the first worker no longer holds the job, so it can't end it
+        assert not mock_db.finish_job(uid, 'worker-1', 'art', {})
+        assert mock_db.finish_job(uid, 'worker-2', 'art', {})
+
+    def test_finish_and_fail(self, mock_db):
+        done = mock_db.enqueue_job(b'input', {})
+        failed = mock_db.enqueue_job(b'input', {})
+        mock_db.claim_job('worker', lease_s=60)
+        mock_db.claim_job('worker', lease_s=60)
+        assert mock_db.update_job(done, 'worker', 5)
+        assert mock_db.get_job(done)['progress'] == 5
+        art = 'art' * 1000
+        mock_db.finish_job(done, 'worker', art, {'public-uid': 'x'})
+        mock_db.fail_job(failed, 'worker', 'bad input', 400)
+
+        job = mock_db.retrieve_job_result(done)
+        assert job['status'] == 'done'
+        assert job['result'] == art
+        assert job['headers'] == {'public-uid': 'x'}
+        job = mock_db.retrieve_job_result(failed)
+        assert (job['status'], job['error'], job['error_code']) == ('failed', 'bad input', 400)
+        assert job['result'] is None
+        with mock_db.engine.connect() as con:
+            assert con.execute(text('SELECT COUNT(*) FROM jobs WHERE input IS NOT NULL')).scalar() == 0
+
+    def test_requeue(self, mock_db):
+        uid = mock_db.enqueue_job(b'input', {})
+        mock_db.claim_job('worker', lease_s=60)
+        assert mock_db.requeue_job(uid, 'worker')
+        assert mock_db.get_job(uid)['status'] == 'queued'
+        assert mock_db.claim_job('worker', lease_s=60)['attempts'] == 1
+
+    def test_only_owner_sees_job(self, mock_db):
+        uid = mock_db.enqueue_job(b'input', {}, 'someone')
+        assert mock_db.get_job(uid) is None
+        assert mock_db.get_job(uid, 'someone else') is None
+        assert mock_db.retrieve_job_result(uid) is None
+        anonymous = mock_db.enqueue_job(b'input', {})
+        assert mock_db.get_job(anonymous, 'anyone') is not None
+        assert mock_db.get_job('no such job') is None
+
+    def test_delete_jobs_before(self, mock_db):
+        ended = mock_db.enqueue_job(b'input', {})
+        queued = mock_db.enqueue_job(b'input', {})
+        mock_db.claim_job('worker', lease_s=60)
+        mock_db.finish_job(ended, 'worker', 'art', {})
+        assert mock_db.delete_jobs_before(time.time() + 1) == 1
+        assert mock_db.get_job(ended) is None
+        assert mock_db.get_job(queued) is not None
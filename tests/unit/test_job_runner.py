@@ -0,0 +1,78 @@
+import time
+
+import sqlalchemy
+
+from data_model.base_model import BaseDBSession
+from pipeline.errors import AnsifierError
+from pipeline.jobs import JobRunner
+
+
+class FileDBSession(BaseDBSession):
+    """ unlike an in-memory database, visible to every thread """
+    def __init__(self, path):
+        super().__init__(sqlalchemy.create_engine(f'sqlite:///{path}'))
+
+
+class TestJobRunner():
+
+    def make_runner(self, mock_db, handler, **kwargs):
+        return JobRunner(lambda: mock_db, handler, threads=0, **kwargs)
+
+    def test_runs_job(self, mock_db):
+        def handler(data, params, user, client, progress):
+            assert client == '127.0.0.1'
+            progress(1)
+            progress(2)
+            return data.decode() * 2, {'ansifier-cache': 'miss'}
+
+        uid = mock_db.enqueue_job(b'art', {'format': 'ansi-escaped'}, client='127.0.0.1')
+        runner = self.make_runner(mock_db, handler)
+        assert runner.run_once('worker')
+        assert not runner.run_once('worker')
+        job = mock_db.retrieve_job_result(uid)
+        assert (job['status'], job['progress'], job['result']) == ('done', 2, 'artart')
+        assert job['headers'] == {'ansifier-cache': 'miss'}
+
+    def test_errors_fail_job(self, mock_db):
+        def handler(data, params, user, client, progress):
+            if data == b'bad':
+                raise AnsifierError('not an image', http_code=400)
+            raise RuntimeError('bug')
+
+        bad = mock_db.enqueue_job(b'bad', {})
+        crash = mock_db.enqueue_job(b'crash', {})
+        runner = self.make_runner(mock_db, handler)
+        runner.run_once('worker')
+        runner.run_once('worker')
+        assert mock_db.get_job(bad)['error'] == 'not an image'
+        assert mock_db.get_job(bad)['error_code'] == 400
+        assert mock_db.get_job(crash)['error_code'] == 500
+
+    def test_busy_executor_requeues(self, mock_db):
+        def handler(data, params, user, client, progress):
+            raise AnsifierError('busy', http_code=429)
+
+        uid = mock_db.enqueue_job(b'input', {})
+        assert not self.make_runner(mock_db, handler).run_once('worker')
+        assert mock_db.get_job(uid)['status'] == 'queued'
+
+    def test_gives_up_after_max_attempts(self, mock_db):
+        uid = mock_db.enqueue_job(b'input', {})
+        for _ in range(2):  # claimed by workers that never came back
+            mock_db.claim_job('worker', lease_s=-1)
+        self.make_runner(mock_db, None, max_attempts=2, lease_s=-1).run_once('worker')
+        assert mock_db.get_job(uid)['status'] == 'failed'
+
+    def test_threads(self, tmp_path):
+        db = FileDBSession(tmp_path / 'jobs.db')
+        uid = db.enqueue_job(b'input', {})
+        runner = JobRunner(lambda: db, lambda *args: ('art', {}), threads=2, poll_s=0.01)
+        runner.start()
+        try:
+            deadline = time.monotonic() + 5
+            while db.get_job(uid)['status'] != 'done' and time.monotonic() < deadline:
+                time.sleep(0.01)
+                db.remove_sessions()
+        finally:
+            runner.stop(timeout=5)
+        assert db.retrieve_job_result(uid)['result'] == 'art'
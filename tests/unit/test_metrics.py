@@ -0,0 +1,70 @@
+import time
+
+from pipeline.metrics import Metrics, RequestTimings, UntimedStage
+
+
+class TestRequestTimings():
+
+    def test_stages_add_up(self):
+        timings = RequestTimings()
+        with timings.stage('validate'):
+            time.sleep(0.01)
+        with timings.stage('save') as stage:
+            stage.count(1000)
+        with timings.stage('validate') as stage:
+            time.sleep(0.01)
+            stage.count_text('██')
+        assert list(timings.stages) == ['validate', 'save']
+        assert timings.stages['validate'].seconds >= 0.02
+        assert timings.stages['validate'].bytes == 6
+        assert timings.stages['save'].bytes == 1000
+
+    def test_server_timing(self):
+        timings = RequestTimings()
+        with timings.stage('validate'):
+            pass
+        with timings.stage('save') as stage:
+            stage.count(1000)
+        validate, save = timings.server_timing().split(', ')
+        assert validate.startswith('validate;dur=')
+        assert save.startswith('save;dur=') and save.endswith(';desc="1000 B"')
+
+    def test_stage_timed_on_error(self):
+        timings = RequestTimings()
+        try:
+            with timings.stage('convert'):
+                time.sleep(0.01)
+                raise ValueError()
+        except ValueError:
+            pass
+        assert timings.stages['convert'].seconds >= 0.01
+
+    def test_untimed_stage_counts_nothing(self):
+        stage = UntimedStage()
+        stage.count(1000)
+        stage.count_text('abc')
+        assert stage.bytes == 0
+
+
+class TestMetrics():
+
+    def test_render(self):
+        metrics = Metrics(buckets=(0.1, 1))
+        for seconds, n_bytes in [(0.05, 10), (0.5, 20), (5, 30)]:
+            timings = RequestTimings()
+            with timings.stage('convert') as stage:
+                stage.count(n_bytes)
+            timings.stages['convert'].seconds = seconds
+            metrics.observe(timings)
+        lines = metrics.render().splitlines()
+        assert 'ansifier_stage_seconds_bucket{stage="convert",le="0.1"} 1' in lines
+        assert 'ansifier_stage_seconds_bucket{stage="convert",le="1"} 2' in lines
+        assert 'ansifier_stage_seconds_bucket{stage="convert",le="+Inf"} 3' in lines
+        assert 'ansifier_stage_seconds_sum{stage="convert"} 5.55' in lines
+        assert 'ansifier_stage_seconds_count{stage="convert"} 3' in lines
+        assert 'ansifier_stage_bytes_total{stage="convert"} 60' in lines
+        assert '# TYPE ansifier_stage_seconds histogram' in lines
+
+    def test_render_startup(self):
+        metrics = Metrics(startup_seconds={'import': 0.5})
+        assert 'ansifier_startup_seconds{phase="import"} 0.5' in metrics.render().splitlines()
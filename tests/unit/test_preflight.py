@@ -0,0 +1,79 @@
+import io
+
+import pytest
+
+from PIL import Image
+
+from pipeline.buffers import ImageBuffer
+from pipeline.convert import convert
+from pipeline.preflight import draft_scale, frame_bytes, inspect_input, plan_decode
+
+
+def encode(images, format_):
+    encoded = io.BytesIO()
+    images[0].save(encoded, format=format_, save_all=len(images) > 1, append_images=images[1:])
+    return encoded.getvalue()
+
+
+def inspect(data):
+    with ImageBuffer.from_bytes(data, len(data)) as image:
+        return inspect_input(image)
+
+
+class TestPreflight():
+
+    def test_inspect_input(self):
+        """ the format comes from the data itself, and pixels aren't decoded to read the header """
+        info = inspect(encode([Image.new('L', (9000, 9000))], 'PNG'))
+        assert (info.format, info.size, info.mode, info.frames) == ('PNG', (9000, 9000), 'L', 1)
+        info = inspect(encode([Image.new('RGB', (30, 20), (40 * n, 0, 0)) for n in range(5)], 'GIF'))
+        assert (info.format, info.size, info.frames) == ('GIF', (30, 20), 5)
+        with pytest.raises(ValueError, match='unable to recognize'):
+            inspect(b'<html>not an image</html>')
+        with pytest.raises(ValueError, match='too large'):
+            inspect(encode([Image.new('1', (20000, 20000))], 'PNG'))
+
+    def test_plan_decode(self):
+        png = inspect(encode([Image.new('L', (9000, 9000))], 'PNG'))
+        assert frame_bytes(png.size, png.mode) == 9000 * 9000 * 5
+        assert not plan_decode(png, 1, (50, 100), 0), 'no budget, no limit'
+        with pytest.raises(ValueError, match='405 MB, more than the 256 MB'):
+            plan_decode(png, 1, (50, 100), 256_000_000)
+
+        jpeg = inspect(encode([Image.new('RGB', (6000, 4000))], 'JPEG'))
+        assert draft_scale(jpeg.size, (50, 100)) == 8
+        assert draft_scale(jpeg.size, (6000, 4000)) == 1
+        assert not plan_decode(jpeg, 1, (50, 100), 256_000_000)
+        assert plan_decode(jpeg, 1, (50, 100), 100_000_000), 'over budget, but can be drafted'
+        with pytest.raises(ValueError):
+            plan_decode(jpeg, 1, (6000, 4000), 100_000_000)
+
+        gif = inspect(encode([Image.new('RGB', (30, 20), (40 * n, 0, 0)) for n in range(5)], 'GIF'))
+        assert not plan_decode(gif, 100, (50, 100), 256_000_000, max_frames=5)
+        with pytest.raises(ValueError, match='decoding 5 frames'):
+            plan_decode(gif, 100, (50, 100), 256_000_000, max_frames=4)
+
+    def test_video(self, tmp_path):
+        """ videos' dimensions and frame counts come from their containers, and are held to budget """
+        cv2 = pytest.importorskip('cv2')
+        import numpy as np
+        path = str(tmp_path / 'input.avi')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+        for n in range(12):
+            writer.write(np.full((48, 64, 3), 20 * n, np.uint8))
+        writer.release()
+        with open(path, 'rb') as rf:
+            info = inspect(rf.read())
+        assert info.video
+        assert (info.size, info.mode, info.frames) == ((64, 48), 'RGB', 12)
+        assert not plan_decode(info, 100, (50, 100), 256_000_000, max_frames=12)
+        with pytest.raises(ValueError, match='decoding 12 frames'):
+            plan_decode(info, 100, (50, 100), 256_000_000, max_frames=11)
+        with pytest.raises(ValueError, match='more than the 0.01 MB'):
+            plan_decode(info, 1, (50, 100), 10_000)
+
+    def test_drafted_conversion(self):
+        """ an input planned to be drafted is converted at the same size as without """
+        data = encode([Image.new('RGB', (1600, 1200), (200, 40, 40))], 'JPEG')
+        drafted = convert(data, 'ansi-escaped', '█▓▒░ ', 60, 60, predecode=True)
+        assert drafted.count('\n') == convert(data, 'ansi-escaped', '█▓▒░ ', 60, 60).count('\n')
@@ -0,0 +1,46 @@
+import io
+
+import numpy as np
+
+from PIL import Image
+
+from pipeline.frames import prepare_frame
+
+
+def make_image(format_, mode, size=(1600, 1200)):
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    pixels = np.stack([x % 256, y % 256, (x + y) // 8 % 256], -1).astype(np.uint8)
+    image = Image.fromarray(pixels).convert(mode)
+    encoded = io.BytesIO()
+    image.save(encoded, format=format_)
+    return encoded.getvalue()
+
+
+def prepare(data, predecode):
+    return prepare_frame(Image.open(io.BytesIO(data)), 100, 100, predecode=predecode)
+
+
+class TestPrepareFrame():
+
+    def test_predecode_is_close(self):
+        """ shrinking first gives the same size and nearly the same colors """
+        for format_, mode in [('JPEG', 'RGB'), ('JPEG', 'L'), ('PNG', 'RGB')]:
+            data = make_image(format_, mode)
+            (size, pixels), (predecoded_size, predecoded) = prepare(data, False), prepare(data, True)
+            assert size == predecoded_size == (50, 38)
+            difference = np.abs(np.frombuffer(pixels, np.uint8).astype(int)
+                                - np.frombuffer(predecoded, np.uint8))
+            assert difference.mean() < 2
+
+    def test_jpeg_is_drafted(self):
+        image = Image.open(io.BytesIO(make_image('JPEG', 'RGB')))
+        prepare_frame(image, 100, 100, predecode=True)
+        assert image.size == (50, 38)
+        assert image.tile == [], 'decoded by thumbnail, at a reduced scale'
+
+    def test_other_modes_are_unchanged(self):
+        with open('./tests/test.png', 'rb') as rbf:
+            rgba = rbf.read()
+        assert prepare(rgba, True) == prepare(rgba, False)
+        palette = make_image('GIF', 'P', (300, 200))
+        assert prepare(palette, True) == prepare(palette, False)
@@ -0,0 +1,30 @@
+import importlib
+
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+
+def client_of(app, remote_addr, forwarded_for=None):
+    """ :return: request_client of a request that went through the app's middleware """
+    headers = {'X-Forwarded-For': forwarded_for} if forwarded_for else {}
+    environ = EnvironBuilder(path='/no-such-page', headers=headers,
+                             environ_base={'REMOTE_ADDR': remote_addr}).get_environ()
+    app.app.wsgi_app(environ, lambda *args: None)
+    return app.request_client(Request(environ), None)
+
+
+class TestRequestClient():
+
+    def test_forwarded_addresses(self, tmp_path, monkeypatch):
+        """ anonymous clients behind the same proxy each get their own share of the workers """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('ANSIFIER_LAZY_STARTUP', '1')
+        monkeypatch.setenv('ANSIFIER_PROXY_HOPS', '1')
+        app = importlib.import_module('app')
+        proxy = '169.254.1.1'
+        assert client_of(app, proxy, '203.0.113.5') == '203.0.113.5'
+        assert client_of(app, proxy, '198.51.100.7') == '198.51.100.7'
+        assert client_of(app, proxy, '10.9.9.9, 198.51.100.7') == '198.51.100.7', \
+            'only the trusted proxy is believed, not what the client claims'
+        assert client_of(app, proxy) == proxy
+        assert app.request_client(None, 'someone') == 'user:someone'
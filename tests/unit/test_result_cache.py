@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from pipeline.result_cache import ResultCache, make_key
+
+
+class TestResultCache():
+
+    def test_make_key_normalizes_params(self):
+        """ parameter order must not matter, parameter values must """
+        a = make_key('abc', format='ansi-escaped', width=10, height=20)
+        b = make_key('abc', height=20, width=10, format='ansi-escaped')
+        c = make_key('abc', format='html/css', width=10, height=20)
+        assert a == b
+        assert a != c
+
+    def test_hit_after_miss(self):
+        cache = ResultCache(max_bytes=1000)
+        assert cache.get_or_compute('k', lambda: 'art') == ('art', 'miss')
+        assert cache.get_or_compute('k', lambda: 'other') == ('art', 'hit')
+        stats = cache.stats()
+        assert stats['misses'] == 1 and stats['memory_hits'] == 1
+
+    def test_get_and_put(self, tmp_path):
+        """ results produced outside get_or_compute, e.x. streamed ones, are cached with put """
+        cache = ResultCache(max_bytes=1000, disk_dir=str(tmp_path), disk_max_bytes=1000)
+        assert cache.get('k') is None
+        cache.put('k', 'art')
+        assert cache.get('k') == 'art'
+        assert cache.get_or_compute('k', lambda: 'other') == ('art', 'hit')
+        assert ResultCache(max_bytes=1000, disk_dir=str(tmp_path)).get('k') == 'art'
+
+    def test_lru_eviction(self):
+        """ the least recently used entry goes first once the byte budget is exceeded """
+        cache = ResultCache(max_bytes=10)
+        cache.get_or_compute('a', lambda: 'aaaa')
+        cache.get_or_compute('b', lambda: 'bbbb')
+        cache.get_or_compute('a', lambda: 'aaaa')  # touch a so b is least recent
+        cache.get_or_compute('c', lambda: 'cccc')
+        assert cache.get_or_compute('a', lambda: 'new')[1] == 'hit'
+        assert cache.get_or_compute('b', lambda: 'new') == ('new', 'miss')
+        assert cache.stats()['bytes'] <= 10
+
+    def test_errors_are_not_cached(self):
+        cache = ResultCache(max_bytes=1000)
+        def fail():
+            raise ValueError('bad image')
+        with pytest.raises(ValueError):
+            cache.get_or_compute('k', fail)
+        assert cache.get_or_compute('k', lambda: 'art') == ('art', 'miss')
+
+    def test_single_flight(self):
+        """ concurrent lookups of one key must run the computation exactly once """
+        cache = ResultCache(max_bytes=1000)
+        calls = []
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'art'
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', slow)))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(calls) == 1
+        assert all(result == 'art' for result, _ in results)
+        assert sorted(status for _, status in results) == ['collapsed'] * 4 + ['miss']
+
+    def test_disk_tier(self, tmp_path):
+        """ results survive the memory tier via disk, which is evicted oldest first """
+        cache = ResultCache(max_bytes=1000, disk_dir=str(tmp_path), disk_max_bytes=10)
+        cache.get_or_compute('a', lambda: 'aaaa')
+        fresh = ResultCache(max_bytes=1000, disk_dir=str(tmp_path), disk_max_bytes=10)
+        assert fresh.get_or_compute('a', lambda: 'new') == ('aaaa', 'hit')
+        assert fresh.stats()['disk_hits'] == 1
+        fresh.get_or_compute('b', lambda: 'bbbbbbbb')
+        assert len(list(tmp_path.iterdir())) == 1
+
+    def test_disk_size_is_tallied(self, tmp_path, monkeypatch):
+        """ the disk tier is only scanned when it's seeded and when it's over budget """
+        ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=100).put('a', 'a' * 40)
+        cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=100)
+        scans = []
+        entries = cache._disk_entries
+        monkeypatch.setattr(cache, '_disk_entries', lambda: scans.append(1) or entries())
+        cache.put('b', 'b' * 40)
+        cache.put('b', 'b' * 50)  # replacing an entry only counts the difference
+        assert not scans
+        cache.put('c', 'c' * 20)
+        assert len(scans) == 1
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['b', 'c']
+        assert cache._disk_size == 70
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from pipeline.errors import AnsifierError
+from pipeline.executor import ConversionExecutor
+from pipeline.scheduler import Admission, ClientBuckets, FairQueue, estimate_cost
+
+
+class TestScheduler():
+
+    def test_estimate_cost(self):
+        assert estimate_cost(0, 100, 50) == 50 * 50
+        assert estimate_cost(0, 100, 50, frames=10) == 10 * estimate_cost(0, 100, 50)
+        assert estimate_cost(2000, 4, 4) > estimate_cost(1000, 4, 4)
+
+    def test_client_buckets(self):
+        buckets = ClientBuckets(rate=10, burst=100)
+        assert buckets.take('a', 60) == 0
+        wait_s = buckets.take('a', 60)
+        assert 1.5 < wait_s <= 2, 'about 20 short, at 10 a second'
+        assert buckets.take('b', 60) == 0, 'every client has its own bucket'
+        buckets.refund('a', 60)
+        assert buckets.take('a', 1000) == 0, 'more than the burst goes through when the bucket is full'
+        assert buckets.take('a', 1) > 0
+        assert ClientBuckets(rate=0, burst=0).take('a', 1e12) == 0
+
+    def test_fair_queue_order(self):
+        """ a small request goes ahead of another client's backlog of large ones """
+        queue = FairQueue(running=1, depth=10)
+        assert queue.acquire(Admission('heavy', 100))
+        served = []
+
+        def request(client, cost):
+            queue.acquire(Admission(client, cost))
+            served.append(client)
+            queue.release()
+
+        threads = [threading.Thread(target=request, args=('heavy', 100)) for _ in range(3)]
+        threads.append(threading.Thread(target=request, args=('light', 1)))
+        for n, thread in enumerate(threads):
+            thread.start()
+            while len(queue) < n + 1:
+                time.sleep(0.001)
+        queue.release()
+        for thread in threads:
+            thread.join()
+        assert served == ['light', 'heavy', 'heavy', 'heavy']
+        assert queue.in_use == 0
+
+    def test_fair_queue_depth(self):
+        queue = FairQueue(running=1, depth=0)
+        assert queue.acquire(Admission())
+        assert not queue.acquire(Admission()), 'no room to wait'
+        queue.release()
+        assert queue.acquire(Admission())
+
+    def test_executor_limits_clients(self):
+        executor = ConversionExecutor(workers=0, queue_depth=0, client_rate=100, client_burst=1000)
+        assert executor.run(lambda: 'admitted', admission=Admission('a', 1000)) == 'admitted'
+        with pytest.raises(AnsifierError) as e:
+            executor.run(lambda: 'admitted', admission=Admission('a', 500))
+        assert e.value.http_code == 429
+        assert int(e.value.headers['Retry-After']) == 5
+        assert executor.run(lambda: 'admitted', admission=Admission('b', 500)) == 'admitted'
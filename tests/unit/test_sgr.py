@@ -0,0 +1,81 @@
+import pytest
+
+from pipeline.sgr import SGR, minimize_sgr, quantize_256
+
+
+def render(text):
+    """ :return: (every printed character with the colors it was printed in, final colors) """
+    state = {'fg': None, 'bg': None}
+    cells = []
+    position = 0
+    for match in list(SGR.finditer(text)) + [None]:
+        segment = text[position:match.start() if match else len(text)]
+        for c in segment:
+            # spaces and newlines only show the background
+            cells.append((c, state['fg'] if c not in ' \n' else None, state['bg']))
+        if match is None:
+            break
+        position = match.end()
+        codes = match.group(1).split(';') if match.group(1) else ['0']
+        while codes:
+            code = codes.pop(0)
+            if code == '0':
+                state = {'fg': None, 'bg': None}
+            elif code in ('38', '48'):
+                n = 4 if codes[0] == '2' else 2
+                state['fg' if code == '38' else 'bg'] = tuple(codes[:n])
+                codes = codes[n:]
+            elif code == '39':
+                state['fg'] = None
+            elif code == '49':
+                state['bg'] = None
+            else:
+                state['other'] = code
+    return cells, state
+
+
+@pytest.fixture(params=['file', 'url'])
+def expected_output(request):
+    with open(f'tests/static/test_ansify_{request.param}_expected.txt', 'r') as rf:
+        return rf.read()
+
+
+class TestMinimizeSGR():
+
+    def test_renders_identically(self, expected_output):
+        optimized = minimize_sgr(expected_output)
+        assert render(optimized) == render(expected_output)
+        assert len(optimized) <= len(expected_output)
+
+    def test_drops_redundant_escapes(self):
+        red = '\033[38;2;255;0;0m'
+        text = red + '██' + red + '██' + red + '  ' + red + '██\n' + '\033[38;2;255;255;255m'
+        optimized = minimize_sgr(text)
+        assert optimized == red + '████  ██\n' + '\033[38;2;255;255;255m'
+        assert render(optimized) == render(text)
+
+    def test_merges_foreground_and_background(self):
+        text = '\033[38;2;1;2;3m\033[48;2;4;5;6mab\033[0m'
+        optimized = minimize_sgr(text)
+        assert optimized == '\033[38;2;1;2;3;48;2;4;5;6mab\033[0m'
+        assert render(optimized) == render(text)
+
+    def test_quantizes_to_256_colors(self, expected_output):
+        optimized = minimize_sgr(expected_output, 256)
+        assert '38;2;' not in optimized
+        assert len(optimized) < len(expected_output) * 0.7
+        assert [c for c, _, _ in render(optimized)[0]] == \
+            [c for c, _, _ in render(expected_output)[0]]
+
+    def test_passes_through_unknown_escapes(self):
+        text = '\033[38;2;1;2;3mab\033[1mcd\033[38;2;1;2;3mef'
+        optimized = minimize_sgr(text)
+        assert '\033[1m' in optimized
+        assert render(optimized) == render(text)
+
+
+def test_quantize_256():
+    assert quantize_256(0, 0, 0) == 16
+    assert quantize_256(255, 255, 255) == 231
+    assert quantize_256(255, 0, 0) == 196
+    assert quantize_256(128, 128, 128) == 244
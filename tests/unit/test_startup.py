@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HEAVY_MODULES = ['sqlalchemy', 'ansifier', 'numpy', 'cv2', 'requests', 'validators',
+                 'data_model.gcp_mysql_model']
+
+
+def imported_after_app(tmp_path, **env):
+    """ imports app.py in a fresh interpreter, :return: which of HEAVY_MODULES it imported """
+    script = ('import sys; sys.path.insert(0, sys.argv[1]); import app; '
+              f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    result = subprocess.run(
+        [sys.executable, '-c', script, REPO_ROOT], cwd=tmp_path, capture_output=True, text=True,
+        env={**os.environ, 'ANSIFIER_DATABASE': 'Sqlite3', 'ANSIFIER_LAZY_STARTUP': '', **env})
+    assert result.returncode == 0, result.stderr
+    return set(filter(None, result.stdout.strip().split(',')))
+
+
+class TestStartup():
+
+    def test_only_selected_backend_imported(self, tmp_path):
+        assert imported_after_app(tmp_path) == {'sqlalchemy'}
+
+    def test_lazy_startup_defers_heavy_imports(self, tmp_path):
+        assert imported_after_app(tmp_path, ANSIFIER_LAZY_STARTUP='1') == set()
+        assert not (tmp_path / 'test.db').exists()
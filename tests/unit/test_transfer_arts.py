@@ -0,0 +1,28 @@
+import io
+import json
+
+from transfer_arts import export_arts, import_arts
+
+
+class TestTransferArts():
+
+    def test_round_trip(self, mock_db):
+        with open('./tests/static/test_ansify_url_expected.txt', 'r') as rf:
+            ansi_art = rf.read()
+        uids = [mock_db.insert_art(ansi_art, 'ansi-escaped'),
+                mock_db.insert_art('█▓▒░', 'ansi-escaped', 'someuser'),
+                mock_db.insert_art('<b>hi</b>', 'html/css')]
+
+        out = io.StringIO()
+        assert export_arts(mock_db, out, chunk_size=2) == 3
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 3 and all(json.loads(line)['uid'] in uids for line in lines)
+
+        destination = type(mock_db)()  # another in-memory database
+        reported = []
+        assert import_arts(destination, lines, batch_size=2, report=reported.append) == 3
+        assert reported == [2, 3]
+        assert list(destination.iter_arts()) == list(mock_db.iter_arts())
+
+        # an import picks up where it left off
+        assert import_arts(destination, lines, skip_existing=True) == 0
@@ -0,0 +1,95 @@
+"""
+Streams the gallery out of or into a database backend as NDJSON, one art per line.
+
+    python3 transfer_arts.py export --database Sqlite3 --output arts.ndjson
+    python3 transfer_arts.py import --database Gcp --input arts.ndjson
+    python3 transfer_arts.py export --database Sqlite3 | python3 transfer_arts.py import --database Gcp
+
+Each line is a JSON object with an art's uid, format, timestamp, user (null for public arts), size,
+and the art itself, so arts keep their uids, owners, and places in the feeds when imported.
+Arts are read a chunk at a time (see BaseDBSession.iter_arts) and written in batches
+(see BaseDBSession.insert_arts), so neither side ever holds more than a chunk of the gallery in
+memory. Exports can be resumed with --after, the uid of the last art exported, and imports with
+--skip-existing. Only the gallery is transferred; user accounts are not.
+The backend is chosen like the app chooses it, by --database or ANSIFIER_DATABASE, along with its
+blob store and art codec settings, see README.md.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from itertools import islice
+
+
+def export_arts(db, out, chunk_size: int = 100, after=None) -> int:
+    """ writes every art in db to the text file out, :return: how many """
+    n = 0
+    for art in db.iter_arts(chunk_size=chunk_size, after=after):
+        out.write(json.dumps(art, ensure_ascii=False) + '\n')
+        n += 1
+    return n
+
+
+def import_arts(db, lines, batch_size: int = 100, skip_existing: bool = False,
+                report=None) -> int:
+    """
+    inserts the arts in an iterable of NDJSON lines into db
+    :param report: optional, called with the number of arts inserted so far after each batch
+    :return: how many were inserted
+    """
+    arts = (json.loads(line) for line in lines if line.strip())
+    n = 0
+    while batch := list(islice(arts, batch_size)):
+        n += len(db.insert_arts([{key: art.get(key)
+                                  for key in ('uid', 'art', 'format', 'user', 'timestamp')}
+                                 for art in batch],
+                                batch_size=batch_size, skip_existing=skip_existing))
+        if report is not None:
+            report(n)
+    return n
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('--database', help='backend to use, like ANSIFIER_DATABASE')
+    parser.add_argument('--input', help='NDJSON to import (default stdin)')
+    parser.add_argument('--output', help='where to export to (default stdout)')
+    parser.add_argument('--chunk-size', type=int, default=100,
+                        help='arts read or written per query (default 100)')
+    parser.add_argument('--after', help='export: only arts whose uid sorts after this one')
+    parser.add_argument('--skip-existing', action='store_true',
+                        help='import: leave out arts whose uid is taken instead of failing')
+    args = parser.parse_args(argv)
+
+    if args.database:
+        os.environ['ANSIFIER_DATABASE'] = args.database
+    from data_model import Database  # picks the backend from the environment on import
+
+    db = Database()
+    started = time.perf_counter()
+    if args.command == 'export':
+        out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            n = export_arts(db, out, args.chunk_size, args.after)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f'exported {n} arts in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    else:
+        lines = open(args.input, 'r', encoding='utf-8') if args.input else sys.stdin
+        try:
+            n = import_arts(db, lines, args.chunk_size, args.skip_existing,
+                            report=lambda n: print(f'imported {n} arts', file=sys.stderr))
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+        print(f'imported {n} arts in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    db.remove_sessions()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())